@@ -0,0 +1,84 @@
+"""
+Concurrent primary key lookups from several reader threads while a single
+writer thread inserts rows, comparing a new connection per operation with the
+generated ConnectionPool under the rollback journal and WAL profiles.
+
+    python benchmarks/bench_concurrency.py [readers] [seconds]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from common import create_db, generate_models
+
+ROWS = 10000
+
+
+def run(models, get_conn: Callable[[], Any], readers: int, seconds: float):
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def reader(n: int):
+        i = 0
+        while not stop.is_set():
+            conn = get_conn()
+            models.ASequenceMulti.by_a_seq(conn.cursor(), i % ROWS + 1)
+            reads[n] += 1
+            i += 7919
+
+    def writer():
+        while not stop.is_set():
+            conn = get_conn()
+            with conn:
+                models.ASequenceMulti(a_text="write").insert(conn.cursor())
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(reads) / seconds, writes[0] / seconds
+
+
+def main(readers: int, seconds: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        models = None
+        modes = ["connect per operation", "pool (rollback journal)", "pool (wal)"]
+        for i, mode in enumerate(modes):
+            # the journal mode is persistent, so each mode gets a fresh database
+            dbfile = tmpdir / f"bench{i}.db"
+            create_db(dbfile)
+            if models is None:
+                models = generate_models(dbfile, tmpdir, "concurrency_models")
+            with sqlite3.connect(dbfile) as conn:
+                rows = [models.ASequenceMulti(a_text=str(i)) for i in range(ROWS)]
+                models.ASequenceMulti.insert_many(conn.cursor(), rows)
+
+            if mode == "connect per operation":
+
+                def get_conn():
+                    return sqlite3.connect(dbfile, timeout=5)
+
+                res = run(models, get_conn, readers, seconds)
+            else:
+                profile = "wal" if "wal" in mode else "default"
+                with models.utils.ConnectionPool(str(dbfile), profile) as pool:
+                    res = run(models, pool.connection, readers, seconds)
+            print(f"{mode:24} {res[0]:10.0f} reads/s {res[1]:8.0f} writes/s")
+
+
+if __name__ == "__main__":
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    main(readers, seconds)
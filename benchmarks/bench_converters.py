@@ -0,0 +1,84 @@
+"""
+Rows per second read by get() from a time series table with a DATETIME column,
+comparing converting values in the models with registering sqlite3 converters,
+each with and without the LRU cache for repeated timestamps.
+
+    python benchmarks/bench_converters.py [rows] [distinct timestamps]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from common import generate_models
+from pianola.generate.options import Options
+
+SCHEMA = """
+CREATE TABLE series (
+  id INTEGER NOT NULL PRIMARY KEY,
+  ts DATETIME NOT NULL,
+  value REAL NOT NULL
+);
+"""
+
+MODES = {
+    "python": Options(),
+    "python+cache": Options(converter_cache=4096),
+    "sqlite": Options(converters="sqlite"),
+    "sqlite+cache": Options(converters="sqlite", converter_cache=4096),
+}
+
+
+def create_db(dbfile: Path, nrows: int, distinct: int):
+    start = datetime(2024, 1, 1)
+    with sqlite3.connect(dbfile) as conn:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO series(ts, value) VALUES (?, ?)",
+            (
+                ((start + timedelta(minutes=i % distinct)).isoformat(), i * 0.5)
+                for i in range(nrows)
+            ),
+        )
+
+
+def measure(models, conn: sqlite3.Connection, nrows: int) -> float:
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    n = 0
+    for row in models.Series.get(cursor):
+        n += 1
+    elapsed = time.perf_counter() - start
+    assert n == nrows and isinstance(row.ts, datetime)
+    return nrows / elapsed
+
+
+def main(nrows: int, distinct: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        dbfile = tmpdir / "bench.db"
+        create_db(dbfile, nrows, distinct)
+
+        print(f"rows:         {nrows} ({distinct} distinct timestamps)")
+        for i, (mode, options) in enumerate(MODES.items()):
+            models = generate_models(dbfile, tmpdir, f"models_{i}", options)
+            if options.converters == "sqlite":
+                # converters are registered globally, so the last generated
+                # package would otherwise win
+                models.converters.register_converters()
+                conn = sqlite3.connect(dbfile, detect_types=sqlite3.PARSE_DECLTYPES)
+            else:
+                conn = sqlite3.connect(dbfile)
+            with conn:
+                rate = measure(models, conn, nrows)
+            print(f"{mode + ':':<13} {rate:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1440,
+    )
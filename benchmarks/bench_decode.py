@@ -0,0 +1,89 @@
+"""
+Rows per second decoded by get() on the a_bit_of_everything table, compared
+with fetching the raw tuples through the same cursor and with constructing
+the models through the keyword arguments of __init__, as get() did before
+_from_row.
+
+    python benchmarks/bench_decode.py [rows]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import create_db, generate_models, make_row
+from pianola.analyse import analyse
+from pianola.generate.options import Options
+
+
+def rate(fn, nrows: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n = sum(1 for _ in fn())
+        best = min(best, time.perf_counter() - start)
+        assert n == nrows
+    return nrows / best
+
+
+def kwargs_get(dbfile: Path, models):
+    # the constructor call query_construct generates for partial results,
+    # evaluated where the converters it names are defined
+    table = analyse("sqlite://" + str(dbfile)).find_table("a_bit_of_everything", False)
+    fields = ", ".join(
+        c.pyname + " = " + c.val_from_sql(f"row[{i}]")
+        for i, c in enumerate(table.columns)
+    )
+    construct = eval(
+        "lambda row: " + table.pyname + "(" + fields + ")._mark_clean()",
+        vars(models.a_bit_of_everything),
+    )
+    stmt = (
+        "SELECT "
+        + ", ".join(c.sqlname for c in table.columns)
+        + " FROM "
+        + table.sqlname
+    )
+
+    def get(cursor):
+        cursor.execute(stmt)
+        while rows := cursor.fetchmany(models.utils.FETCH_BATCH_SIZE):
+            for row in rows:
+                yield construct(row)
+
+    return get
+
+
+def main(nrows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        dbfile = tmpdir / "bench.db"
+        create_db(dbfile)
+
+        default = generate_models(dbfile, tmpdir, "default_models")
+        slots = generate_models(dbfile, tmpdir, "slots_models", Options(slots=True))
+        get = kwargs_get(dbfile, default)
+
+        with sqlite3.connect(dbfile) as conn:
+            cursor = conn.cursor()
+            rows = [make_row(default, i) for i in range(nrows)]
+            default.ABitOfEverything.insert_many(cursor, rows)
+
+            raw = rate(
+                lambda: cursor.execute("SELECT * FROM a_bit_of_everything"), nrows
+            )
+            kwargs = rate(lambda: get(cursor), nrows)
+            plain = rate(lambda: default.ABitOfEverything.get(cursor), nrows)
+            slotted = rate(lambda: slots.ABitOfEverything.get(cursor), nrows)
+
+        print(f"rows:    {nrows}")
+        print(f"raw:     {raw:,.0f} rows/s")
+        print(f"kwargs:  {kwargs:,.0f} rows/s")
+        print(f"default: {plain:,.0f} rows/s")
+        print(f"slots:   {slotted:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,50 @@
+"""
+Per-row memory footprint of models loaded from the a_bit_of_everything table,
+comparing the default model classes with the __slots__ generation mode.
+
+    python benchmarks/bench_memory.py [rows]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from common import create_db, generate_models, make_row
+from pianola.generate.options import Options
+
+
+def measure(models, dbfile: Path) -> float:
+    with sqlite3.connect(dbfile) as conn:
+        cursor = conn.cursor()
+        tracemalloc.start()
+        rows = list(models.ABitOfEverything.get(cursor))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return size / len(rows)
+
+
+def main(nrows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        dbfile = tmpdir / "bench.db"
+        create_db(dbfile)
+
+        default = generate_models(dbfile, tmpdir, "default_models")
+        slots = generate_models(dbfile, tmpdir, "slots_models", Options(slots=True))
+
+        with sqlite3.connect(dbfile) as conn:
+            cursor = conn.cursor()
+            rows = [make_row(default, i) for i in range(nrows)]
+            default.ABitOfEverything.insert_many(cursor, rows)
+
+        before = measure(default, dbfile)
+        after = measure(slots, dbfile)
+        print(f"rows:    {nrows}")
+        print(f"default: {before:.0f} bytes/row")
+        print(f"slots:   {after:.0f} bytes/row ({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,61 @@
+"""
+Insert throughput of the generated insert method in autocommit mode, with a
+commit per row, with the generated batch_commit helper and in a single
+transaction, on a WAL database.
+
+    python benchmarks/bench_transactions.py [rows] [every]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import create_db, generate_models
+
+
+def main(rows: int, every: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = Path(tmp)
+        models = None
+        modes = [
+            "autocommit",
+            "commit per row",
+            f"batch_commit({every})",
+            "single transaction",
+        ]
+        for i, mode in enumerate(modes):
+            dbfile = tmpdir / f"bench{i}.db"
+            create_db(dbfile)
+            if models is None:
+                models = generate_models(dbfile, tmpdir, "transaction_models")
+            utils = models.utils
+
+            conn = utils.connect(str(dbfile), "wal", isolation_level=None)
+            cursor = conn.cursor()
+            start = time.perf_counter()
+            if mode == "autocommit":
+                for n in range(rows):
+                    models.ASequenceMulti(a_text=str(n)).insert(cursor)
+            elif mode == "commit per row":
+                for n in range(rows):
+                    with utils.transaction(conn):
+                        models.ASequenceMulti(a_text=str(n)).insert(cursor)
+            elif mode == "single transaction":
+                with utils.transaction(conn):
+                    for n in range(rows):
+                        models.ASequenceMulti(a_text=str(n)).insert(cursor)
+            else:
+                with utils.batch_commit(conn, every=every) as batch:
+                    for n in range(rows):
+                        models.ASequenceMulti(a_text=str(n)).insert(cursor)
+                        batch.add()
+            elapsed = time.perf_counter() - start
+            conn.close()
+            print(f"{mode:20} {rows / elapsed:10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    every = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    main(rows, every)
@@ -0,0 +1,46 @@
+import importlib
+import os
+import sqlite3
+import sys
+from datetime import date, datetime, time
+from decimal import Decimal
+from pathlib import Path
+from types import ModuleType
+
+from pianola.analyse import analyse
+from pianola.generate import generate
+from pianola.generate.options import Options
+
+ROOT = Path(os.path.dirname(os.path.realpath(__file__))).parent
+SCHEMA = ROOT / "tests" / "schemas" / "abitofeverything.sql"
+
+
+def create_db(dbfile: Path):
+    with open(SCHEMA) as f:
+        with sqlite3.connect(dbfile) as conn:
+            conn.executescript(f.read())
+            # the benchmarks only exercise tables
+            views = conn.execute("SELECT name FROM sqlite_master WHERE type='view'")
+            for (name,) in views.fetchall():
+                conn.execute("DROP VIEW " + name)
+
+
+def generate_models(
+    dbfile: Path, outdir: Path, package_name: str, options: Options = Options()
+) -> ModuleType:
+    schema = analyse("sqlite://" + str(dbfile))
+    generate(schema, outdir / package_name, package_name, [], options)
+    if str(outdir) not in sys.path:
+        sys.path.append(str(outdir))
+    return importlib.import_module(package_name)
+
+
+def make_row(models, i: int):
+    return models.ABitOfEverything(
+        i, None, b"blob", None, True, None, False, None, "a", None,
+        b"clob", None, date.today(), None, datetime.now(), None,
+        Decimal("1.25"), None, 1.23, None, 2.34, None, i, None, i, None,
+        "abc", None, 9.12, None, "bcd", None, 3.56, None, 1, None,
+        "hello", None, time(1, 2, 3), None, datetime.now(), None, 2, None,
+        "bye", None,
+    )  # fmt: skip
@@ -1,6 +1,5 @@
 import sqlite3
 
-from pianola.lib.pytypes.sql import INTEGER_TYPES
 from pianola.lib.schema.sql import Index, SqlSchema, Table
 
 
@@ -16,12 +15,31 @@ def table_populate_index(
     table.indices += [index]
 
 
+def table_mark_rowid_alias(table: Table, pk_autoindex: bool, cursor: sqlite3.Cursor):
+    """
+    Marks the primary key of table if it aliases the rowid: a single column
+    declared exactly INTEGER, which sqlite doesn't index separately. other
+    integer types (INT, BIGINT, ...), INTEGER PRIMARY KEY DESC and WITHOUT
+    ROWID tables get an automatic index on the primary key instead.
+    """
+    pks = [c for c in table.columns if c.primary_key]
+    if len(pks) != 1 or pk_autoindex:
+        return
+    cursor.execute(f"PRAGMA table_info('{table.sqlname}')")
+    for _, name, decltype, _, _, pk in cursor.fetchall():
+        if pk and name == pks[0].sqlname:
+            pks[0].rowid_alias = decltype.upper() == "INTEGER"
+
+
 def schema_populate_indices(schema: SqlSchema, cursor: sqlite3.Cursor):
     for table in schema.tables:
         cursor.execute(f"PRAGMA INDEX_LIST('{table.sqlname}')")
         rows = cursor.fetchall()
+        pk_autoindex = False
         for seq, name, unique, origin, partial in rows:
             table_populate_index(table, name, unique, cursor)
+            pk_autoindex = pk_autoindex or origin == "pk"
+        table_mark_rowid_alias(table, pk_autoindex, cursor)
 
     # rowid primary keys do not get an explicit index created
     for table in schema.tables:
@@ -32,5 +50,5 @@ def schema_populate_indices(schema: SqlSchema, cursor: sqlite3.Cursor):
                 pk_index_exists = True
                 break
 
-        if not pk_index_exists and len(pks) == 1 and pks[0].sqltype in INTEGER_TYPES:
+        if not pk_index_exists and len(pks) == 1 and pks[0].rowid_alias:
             table.indices += [Index("pianola_implicit_rowid_index", pks, True)]
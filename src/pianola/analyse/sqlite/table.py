@@ -3,8 +3,8 @@ import sqlite3
 import sqlglot
 import sqlglot.expressions as exp
 from pianola.analyse.sqlite.column import column_from_expr
-from pianola.analyse.sqlite.utils import resolve_reference
-from pianola.lib.schema.sql import SqlSchema, Table
+from pianola.analyse.sqlite.utils import resolve_references
+from pianola.lib.schema.sql import ForeignKey, SqlSchema, Table
 from pianola.lib.stringutils import sql_to_class_name
 
 
@@ -22,21 +22,31 @@ def schema_populate_table(schema: SqlSchema, table_schema: exp.Schema):
         elif isinstance(expr, exp.ColumnDef):
             column = column_from_expr(expr, schema)
             table.columns += [column]
+            reference = expr.find(exp.Reference)
+            if reference is not None:
+                ref_table, ref_columns = resolve_references(reference, schema)
+                table.foreign_keys += [ForeignKey([column], ref_table, ref_columns)]
         elif isinstance(expr, exp.PrimaryKey):
             for _, pk in expr.iter_expressions():
                 assert isinstance(pk.this, str)
                 column = table.find_column(pk.this, False)
                 column.primary_key = True
         elif isinstance(expr, exp.ForeignKey):
-            ident = expr.find(exp.Identifier)
-            if ident is None:
+            columns = []
+            for ident in expr.expressions:
+                assert isinstance(ident.this, str)
+                columns += [table.find_column(ident.this, ident.quoted)]
+            if not columns:
                 raise ValueError("foreign key has no identifier")
-            assert isinstance(ident.this, str)
             reference = expr.find(exp.Reference)
             if reference is None:
                 raise ValueError("foreign key has no reference")
-            reference_col = resolve_reference(reference, schema)
-            table.find_column(ident.this, ident.quoted).reference = reference_col
+            ref_table, ref_columns = resolve_references(reference, schema)
+            if len(columns) != len(ref_columns):
+                raise ValueError("foreign key and reference column counts differ")
+            for column, reference_col in zip(columns, ref_columns):
+                column.reference = reference_col
+            table.foreign_keys += [ForeignKey(columns, ref_table, ref_columns)]
         elif isinstance(expr, exp.UniqueColumnConstraint):
             pass
         else:
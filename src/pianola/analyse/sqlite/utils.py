@@ -5,12 +5,15 @@ import sqlglot.expressions as exp
 from pianola.lib.schema.sql import Column, SqlSchema, Table
 
 
-def resolve_reference(reference: exp.Reference, schema: SqlSchema) -> Column:
+def resolve_references(
+    reference: exp.Reference, schema: SqlSchema
+) -> tuple[Table, list[Column]]:
     ref_schema = reference.find(exp.Schema)
     if ref_schema is None:
         raise ValueError("reference has no schema")
 
     table: Optional[Table] = None
+    columns: list[Column] = []
     for _, expr in ref_schema.iter_expressions():
         if isinstance(expr, exp.Table):
             ident = expr.find(exp.Identifier)
@@ -22,8 +25,21 @@ def resolve_reference(reference: exp.Reference, schema: SqlSchema) -> Column:
             if table is None:
                 raise RuntimeError("reference column has no associated table")
             assert isinstance(expr.this, str)
-            return table.find_column(expr.this, expr.quoted)
-    raise RuntimeError("could not resolve reference")
+            columns += [table.find_column(expr.this, expr.quoted)]
+
+    if table is None:
+        raise RuntimeError("could not resolve reference")
+    # a reference without columns refers to the primary key
+    if not columns:
+        columns = [c for c in table.columns if c.primary_key]
+    if not columns:
+        raise RuntimeError("could not resolve reference")
+    return table, columns
+
+
+def resolve_reference(reference: exp.Reference, schema: SqlSchema) -> Column:
+    _, columns = resolve_references(reference, schema)
+    return columns[0]
 
 
 def debug_expr(name: str, e: exp.Expression, indent: int = 0):
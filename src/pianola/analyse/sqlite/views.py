@@ -1,11 +1,14 @@
 import sqlite3
 from contextlib import contextmanager
-from typing import Generator, Type, TypeVar
+from dataclasses import replace
+from typing import Generator, Optional, Type, TypeVar
 
 import sqlglot
 import sqlglot.expressions as exp
+import stringcase as sc
 from pianola.analyse.sqlite.utils import debug_expr
 from pianola.lib.schema.sql.schema import SqlSchema
+from pianola.lib.schema.sql.table import Table
 from pianola.lib.schema.sql.view import ColumnInfo, View
 from pianola.lib.stringutils import sql_to_class_name
 
@@ -70,17 +73,47 @@ class ExpressionParser:
             yield expression
 
 
-def populate_column(view: View, column: exp.Column, schema: SqlSchema):
-    p = ExpressionParser(column)
-    with p.expect_one(exp.Identifier) as ident:
-        name = ident.name
-        quoted = ident.quoted
-    with p.expect_one(exp.Identifier) as ident:
-        tbl_name = ident.name
-        tbl_quoted = ident.quoted
-    table = schema.find_table(tbl_name, tbl_quoted)
-    view.columns.append(table.find_column(name, quoted))
-    view.column_info.append(ColumnInfo(table, None))
+def view_sources(select: exp.Select, schema: SqlSchema) -> dict[str, Table]:
+    """
+    Returns the tables a view selects from, keyed by their alias or name.
+    """
+    sources: dict[str, Table] = {}
+    from_ = select.args.get("from")
+    joins = select.args.get("joins") or []
+    for source in [from_.this if from_ is not None else None] + [j.this for j in joins]:
+        if not isinstance(source, exp.Table):
+            raise ValueError(f"views must select from tables, got {source}")
+        ident = source.find(exp.Identifier)
+        assert ident is not None
+        sources[source.alias_or_name] = schema.find_table(ident.name, ident.quoted)
+    return sources
+
+
+def populate_column(
+    view: View, column: exp.Column, sources: dict[str, Table], alias: Optional[str]
+):
+    ident = column.find(exp.Identifier)
+    assert ident is not None
+    if column.table:
+        tables = [sources[column.table]]
+    else:
+        tables = [
+            t
+            for t in sources.values()
+            if any(c.sqlname == ident.name for c in t.columns)
+        ]
+    if len(tables) != 1:
+        raise ValueError(f"cannot resolve view column {column.sql()}")
+    table = tables[0]
+    source = table.find_column(ident.name, ident.quoted)
+
+    # the view column has the type of its source column, under its own name
+    view_column = replace(source, primary_key=False, reference=None, rowid_alias=False)
+    if alias is not None:
+        view_column.sqlname = alias
+        view_column.pyname = sc.snakecase(alias)
+    view.columns.append(view_column)
+    view.column_info.append(ColumnInfo(table, alias, source))
 
 
 def parse_view(schema: SqlSchema, e: exp.Expression) -> View:
@@ -94,16 +127,19 @@ def parse_view(schema: SqlSchema, e: exp.Expression) -> View:
             view.quoted = ident.quoted
 
     with parser.expect_one(exp.Select) as select:
-        p = ExpressionParser(select)
-        for column in p.expect_many_of(exp.Column, exp.Alias):
-            if isinstance(column, exp.Column):
-                populate_column(view, column, schema)
-            elif isinstance(column, exp.Alias):
-                pp = ExpressionParser(column)
-                with pp.expect_one(exp.Column) as col:
-                    populate_column(view, col, schema)
-                with pp.expect_one(exp.Identifier) as ident:
-                    view.column_info[-1].alias = ident.name
+        sources = view_sources(select, schema)
+        for column in select.expressions:
+            if isinstance(column, exp.Star):
+                for name, table in sources.items():
+                    for c in table.columns:
+                        ref = exp.column(c.sqlname, name, quoted=c.quoted)
+                        populate_column(view, ref, sources, None)
+            elif isinstance(column, exp.Column):
+                populate_column(view, column, sources, None)
+            elif isinstance(column, exp.Alias) and isinstance(column.this, exp.Column):
+                populate_column(view, column.this, sources, column.alias)
+            else:
+                raise ValueError(f"unsupported view column {column.sql()}")
 
     return view
 
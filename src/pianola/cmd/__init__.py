@@ -1,11 +1,39 @@
 from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
 
 import click
 from pianola.analyse import analyse
 from pianola.generate import generate
+from pianola.generate.options import Options
+from pianola.generate.sqlite import advise as sqlite_advise
+from pianola.generate.sqlite import audit as sqlite_audit
 
 
-@click.command
+class DefaultGroup(click.Group):
+    """
+    A group which runs its default command when the first argument isn't the
+    name of a command, so that `pianola URI OUTDIR` keeps generating models.
+    """
+
+    def __init__(self, *args, default: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
+
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        if args and args[0] not in self.commands and args[0] != "--help":
+            args = [self.default, *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default="generate")
+def main():
+    """
+    Generate models for a database, or advise on its indices.
+    """
+
+
+@main.command("generate")
 @click.option(
     "-p",
     "--package",
@@ -19,6 +47,72 @@ from pianola.generate import generate
     default=[],
     help="Tables to exclude from generated code",
 )
+@click.option(
+    "--slots",
+    is_flag=True,
+    default=False,
+    help="Generate __slots__ model classes (sqlite only)",
+)
+@click.option(
+    "--aio",
+    is_flag=True,
+    default=False,
+    help="Generate an aio package of async model methods (sqlite only)",
+)
+@click.option(
+    "--converters",
+    type=click.Choice(["python", "sqlite"]),
+    default="python",
+    help="Convert values in the models or with sqlite3 converters (sqlite only)",
+)
+@click.option(
+    "--converter-cache",
+    type=int,
+    default=0,
+    help="Size of the LRU cache for decoding dates and times (sqlite only)",
+)
+@click.option(
+    "--defer",
+    multiple=True,
+    default=[],
+    help="Columns to load on demand, as table.column (sqlite only)",
+)
+@click.option(
+    "--defer-blobs",
+    is_flag=True,
+    default=False,
+    help="Load every BLOB column on demand (sqlite only)",
+)
+@click.option(
+    "--identity-map",
+    is_flag=True,
+    default=False,
+    help="Use the active IdentityMap in primary key lookups (sqlite only)",
+)
+@click.option(
+    "--result-cache",
+    is_flag=True,
+    default=False,
+    help="Serve index queries from the installed ResultCache (sqlite only)",
+)
+@click.option(
+    "--queries",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=None,
+    help="Directory of .sql files of named queries to generate (sqlite only)",
+)
+@click.option(
+    "--audit",
+    type=click.Choice(["text", "json"]),
+    default=None,
+    help="Report the query plan of each generated statement (sqlite only)",
+)
+@click.option(
+    "--audit-strict",
+    is_flag=True,
+    default=False,
+    help="Fail when a method called with a key scans a table (sqlite only)",
+)
 @click.argument(
     "uri",
     type=str,
@@ -27,11 +121,97 @@ from pianola.generate import generate
     "outdir",
     type=click.Path(path_type=Path),
 )
-def main(uri: str, outdir: Path, package: str, exclude: list[str]):
+def generate_models(
+    uri: str,
+    outdir: Path,
+    package: str,
+    exclude: list[str],
+    slots: bool,
+    aio: bool,
+    converters: str,
+    converter_cache: int,
+    defer: list[str],
+    defer_blobs: bool,
+    identity_map: bool,
+    result_cache: bool,
+    queries: Optional[Path],
+    audit: Optional[str],
+    audit_strict: bool,
+):
     """
     Generate models for the database at URI in the directory OUTDIR. URI should
     be a scheme qualified database uri (e.g. sqlite://db.sqlite,
     whoosh://path/to/indices).
     """
     schema = analyse(uri)
-    generate(schema, outdir, package, exclude)
+    options = Options(
+        slots=slots,
+        aio=aio,
+        converters=converters,
+        converter_cache=converter_cache,
+        defer=list(defer),
+        defer_blobs=defer_blobs,
+        identity_map=identity_map,
+        result_cache=result_cache,
+        queries=queries,
+    )
+    if (audit or audit_strict) and schema.dialect == "sqlite":
+        results = sqlite_audit.audit(
+            schema, Path(urlparse(uri).path), list(exclude), options
+        )
+        if audit == "json":
+            click.echo(sqlite_audit.format_json(results))
+        elif audit == "text" or any(r.failed for r in results):
+            click.echo(sqlite_audit.format_text(results))
+        if audit_strict and any(r.failed for r in results):
+            raise click.ClickException("generated methods scan tables by key")
+    generate(schema, outdir, package, exclude, options)
+
+
+@main.command("advise")
+@click.option(
+    "-x",
+    "--exclude",
+    multiple=True,
+    default=[],
+    help="Tables to exclude from the workload",
+)
+@click.option(
+    "--queries",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=None,
+    help="Directory of .sql files of named queries to include in the workload",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help="Format of the advice",
+)
+@click.argument(
+    "uri",
+    type=str,
+)
+def advise(
+    uri: str,
+    exclude: list[str],
+    queries: Optional[Path],
+    output_format: str,
+):
+    """
+    Propose indices for the queries of the models generated for the sqlite
+    database at URI, and report redundant indices. The database isn't
+    modified, statistics are gathered on a copy when it hasn't been analysed.
+    """
+    schema = analyse(uri)
+    if schema.dialect != "sqlite":
+        raise click.ClickException("advise only supports sqlite databases")
+    options = Options(queries=queries)
+    advice = sqlite_advise.advise(
+        schema, Path(urlparse(uri).path), list(exclude), options
+    )
+    if output_format == "json":
+        click.echo(sqlite_advise.format_json(advice))
+    else:
+        click.echo(sqlite_advise.format_text(advice))
@@ -0,0 +1,27 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+
+@dataclass
+class Options:
+    # emit __slots__ model classes which use a shared UNSET sentinel
+    slots: bool = False
+    # emit an aio package with async versions of every generated method
+    aio: bool = False
+    # convert values in the models ("python") or register converters with
+    # the sqlite3 module and let the cursor convert them ("sqlite")
+    converters: str = "python"
+    # size of the lru cache used when decoding dates and times, 0 to disable
+    converter_cache: int = 0
+    # columns to load on demand, given as table.column
+    defer: list[str] = field(default_factory=list)
+    # load every BLOB column on demand
+    defer_blobs: bool = False
+    # check and maintain the active utils.IdentityMap in primary key lookups
+    # and writes
+    identity_map: bool = False
+    # serve index queries from the installed utils.ResultCache
+    result_cache: bool = False
+    # directory of .sql files of named queries to generate methods for
+    queries: Optional[Path] = None
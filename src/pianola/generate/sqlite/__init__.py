@@ -1,32 +1,79 @@
+from copy import deepcopy
 from pathlib import Path
 
+from pianola.generate.options import Options
+from pianola.generate.sqlite.aio import generate_aio_database, generate_aio_module
 from pianola.generate.sqlite.converters import generate_converters
+from pianola.generate.sqlite.queries import check_query_names, load_queries
 from pianola.generate.sqlite.table import generate_table
 from pianola.generate.sqlite.utils import generate_utils
 from pianola.generate.sqlite.view import generate_view
-from pianola.lib.schema.sql import SqlSchema
+from pianola.lib.pytypes.sql import BYTES_TYPES
+from pianola.lib.schema.sql import Query, SqlSchema, Table
 from pianola.lib.stringutils import sql_to_class_name, sql_to_module_name
 from pianola.lib.writer import Writer
 
 
+def mark_deferred(tables: list[Table], options: Options):
+    for table in tables:
+        # deferred columns are loaded by primary key
+        if not any(c.primary_key for c in table.columns):
+            continue
+        for column in table.columns:
+            if column.primary_key:
+                continue
+            if table.sqlname + "." + column.sqlname in options.defer or (
+                options.defer_blobs and column.sqltype.upper() in BYTES_TYPES
+            ):
+                column.deferred = True
+
+
+def prepare_tables(
+    schema: SqlSchema, exclude_tables: list[str], options: Options
+) -> tuple[list[Table], dict[str, list[Query]]]:
+    """
+    Returns the tables to generate and their named queries, keyed by table
+    sqlname.
+    """
+    tables = [t for t in schema.tables if t.sqlname not in exclude_tables]
+    mark_deferred(tables, options)
+    queries: dict[str, list[Query]] = {}
+    if options.queries is not None:
+        queries = load_queries(options.queries, tables)
+        check_query_names(tables, queries, options)
+    return tables, queries
+
+
 def generate(
     schema: SqlSchema,
     outdir: Path,
     package_name: str,
     exclude_tables: list[str] = [],
+    options: Options = Options(),
 ):
     outdir.mkdir(exist_ok=True)
+    # columns are marked up for the options, which mustn't leak into the
+    # caller's schema
+    schema = deepcopy(schema)
 
     # generate static files
-    generate_converters(outdir)
-    generate_utils(outdir)
+    generate_converters(outdir, options)
+    generate_utils(outdir, options)
+
+    if options.converters == "sqlite":
+        # values are converted by the sqlite3 module, so the models pass them
+        # through untouched
+        for table in [*schema.tables, *schema.views]:
+            for column in table.columns:
+                column.conv_func = None
 
     # generate tables
     generated_tables: list[str] = []
-    for table in schema.tables:
-        if table.sqlname not in exclude_tables:
-            generate_table(table, outdir, package_name, [])
-            generated_tables += [table.sqlname]
+    tables, queries = prepare_tables(schema, exclude_tables, options)
+    for table in tables:
+        table_queries = queries.get(table.sqlname, [])
+        generate_table(table, outdir, package_name, table_queries, options, tables)
+        generated_tables += [table.sqlname]
 
     # generate views
     for view in schema.views:
@@ -34,6 +81,21 @@ def generate(
         generate_view(view, outdir, package_name)
         generated_tables += [view.sqlname]
 
+    # generate async wrappers of the generated modules
+    if options.aio:
+        aiodir = outdir / "aio"
+        aiodir.mkdir(exist_ok=True)
+        generate_aio_database(aiodir, package_name)
+        for table in generated_tables:
+            module_name = sql_to_module_name(table)
+            generate_aio_module(
+                outdir / (module_name + ".py"),
+                aiodir,
+                package_name,
+                module_name,
+                sql_to_class_name(table),
+            )
+
     # generate module level imports
     with Writer(outdir / "__init__.py") as w:
         for table in generated_tables:
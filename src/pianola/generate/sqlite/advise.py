@@ -0,0 +1,270 @@
+import json
+import sqlite3
+import tempfile
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import sqlglot
+import sqlglot.expressions as exp
+from pianola.generate.options import Options
+from pianola.generate.sqlite.audit import AuditResult, explain, workload
+from pianola.lib.schema.sql import Column, SqlSchema, Table
+from pianola.lib.stringutils import quote
+
+IMPLICIT_INDEX = "pianola_implicit_rowid_index"
+
+
+@dataclass
+class IndexProposal:
+    table: str
+    columns: list[str]
+    key: list[Column] = field(repr=False, compare=False)
+    # the methods whose statements scan the table or sort in a temp b-tree
+    methods: list[str] = field(default_factory=list)
+    # methods which no longer scan once every proposal is created
+    fixed: list[str] = field(default_factory=list)
+    # rows in the table according to sqlite_stat1
+    rows: Optional[int] = None
+    # b-trees written by an insert or delete of a row, before and after
+    btrees: tuple[int, int] = (1, 2)
+    sql: str = ""
+
+
+@dataclass
+class RedundantIndex:
+    table: str
+    index: str
+    covered_by: str
+    sql: str = ""
+
+
+@dataclass
+class Advice:
+    proposals: list[IndexProposal]
+    redundant: list[RedundantIndex]
+
+
+def table_source(statement: exp.Expression) -> Optional[str]:
+    if isinstance(statement, exp.Select):
+        from_ = statement.args.get("from")
+        source = from_.this if from_ is not None else None
+    else:
+        source = statement.this
+    return source.name if isinstance(source, exp.Table) else None
+
+
+def column_refs(expr: exp.Expression) -> list[exp.Column]:
+    if isinstance(expr, exp.Column):
+        return [expr]
+    if isinstance(expr, exp.Tuple):
+        return [e for e in expr.expressions if isinstance(e, exp.Column)]
+    return []
+
+
+def key_columns(statement: exp.Expression, table: Table) -> list[Column]:
+    """
+    Returns the columns an index should have to serve statement: the columns
+    compared for equality, followed by the ORDER BY columns or else the first
+    range compared column.
+    """
+    equal: list[exp.Column] = []
+    ranged: list[exp.Column] = []
+    where = statement.args.get("where")
+    if where is not None:
+        for cmp in where.find_all(exp.EQ, exp.In):
+            equal += column_refs(cmp.this)
+        for cmp in where.find_all(exp.GT, exp.GTE, exp.LT, exp.LTE):
+            ranged += column_refs(cmp.this)
+    order = statement.args.get("order")
+    ordered = [o.this for o in order.expressions] if order is not None else []
+
+    columns: list[Column] = []
+    extra = [c for c in ordered if isinstance(c, exp.Column)] or ranged[:1]
+    for ref in equal + extra:
+        ident = ref.find(exp.Identifier)
+        assert ident is not None
+        column = table.find_column(ident.name, ident.quoted)
+        if column not in columns:
+            columns += [column]
+    return columns
+
+
+def is_prefix(prefix: list, columns: list) -> bool:
+    return columns[: len(prefix)] == prefix
+
+
+def read_stats(conn: sqlite3.Connection) -> dict[str, int]:
+    """
+    Returns the row count of each table in sqlite_stat1, running ANALYZE first
+    if the database has never been analysed.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if not exists or not conn.execute("SELECT 1 FROM sqlite_stat1").fetchone():
+        conn.execute("ANALYZE")
+    rows: dict[str, int] = {}
+    for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+        rows[tbl] = int(stat.split()[0])
+    return rows
+
+
+def replan(conn: sqlite3.Connection, result: AuditResult) -> AuditResult:
+    planned = AuditResult(result.table, result.method, result.sql, result.keyed)
+    explain(conn, planned)
+    return planned
+
+
+def redundant_indices(table: Table) -> list[RedundantIndex]:
+    """
+    Returns the indices of table whose columns are a prefix of another index,
+    other than those enforcing a constraint.
+    """
+    redundant: list[RedundantIndex] = []
+    for index in table.indices:
+        if (
+            index.unique
+            or index.name == IMPLICIT_INDEX
+            or index.name.startswith("sqlite_autoindex")
+        ):
+            continue
+        for other in table.indices:
+            if other is index or other.name == IMPLICIT_INDEX:
+                continue
+            # of two identical indices only the later one is reported
+            same = other.columns == index.columns
+            if same and table.indices.index(other) > table.indices.index(index):
+                continue
+            if is_prefix(index.columns, other.columns):
+                sql = "DROP INDEX " + quote(index.name, '"')
+                redundant += [
+                    RedundantIndex(table.sqlname, index.name, other.name, sql)
+                ]
+                break
+    return redundant
+
+
+def advise(
+    schema: SqlSchema,
+    dbfile: Path,
+    exclude_tables: list[str] = [],
+    options: Options = Options(),
+) -> Advice:
+    """
+    Proposes indices which remove the scans and sorts of the generated and
+    named query statements, planned against an analysed copy of the database
+    in dbfile, and reports redundant indices.
+    """
+    results = workload(schema, exclude_tables, options)
+    tables = {t.sqlname: t for t in schema.tables}
+    proposals: dict[tuple[str, tuple[str, ...]], IndexProposal] = {}
+    advice = Advice([], [])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = sqlite3.connect(Path(tmpdir) / "advise.db")
+        try:
+            with sqlite3.connect(
+                dbfile.absolute().as_uri() + "?mode=ro", uri=True
+            ) as src:
+                src.backup(conn)
+            stats = read_stats(conn)
+
+            scanning: list[AuditResult] = []
+            for result in results:
+                explain(conn, result)
+                if result.error or not (result.scans or result.temp_btrees):
+                    continue
+                statement = sqlglot.parse_one(result.sql, read="sqlite")
+                table = tables.get(table_source(statement) or "")
+                if table is None:
+                    continue
+                columns = key_columns(statement, table)
+                if not columns or any(
+                    is_prefix(columns, index.columns) for index in table.indices
+                ):
+                    continue
+                scanning += [result]
+                key = (table.sqlname, tuple(c.sqlname for c in columns))
+                proposal = proposals.setdefault(
+                    key, IndexProposal(table.sqlname, list(key[1]), columns)
+                )
+                proposal.methods += [result.table + "." + result.method]
+
+            # an index also serves the statements using a prefix of its columns
+            for key, proposal in list(proposals.items()):
+                for other in proposals.values():
+                    if (
+                        other is not proposal
+                        and other.table == proposal.table
+                        and is_prefix(proposal.columns, other.columns)
+                    ):
+                        other.methods += proposal.methods
+                        del proposals[key]
+                        break
+
+            for proposal in proposals.values():
+                table = tables[proposal.table]
+                name = "ix_" + proposal.table + "_" + "_".join(proposal.columns)
+                proposal.sql = (
+                    "CREATE INDEX "
+                    + quote(name, '"')
+                    + " ON "
+                    + quote(table.sqlname, '"' if table.quoted else "")
+                    + " ("
+                    + ", ".join(
+                        quote(c.sqlname, '"' if c.quoted else "") for c in proposal.key
+                    )
+                    + ")"
+                )
+                proposal.rows = stats.get(proposal.table)
+                btrees = 1 + sum(1 for i in table.indices if i.name != IMPLICIT_INDEX)
+                proposal.btrees = (btrees, btrees + 1)
+                conn.execute(proposal.sql)
+
+            fixed = [r for r in scanning if not replan(conn, r).scans]
+            for proposal in proposals.values():
+                proposal.fixed = [
+                    m
+                    for m in proposal.methods
+                    if any(r.table + "." + r.method == m for r in fixed)
+                ]
+            advice.proposals = list(proposals.values())
+        finally:
+            conn.close()
+
+    for table in tables.values():
+        if table.sqlname not in exclude_tables:
+            advice.redundant += redundant_indices(table)
+    return advice
+
+
+def format_text(advice: Advice) -> str:
+    lines: list[str] = []
+    for proposal in advice.proposals:
+        before, after = proposal.btrees
+        rows = "unknown" if proposal.rows is None else str(proposal.rows)
+        lines += [proposal.sql + ";"]
+        lines += [f"    -- rows: {rows}"]
+        lines += [
+            f"    -- writes: {after} b-trees per insert or delete instead of "
+            + f"{before} (+{100 * (after - before) // before}%)"
+        ]
+        for method in proposal.methods:
+            status = "removes scan" if method in proposal.fixed else "still scans"
+            lines += [f"    -- {method}: {status}"]
+    for redundant in advice.redundant:
+        lines += [
+            redundant.sql + ";",
+            f"    -- {redundant.index} is a prefix of {redundant.covered_by}",
+        ]
+    if not lines:
+        lines += ["no indices to propose"]
+    return "\n".join(lines)
+
+
+def format_json(advice: Advice) -> str:
+    data = asdict(advice)
+    for proposal in data["proposals"]:
+        del proposal["key"]
+    return json.dumps(data, indent=2)
@@ -0,0 +1,263 @@
+import ast
+from pathlib import Path
+
+from pianola.lib.writer import Writer
+
+
+def generate_aio_database(outdir: Path, package_name: str):
+    with Writer(outdir / "__init__.py") as w:
+        w.writeline("import asyncio")
+        w.writeline("import contextvars")
+        w.writeline("import itertools")
+        w.writeline("import sqlite3")
+        w.writeline("from concurrent.futures import ThreadPoolExecutor")
+        w.writeline(
+            "from typing import Any, AsyncGenerator, Callable, Iterator, Optional, TypeVar"
+        )
+        w.writeline(
+            "from ",
+            package_name,
+            ".utils import FETCH_BATCH_SIZE, LOAD_ON_ACCESS, connect",
+        )
+        w.writeline()
+        w.writeline("T = TypeVar('T')")
+        w.writeline()
+
+        # each worker is a single thread owning one connection, so a stream can
+        # keep using its cursor between batches
+        w.writeline("class _Worker:")
+        with w.indented():
+            w.writeline("def __init__(self, database: str, kwargs: dict[str, Any]):")
+            with w.indented():
+                w.writeline("self.executor = ThreadPoolExecutor(max_workers=1)")
+                w.writeline("self.database = database")
+                w.writeline("self.kwargs = kwargs")
+                w.writeline("self.conn: Optional[sqlite3.Connection] = None")
+            w.writeline()
+
+            w.writeline("def connection(self) -> sqlite3.Connection:")
+            with w.indented():
+                w.writeline("if self.conn is None:")
+                with w.indented():
+                    w.writeline("self.conn = connect(self.database, **self.kwargs)")
+                w.writeline("return self.conn")
+            w.writeline()
+
+            w.writeline("def call(self, fn: Callable[[sqlite3.Cursor], T]) -> T:")
+            with w.indented():
+                w.writeline("conn = self.connection()")
+                w.writeline("with conn:")
+                with w.indented():
+                    w.writeline("return fn(conn.cursor())")
+            w.writeline()
+
+            w.writeline(
+                "def start(self, fn: Callable[[sqlite3.Cursor], Iterator[T]]) -> Iterator[T]:"
+            )
+            with w.indented():
+                w.writeline("return fn(self.connection().cursor())")
+            w.writeline()
+
+            w.writeline("def next_batch(self, it: Iterator[T], size: int) -> list[T]:")
+            with w.indented():
+                w.writeline("return list(itertools.islice(it, size))")
+            w.writeline()
+
+            w.writeline("def close_connection(self):")
+            with w.indented():
+                w.writeline("if self.conn is not None:")
+                with w.indented():
+                    w.writeline("self.conn.close()")
+                    w.writeline("self.conn = None")
+            w.writeline()
+
+            w.writeline("def close(self):")
+            with w.indented():
+                w.writeline("self.executor.submit(self.close_connection).result()")
+                w.writeline("self.executor.shutdown()")
+            w.writeline()
+
+        w.writeline("class AsyncDatabase:")
+        with w.indented():
+            w.writeline(
+                "def __init__(self, database: str, max_workers: int = 4, **kwargs: Any):"
+            )
+            with w.indented():
+                w.writeline(
+                    "self.workers = [_Worker(database, kwargs) for _ in range(max_workers)]"
+                )
+                w.writeline("self.next_worker = itertools.cycle(self.workers)")
+            w.writeline()
+
+            w.writeline("async def run(self, fn: Callable[[sqlite3.Cursor], T]) -> T:")
+            with w.indented():
+                w.writeline("worker = next(self.next_worker)")
+                w.writeline("loop = asyncio.get_running_loop()")
+                # executors don't propagate context variables such as the
+                # active identity map, so the call runs in a copy of ours.
+                # models loaded on a worker can't load deferred fields through
+                # its connection, see load_deferred
+                w.writeline("ctx = contextvars.copy_context()")
+                w.writeline("ctx.run(LOAD_ON_ACCESS.set, False)")
+                w.writeline(
+                    "return await loop.run_in_executor(worker.executor, ctx.run, worker.call, fn)"
+                )
+            w.writeline()
+
+            w.writeline(
+                "async def stream(self, fn: Callable[[sqlite3.Cursor], Iterator[T]], ",
+                "batch_size: int = FETCH_BATCH_SIZE) -> AsyncGenerator[T, None]:",
+            )
+            with w.indented():
+                w.writeline("worker = next(self.next_worker)")
+                w.writeline("loop = asyncio.get_running_loop()")
+                w.writeline("ctx = contextvars.copy_context()")
+                w.writeline("ctx.run(LOAD_ON_ACCESS.set, False)")
+                w.writeline(
+                    "it = await loop.run_in_executor(worker.executor, ctx.run, worker.start, fn)"
+                )
+                w.writeline(
+                    "while batch := await loop.run_in_executor(",
+                    "worker.executor, ctx.run, worker.next_batch, it, batch_size):",
+                )
+                with w.indented():
+                    w.writeline("for row in batch:")
+                    with w.indented():
+                        w.writeline("yield row")
+            w.writeline()
+
+            w.writeline("def close(self):")
+            with w.indented():
+                w.writeline("for worker in self.workers:")
+                with w.indented():
+                    w.writeline("worker.close()")
+            w.writeline()
+
+            w.writeline("async def __aenter__(self) -> 'AsyncDatabase':")
+            with w.indented():
+                w.writeline("return self")
+            w.writeline()
+
+            w.writeline("async def __aexit__(self, *_: Any):")
+            with w.indented():
+                w.writeline("loop = asyncio.get_running_loop()")
+                w.writeline("await loop.run_in_executor(None, self.close)")
+
+
+def method_kind(func: ast.FunctionDef) -> str:
+    for decorator in func.decorator_list:
+        if isinstance(decorator, ast.Name) and decorator.id in (
+            "staticmethod",
+            "classmethod",
+        ):
+            return decorator.id
+    return "method"
+
+
+def generate_aio_module(
+    module: Path, outdir: Path, package_name: str, module_name: str, classname: str
+):
+    """
+    Writes async wrappers of every method of classname, which is read from the
+    already generated module.
+    """
+    tree = ast.parse(module.read_text())
+    imports: list[str] = []
+    methods: list[ast.FunctionDef] = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports += [ast.unparse(node)]
+        elif isinstance(node, ast.If):
+            # TYPE_CHECKING block
+            imports += [ast.unparse(node)]
+        elif isinstance(node, ast.ClassDef) and node.name == classname:
+            methods = [
+                n
+                for n in node.body
+                if isinstance(n, ast.FunctionDef) and not n.name.startswith("_")
+                # blobs can only be used on the thread which opened them
+                and not (n.name.startswith("open_") and n.name.endswith("_blob"))
+                and not any(
+                    isinstance(d, ast.Attribute) and d.attr == "setter"
+                    for d in n.decorator_list
+                )
+                and not any(
+                    isinstance(d, ast.Name) and d.id == "property"
+                    for d in n.decorator_list
+                )
+            ]
+
+    with Writer(outdir / (module_name + ".py")) as w:
+        for line in imports:
+            w.writeline(line)
+        w.writeline("from typing import AsyncGenerator")
+        w.writeline("from ", package_name, ".aio import AsyncDatabase")
+        w.writeline("from ", package_name, ".", module_name, " import ", classname)
+        w.writeline()
+
+        for func in methods:
+            kind = method_kind(func)
+            args = func.args.args
+            defaults = [None] * (len(args) - len(func.args.defaults))
+            defaults += func.args.defaults
+            params: list[str] = []
+            call: list[str] = []
+            target = classname
+            for i, (arg, default) in enumerate(zip(args, defaults)):
+                if kind == "classmethod" and i == 0:
+                    continue
+                if arg.arg == "cursor":
+                    call += ["cursor"]
+                    continue
+                if arg.arg == "connection":
+                    call += ["cursor.connection"]
+                    continue
+                param = arg.arg
+                if kind == "method" and i == 0:
+                    param = "obj: '" + classname + "'"
+                    target = "obj"
+                elif arg.annotation is not None:
+                    param += ": " + ast.unparse(arg.annotation)
+                if default is not None:
+                    param += " = " + ast.unparse(default)
+                params += [param]
+                if not (kind == "method" and i == 0):
+                    call += [arg.arg]
+
+            returns = func.returns
+            streaming = (
+                isinstance(returns, ast.Subscript)
+                and isinstance(returns.value, ast.Name)
+                and returns.value.id == "Generator"
+            )
+            invoke = target + "." + func.name + "(" + ", ".join(call) + ")"
+            if streaming:
+                assert isinstance(returns, ast.Subscript)
+                assert isinstance(returns.slice, ast.Tuple)
+                item = ast.unparse(returns.slice.elts[0])
+                ret = "AsyncGenerator[" + item + ", None]"
+            elif returns is not None:
+                ret = ast.unparse(returns)
+            else:
+                ret = "None"
+
+            w.writeline(
+                "async def ",
+                func.name,
+                "(",
+                ", ".join(["db: AsyncDatabase"] + params),
+                ") -> ",
+                ret,
+                ":",
+            )
+            with w.indented():
+                if streaming:
+                    stream_args = "lambda cursor: " + invoke
+                    if "batch_size" in call:
+                        stream_args += ", batch_size"
+                    w.writeline("async for row in db.stream(", stream_args, "):")
+                    with w.indented():
+                        w.writeline("yield row")
+                else:
+                    w.writeline("return await db.run(lambda cursor: ", invoke, ")")
+            w.writeline()
@@ -0,0 +1,146 @@
+import json
+import sqlite3
+from copy import deepcopy
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from pianola.generate.options import Options
+from pianola.generate.sqlite import prepare_tables
+from pianola.generate.sqlite.table import TableGenerator
+from pianola.generate.sqlite.view import ViewGenerator
+from pianola.lib.schema.sql import SqlSchema
+
+
+@dataclass
+class AuditResult:
+    table: str
+    method: str
+    sql: str
+    # whether the method looks rows up by a key passed by the caller
+    keyed: bool
+    plan: list[str] = field(default_factory=list)
+    scans: list[str] = field(default_factory=list)
+    temp_btrees: list[str] = field(default_factory=list)
+    automatic_indexes: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        """
+        True when the statement couldn't be planned, or when a keyed method
+        scans a whole table instead of searching an index.
+        """
+        return self.error is not None or (self.keyed and bool(self.scans))
+
+
+def is_table_scan(detail: str) -> bool:
+    # scans of subqueries and VALUES lists only visit the rows they produce
+    if not detail.startswith("SCAN "):
+        return False
+    return not (
+        detail.startswith("SCAN (")
+        or "CONSTANT ROW" in detail
+        or "VALUES CLAUSE" in detail
+    )
+
+
+def explain(conn: sqlite3.Connection, result: AuditResult):
+    # the plan doesn't depend on the parameter values, but they must be bound
+    params = [None] * result.sql.count("?")
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + result.sql, params).fetchall()
+    except sqlite3.Error as e:
+        result.error = str(e)
+        return
+    for row in rows:
+        detail = row[-1]
+        result.plan += [detail]
+        if is_table_scan(detail):
+            result.scans += [detail]
+        if detail.startswith("USE TEMP B-TREE"):
+            result.temp_btrees += [detail]
+        if "AUTOMATIC" in detail:
+            result.automatic_indexes += [detail]
+
+
+def workload(
+    schema: SqlSchema, exclude_tables: list[str] = [], options: Options = Options()
+) -> list[AuditResult]:
+    """
+    Returns an unplanned result for each distinct statement of the generated
+    table and view methods.
+    """
+    schema = deepcopy(schema)
+    tables, queries = prepare_tables(schema, exclude_tables, options)
+    generators: list[tuple[str, Union[TableGenerator, ViewGenerator]]] = [
+        (
+            table.sqlname,
+            TableGenerator(
+                table, Path(), "", queries.get(table.sqlname, []), options, tables
+            ),
+        )
+        for table in tables
+    ]
+    # views are generated whatever the excluded tables
+    generators += [(v.sqlname, ViewGenerator(v, Path(), "")) for v in schema.views]
+
+    results: list[AuditResult] = []
+    for name, generator in generators:
+        seen: set[tuple[str, str]] = set()
+        for method, sql, keyed in generator.statements():
+            if (method, sql) in seen:
+                continue
+            seen.add((method, sql))
+            results += [AuditResult(name, method, sql, keyed)]
+    return results
+
+
+def audit(
+    schema: SqlSchema,
+    dbfile: Path,
+    exclude_tables: list[str] = [],
+    options: Options = Options(),
+) -> list[AuditResult]:
+    """
+    Runs EXPLAIN QUERY PLAN for each statement of the generated table methods
+    against the database in dbfile.
+    """
+    results = workload(schema, exclude_tables, options)
+    # open read only, the database must already exist
+    conn = sqlite3.connect(dbfile.absolute().as_uri() + "?mode=ro", uri=True)
+    try:
+        for result in results:
+            explain(conn, result)
+    finally:
+        conn.close()
+    return results
+
+
+def format_text(results: list[AuditResult]) -> str:
+    lines: list[str] = []
+    for result in results:
+        if not (
+            result.error
+            or result.scans
+            or result.temp_btrees
+            or result.automatic_indexes
+        ):
+            continue
+        status = "FAIL" if result.failed else "WARN"
+        lines += [f"{status} {result.table}.{result.method}: {result.sql}"]
+        if result.error:
+            lines += ["    error: " + result.error]
+        for detail in result.scans + result.temp_btrees + result.automatic_indexes:
+            lines += ["    " + detail]
+
+    failed = sum(1 for r in results if r.failed)
+    lines += [f"{len(results)} statements audited, {failed} failed"]
+    return "\n".join(lines)
+
+
+def format_json(results: list[AuditResult]) -> str:
+    return json.dumps(
+        [{**asdict(r), "failed": r.failed} for r in results],
+        indent=2,
+    )
@@ -1,13 +1,27 @@
 from pathlib import Path
 
+from pianola.generate.options import Options
+from pianola.lib.pytypes.sql import (
+    DATE_TYPES,
+    DATETIME_TYPES,
+    DECIMAL_TYPES,
+    TIME_TYPES,
+)
 from pianola.lib.writer import Writer
 
 
-def generate_converters(outdir: Path):
+def generate_converters(outdir: Path, options: Options = Options()):
+    # repeated date and time strings can be decoded from a bounded cache
+    cache = ""
+    if options.converter_cache > 0:
+        cache = f"@lru_cache(maxsize={options.converter_cache})"
+
     with Writer(outdir / "converters.py") as w:
-        w.writeline("from typing import Optional")
+        w.writeline("from typing import Any, Optional, Union")
         w.writeline("from datetime import date, datetime, time")
         w.writeline("from decimal import Decimal")
+        w.writeline("from functools import lru_cache")
+        w.writeline("import sqlite3")
         w.writeline()
 
         w.writeline("def datetime_to_sql(dt: datetime) -> str:")
@@ -15,6 +29,8 @@ def generate_converters(outdir: Path):
             w.writeline("return dt.isoformat()")
         w.writeline()
 
+        if cache:
+            w.writeline(cache)
         w.writeline("def datetime_from_sql(dt: str) -> datetime:")
         with w.indented():
             w.writeline("return datetime.fromisoformat(dt)")
@@ -45,6 +61,8 @@ def generate_converters(outdir: Path):
             w.writeline("return dt.isoformat()")
         w.writeline()
 
+        if cache:
+            w.writeline(cache)
         w.writeline("def date_from_sql(dt: str) -> date:")
         with w.indented():
             w.writeline("return date.fromisoformat(dt)")
@@ -71,6 +89,8 @@ def generate_converters(outdir: Path):
             w.writeline("return dt.isoformat()")
         w.writeline()
 
+        if cache:
+            w.writeline(cache)
         w.writeline("def time_from_sql(dt: str) -> time:")
         with w.indented():
             w.writeline("return time.fromisoformat(dt)")
@@ -92,18 +112,29 @@ def generate_converters(outdir: Path):
             w.writeline("return time_from_sql(dt)")
         w.writeline()
 
-        w.writeline("def decimal_to_sql(d: Decimal) -> float:")
+        # decimals are bound as the bytes of their text. the NUMERIC affinity
+        # of DECIMAL columns would convert text or a float to a REAL, keeping
+        # only 15 significant digits, while blobs are stored as they are. the
+        # values read back are exact, but sqlite compares and sorts them as
+        # bytes. numbers stored by other writers are read from their shortest
+        # representation.
+        w.writeline("def decimal_to_sql(d: Decimal) -> bytes:")
         with w.indented():
-            w.writeline("return float(d)")
+            w.writeline("return str(d).encode()")
         w.writeline()
 
-        w.writeline("def decimal_from_sql(d: float) -> Decimal:")
+        w.writeline(
+            "def decimal_from_sql(d: Union[bytes, str, int, float]) -> Decimal:"
+        )
         with w.indented():
-            w.writeline("return Decimal(d)")
+            w.writeline("if isinstance(d, bytes):")
+            with w.indented():
+                w.writeline("return Decimal(d.decode())")
+            w.writeline("return Decimal(str(d))")
         w.writeline()
 
         w.writeline(
-            "def optional_decimal_to_sql(d: Optional[Decimal]) -> Optional[float]:"
+            "def optional_decimal_to_sql(d: Optional[Decimal]) -> Optional[bytes]:"
         )
         with w.indented():
             w.writeline("if d is None:")
@@ -113,10 +144,63 @@ def generate_converters(outdir: Path):
         w.writeline()
 
         w.writeline(
-            "def optional_decimal_from_sql(d: Optional[float]) -> Optional[Decimal]:"
+            "def optional_decimal_from_sql(d: Union[bytes, str, int, float, None]) -> Optional[Decimal]:"
         )
         with w.indented():
             w.writeline("if d is None:")
             with w.indented():
                 w.writeline("return None")
             w.writeline("return decimal_from_sql(d)")
+
+        if options.converters == "sqlite":
+            w.writeline()
+            generate_sqlite_converters(w, cache)
+
+
+def generate_sqlite_converters(w: Writer, cache: str):
+    # the sqlite3 module passes the raw bytes of each non-null value to the
+    # converter registered for its declared type
+    for name in ["datetime", "date", "time"]:
+        if cache:
+            w.writeline(cache)
+        w.writeline("def ", name, "_from_bytes(b: bytes) -> ", name, ":")
+        with w.indented():
+            w.writeline("return ", name, ".fromisoformat(b.decode())")
+        w.writeline()
+
+    w.writeline("def decimal_from_bytes(b: bytes) -> Decimal:")
+    with w.indented():
+        w.writeline("return Decimal(b.decode())")
+    w.writeline()
+
+    w.writeline("DECLTYPES = {")
+    with w.indented():
+        for types, name in [
+            (DATETIME_TYPES, "datetime"),
+            (DATE_TYPES, "date"),
+            (TIME_TYPES, "time"),
+            (DECIMAL_TYPES, "decimal"),
+        ]:
+            for t in types:
+                w.writeline("'", t, "': ", name, "_from_bytes,")
+    w.writeline("}")
+    w.writeline()
+
+    w.writeline("def register_converters(module: Any = sqlite3):")
+    with w.indented():
+        for name in ["datetime", "date", "time", "decimal"]:
+            w.writeline(
+                "module.register_adapter(",
+                "Decimal" if name == "decimal" else name,
+                ", ",
+                name,
+                "_to_sql)",
+            )
+        w.writeline("for decltype, converter in DECLTYPES.items():")
+        with w.indented():
+            w.writeline("module.register_converter(decltype, converter)")
+    w.writeline()
+
+    # connections opened with detect_types=PARSE_DECLTYPES convert values
+    # without going through the models
+    w.writeline("register_converters()")
@@ -0,0 +1,135 @@
+import re
+from pathlib import Path
+
+import sqlglot
+import sqlglot.expressions as exp
+from pianola.generate.options import Options
+from pianola.generate.sqlite.query import query_replace_params
+from pianola.generate.sqlite.table import TableGenerator
+from pianola.lib.schema.sql import Query, Table
+
+# -- name: <method name> [:one | :many]
+NAME_RE = re.compile(r"^--\s*name:\s*(\w+)\s*(?::(one|many))?\s*$")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def load_queries(directory: Path, tables: list[Table]) -> dict[str, list[Query]]:
+    """
+    Loads the named queries from the .sql files in directory and validates
+    them against tables, returning the queries keyed by the sqlname of the
+    table they select from.
+    """
+    queries: dict[str, list[Query]] = {}
+    for path in sorted(directory.glob("*.sql")):
+        for query in parse_queries(path):
+            try:
+                table = validate_query(query, tables)
+            except (QueryError, KeyError, sqlglot.errors.ParseError) as e:
+                raise QueryError(f"{path}: query {query.name}: {e}") from e
+            queries.setdefault(table.sqlname, []).append(query)
+    return queries
+
+
+def check_query_names(
+    tables: list[Table], queries: dict[str, list[Query]], options: Options
+):
+    """
+    Checks that no named query has the name of another query of its table or
+    of a method generated for the table.
+    """
+    for table in tables:
+        table_queries = queries.get(table.sqlname, [])
+        if not table_queries:
+            continue
+        generator = TableGenerator(table, Path(), "", [], options, tables)
+        names = set(generator.method_names())
+        for query in table_queries:
+            if query.name in names:
+                raise QueryError(
+                    f"query {query.name}: {table.sqlname} already has a method "
+                    + f"named {query.name}"
+                )
+            names.add(query.name)
+
+
+def strip_comment(line: str) -> str:
+    """
+    Returns line without its -- comment, if any. Quoted strings and
+    identifiers may contain --.
+    """
+    quote = None
+    for i, c in enumerate(line):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+        elif c == "[":
+            quote = "]"
+        elif line.startswith("--", i):
+            return line[:i]
+    return line
+
+
+def parse_queries(path: Path) -> list[Query]:
+    queries: list[Query] = []
+    name = None
+    one = False
+    lines: list[str] = []
+
+    def flush():
+        sql = " ".join(lines).strip().rstrip(";").strip()
+        if name is None:
+            if sql:
+                raise QueryError(f"{path}: query without a -- name: header")
+            return
+        queries.append(Query(name, sql, one))
+
+    with open(path) as f:
+        for line in f:
+            if m := NAME_RE.match(line.strip()):
+                flush()
+                name = m.group(1)
+                one = m.group(2) == "one"
+                lines = []
+            else:
+                # lines are joined with spaces, so comments must not reach
+                # the end of the line
+                lines.append(strip_comment(line).strip())
+    flush()
+    return queries
+
+
+def validate_query(query: Query, tables: list[Table]) -> Table:
+    """
+    Checks that query is a select of plain columns from a single table in
+    tables, and that every column it references exists. Returns the table.
+    """
+    sql, _ = query_replace_params(query.sql)
+    select = sqlglot.parse_one(sql, read="sqlite")
+    if not isinstance(select, exp.Select):
+        raise QueryError("only SELECT queries are supported")
+    if select.args.get("joins"):
+        raise QueryError("joins are not supported")
+
+    from_ = select.args.get("from")
+    source = from_.this if from_ is not None else None
+    if not isinstance(source, exp.Table):
+        raise QueryError("queries must select from a table")
+    table = next((t for t in tables if t.sqlname == source.name), None)
+    if table is None:
+        raise QueryError("table " + source.name + " does not exist")
+
+    for expr in select.expressions:
+        if not isinstance(expr, (exp.Column, exp.Star)):
+            raise QueryError("only columns can be selected, got " + expr.sql())
+    for column in select.find_all(exp.Column):
+        if column.table and column.table != source.alias_or_name:
+            raise QueryError("unknown table " + column.table)
+        ident = column.find(exp.Identifier)
+        assert ident is not None
+        table.find_column(ident.name, ident.quoted)
+    return table
@@ -1,5 +1,6 @@
 import re
-from typing import Union
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Union
 
 import sqlglot
 import sqlglot.expressions as exp
@@ -9,6 +10,10 @@ from pianola.lib.schema.sql.table import Table
 from pianola.lib.schema.sql.view import View
 from pianola.lib.writer import Writer
 
+# called with the sql and keyed flag of each statement written into a method,
+# see TableGenerator.statements
+Recorder = Callable[[str, bool], Any]
+
 
 def query_select_cols(sql: str, target: Union[Table, View]) -> list[Column]:
     select = sqlglot.parse_one(sql)
@@ -19,7 +24,7 @@ def query_select_cols(sql: str, target: Union[Table, View]) -> list[Column]:
             ident = expr.find(exp.Identifier)
             assert ident is not None
             res += [target.find_column(ident.name, ident.quoted)]
-        elif isinstance(select, exp.Star):
+        elif isinstance(expr, exp.Star):
             return target.columns
         else:
             break
@@ -38,57 +43,311 @@ def query_replace_params(sql: str):
     return sql, params
 
 
-def generate_query(w: Writer, target: Union[Table, View], query: Query):
-    sql, params = query_replace_params(query.sql)
+def loaded_columns(target: Union[Table, View]) -> list[Column]:
+    """
+    Returns the columns of target which are selected when loading its rows,
+    which is every column which is not deferred.
+    """
+    return [c for c in target.columns if not c.deferred]
 
-    if query.one:
-        ret = "Optional['" + target.pyname + "']"
-    else:
-        ret = "Generator['" + target.pyname + "', None, None]"
 
+def query_construct(target: Union[Table, View], cols: list[Column], row: str) -> str:
+    if isinstance(target, Table) and [c.sqlname for c in cols] == [
+        c.sqlname for c in loaded_columns(target)
+    ]:
+        if any(c.deferred for c in target.columns):
+            # deferred columns are loaded through the cursor's connection
+            return target.pyname + "._from_row(" + row + ", cursor)"
+        return target.pyname + "._from_row(" + row + ")"
+    fields: list[str] = []
+    for i, col in enumerate(cols):
+        f = next(c for c in target.columns if c.sqlname == col.sqlname)
+        fields += [f.pyname + " = " + f.val_from_sql(f"{row}[{i}]")]
+    construct = target.pyname + "(" + ", ".join(fields) + ")"
+    if isinstance(target, Table):
+        # loaded models start with no modified fields
+        construct += "._mark_clean()"
+    return construct
+
+
+def result_construct(result: str, cols: list[Column], row: str) -> str:
+    values = [c.val_from_sql(f"{row}[{i}]") for i, c in enumerate(cols)]
+    return result + "(" + ", ".join(values) + ")"
+
+
+def in_clause_sql(keycols: list[Column], nkeys: int = 1) -> str:
+    """
+    Returns the clause written by chunked_in_loop for a chunk of nkeys keys.
+    """
+    if len(keycols) == 1:
+        placeholders = ", ".join("?" for _ in range(nkeys))
+        return keycols[0].sqlname + " IN (" + placeholders + ")"
+    placeholders = "(" + ", ".join("?" for _ in keycols) + ")"
+    return (
+        "("
+        + ", ".join(c.sqlname for c in keycols)
+        + ") IN (SELECT "
+        + ", ".join(f"column{i + 1}" for i in range(len(keycols)))
+        + " FROM (VALUES "
+        + ", ".join(placeholders for _ in range(nkeys))
+        + "))"
+    )
+
+
+@contextmanager
+def chunked_in_loop(w: Writer, keycols: list[Column], keys: str):
+    """
+    Writes a loop over the list named by keys in chunks which fit in
+    MAX_VARIABLES. In the loop body written by the caller, where is a clause
+    matching keycols against the tuples in the chunk and params holds its
+    parameters.
+    """
+    keyvals = ", ".join(c.val_to_sql(f"key[{i}]") for i, c in enumerate(keycols))
+    w.writeline("size = MAX_VARIABLES // ", len(keycols))
+    w.writeline("for i in range(0, len(", keys, "), size):")
+    with w.indented():
+        w.writeline("chunk = ", keys, "[i : i + size]")
+        if len(keycols) == 1:
+            w.writeline(
+                "where = '",
+                keycols[0].sqlname,
+                " IN (' + ', '.join('?' for _ in chunk) + ')'",
+            )
+        else:
+            # sqlite only uses an index for a composite IN when the values
+            # come from a subquery
+            w.writeline(
+                "where = '(",
+                ", ".join(c.sqlname for c in keycols),
+                ") IN (SELECT ",
+                ", ".join(f"column{i + 1}" for i in range(len(keycols))),
+                " FROM (VALUES ' + ', '.join('(",
+                ", ".join("?" for _ in keycols),
+                ")' for _ in chunk) + '))'",
+            )
+        w.writeline("params = [v for key in chunk for v in (", keyvals, ",)]")
+        yield
+
+
+@contextmanager
+def chunked_in_query(
+    w: Writer,
+    target: Union[Table, View],
+    keycols: list[Column],
+    keys: str,
+    record: Optional[Recorder] = None,
+):
+    """
+    Writes a loop selecting the rows of target whose keycols match one of the
+    tuples in the list named by keys, in chunks which fit in MAX_VARIABLES.
+    Each row is constructed as obj, and the caller writes the loop body.
+    """
+    cols = ", ".join(c.sqlname for c in loaded_columns(target))
+    if record is not None:
+        record(
+            "SELECT "
+            + cols
+            + " FROM "
+            + target.sqlname
+            + " WHERE "
+            + in_clause_sql(keycols),
+            True,
+        )
+    with chunked_in_loop(w, keycols, keys):
+        w.writeline(
+            "stmt = 'SELECT ", cols, " FROM ", target.sqlname, " WHERE ' + where"
+        )
+        w.writeline("cursor.execute(stmt, params)")
+        w.writeline("for row in cursor.fetchall():")
+        with w.indented():
+            w.writeline(
+                "obj = ", query_construct(target, loaded_columns(target), "row")
+            )
+            yield
+
+
+def is_rowid_alias(column: Column) -> bool:
+    """
+    Returns whether column is the INTEGER PRIMARY KEY of its table, which
+    aliases the rowid and so is never NULL whatever its declaration. this is
+    found by the analyser, the normalised sqltype can't tell INTEGER from INT.
+    """
+    return column.rowid_alias
+
+
+def page_key(
+    key: list[Column],
+    unique: bool,
+    tiebreak: list[Column],
+    not_null: Callable[[Column], bool],
+) -> Optional[list[Column]]:
+    """
+    Returns the columns a keyset page method over an index on key orders by,
+    or None if the index can't be paged.
+
+    A non unique key is followed by the tiebreak columns (the primary key),
+    otherwise rows sharing a key at a page boundary are skipped. Without a
+    primary key there is no tie-breaker: the rowid would do, but the models
+    don't load it, so callers couldn't pass it back as the key to continue
+    after. Every key column must also be NOT NULL, since NULL never compares
+    greater than a key and a page ending on a NULL key couldn't be continued.
+    """
+    if not unique:
+        if not tiebreak:
+            return None
+        key = key + [c for c in tiebreak if c not in key]
+    if not all(not_null(c) for c in key):
+        return None
+    return key
+
+
+def generate_page_query(
+    w: Writer,
+    target: Union[Table, View],
+    name: str,
+    key: list[Column],
+    record: Optional[Recorder] = None,
+):
+    """
+    Writes a method returning a page of the rows of target in key order,
+    starting after the given key.
+    """
+    # keyset pagination: each page seeks directly to the last key of the
+    # previous page, so every page costs the same regardless of depth
+    cols = ", ".join(c.sqlname for c in loaded_columns(target))
+    keycols = ", ".join(c.sqlname for c in key)
+    if len(key) == 1:
+        where = key[0].sqlname + " > ?"
+    else:
+        where = "(" + keycols + ") > (" + ", ".join("?" for _ in key) + ")"
+    first = "SELECT " + cols + " FROM " + target.sqlname
+    first += " ORDER BY " + keycols + " LIMIT ?"
+    after = "SELECT " + cols + " FROM " + target.sqlname + " WHERE " + where
+    after += " ORDER BY " + keycols + " LIMIT ?"
+    if record is not None:
+        record(first, False)
+        record(after, True)
     w.writeline("@staticmethod")
     w.writeline(
         "def ",
-        query.name,
-        "(cursor: 'DBAPICursor', ",
-        ", ".join(f"{n}: {t}" for n, t in params),
-        ") -> ",
-        ret,
-        ":",
+        name,
+        "(cursor: 'DBAPICursor', after: Optional[tuple[",
+        ", ".join(c.pytype for c in key),
+        "]] = None, limit: int = FETCH_BATCH_SIZE) -> list['",
+        target.pyname,
+        "']:",
     )
-
-    cols = query_select_cols(sql, target)
     with w.indented():
-        fields: list[str] = []
-        for i, col in enumerate(cols):
-            f = next(c for c in target.columns if c.sqlname == col.sqlname)
-            fields += [f.pyname + " = " + f.val_from_sql(f"res[{i}]")]
-        w.writeline("stmt = '''" + sql + "'''")
+        w.writeline("if after is None:")
+        with w.indented():
+            w.writeline("stmt = '", first, "'")
+            w.writeline("cursor.execute(stmt, [limit])")
+        w.writeline("else:")
+        with w.indented():
+            w.writeline("stmt = '", after, "'")
+            w.writeline(
+                "cursor.execute(stmt, [",
+                "".join(c.val_to_sql(f"after[{i}]") + ", " for i, c in enumerate(key)),
+                "limit])",
+            )
         w.writeline(
-            "cursor.execute(stmt, [",
-            ", ".join(p[0] for p in params),
-            "])",
+            "return [",
+            query_construct(target, loaded_columns(target), "res"),
+            " for res in cursor.fetchall()]",
         )
+    w.writeline()
+
+
+def generate_query(
+    w: Writer,
+    target: Union[Table, View],
+    query: Query,
+    identity_key: Optional[str] = None,
+    cache_table: Optional[str] = None,
+    result: Optional[str] = None,
+    record: Optional[Recorder] = None,
+):
+    """
+    Writes a method running query. Rows are returned as target models, or as
+    the named tuple type result if one is given.
+    """
+    sql, params = query_replace_params(query.sql)
+    if record is not None:
+        record(sql, bool(params))
+
+    typ = result or target.pyname
+    if query.one:
+        ret = "Optional['" + typ + "']"
+    else:
+        ret = "Generator['" + typ + "', None, None]"
+
+    args = ["cursor: 'DBAPICursor'"] + [f"{n}: {t}" for n, t in params]
+    if not query.one:
+        args += ["batch_size: int = FETCH_BATCH_SIZE"]
+
+    w.writeline("@staticmethod")
+    w.writeline("def ", query.name, "(", ", ".join(args), ") -> ", ret, ":")
+
+    cols = query_select_cols(sql, target)
+    if result is not None:
+        construct = result_construct(result, cols, "res")
+    else:
+        construct = query_construct(target, cols, "res")
+    with w.indented():
+        if identity_key is not None:
+            # single row lookups by primary key go through the identity map
+            w.writeline("imap = IDENTITY_MAP.get()")
+            w.writeline("if imap is not None:")
+            with w.indented():
+                w.writeline("obj = imap.get(", identity_key, ")")
+                w.writeline("if obj is not None:")
+                with w.indented():
+                    w.writeline("return obj")
+        # named queries may contain any quotes
+        w.writeline("stmt = ", repr(sql))
+        values = "[" + ", ".join(p[0] for p in params) + "]"
+        if cache_table is not None:
+            key = ", ".join(
+                [f"'{cache_table}'", f"'{query.name}'"] + [p[0] for p in params]
+            )
+            w.writeline("cache = result_cache()")
+            fetch = f"cache.fetch(cursor, ({key},), '{cache_table}', stmt, {values})"
         if query.one:
-            w.writeline("res = cursor.fetchone()")
+            if cache_table is not None:
+                w.writeline("if cache is not None:")
+                with w.indented():
+                    w.writeline("rows = ", fetch)
+                    w.writeline("res = rows[0] if rows else None")
+                w.writeline("else:")
+                with w.indented():
+                    w.writeline("cursor.execute(stmt, ", values, ")")
+                    w.writeline("res = cursor.fetchone()")
+            else:
+                w.writeline("cursor.execute(stmt, ", values, ")")
+                w.writeline("res = cursor.fetchone()")
             w.writeline("if res is None:")
             with w.indented():
                 w.writeline("return None")
-            w.writeline(
-                "return ",
-                target.pyname,
-                "(",
-                ", ".join(fields),
-                ")",
-            )
+            if identity_key is not None:
+                w.writeline("obj = ", construct)
+                w.writeline("if imap is not None:")
+                with w.indented():
+                    w.writeline("imap.put(", identity_key, ", obj)")
+                w.writeline("return obj")
+            else:
+                w.writeline("return ", construct)
         else:
-            w.writeline("while res := cursor.fetchone():")
+            if cache_table is not None:
+                w.writeline("if cache is not None:")
+                with w.indented():
+                    w.writeline("for res in ", fetch, ":")
+                    with w.indented():
+                        w.writeline("yield ", construct)
+                    w.writeline("return")
+            w.writeline("cursor.execute(stmt, ", values, ")")
+            w.writeline("while rows := cursor.fetchmany(batch_size):")
             with w.indented():
-                w.writeline(
-                    "yield ",
-                    target.pyname,
-                    "(",
-                    ", ".join(fields),
-                    ")",
-                )
+                w.writeline("for res in rows:")
+                with w.indented():
+                    w.writeline("yield ", construct)
     w.writeline()
@@ -1,11 +1,35 @@
+import ast
 import os
 import re
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 
-from pianola.generate.sqlite.query import generate_query
+from pianola.generate.options import Options
+from pianola.generate.sqlite.query import (
+    Recorder,
+    chunked_in_loop,
+    chunked_in_query,
+    generate_page_query,
+    generate_query,
+    in_clause_sql,
+    is_rowid_alias,
+    loaded_columns,
+    page_key,
+    query_construct,
+    query_replace_params,
+    query_select_cols,
+)
+from pianola.lib.pytypes.sql import BYTES_TYPES, col_numeric_type
 from pianola.lib.schema.sql import Column, Query, Table
-from pianola.lib.stringutils import quote, sql_to_module_name
+from pianola.lib.stringutils import (
+    query_to_result_name,
+    quote,
+    sql_to_class_name,
+    sql_to_collection_name,
+    sql_to_module_name,
+)
 from pianola.lib.writer import Writer
 
 ALLOWED_TYPES = ["int", "float", "str", "bytes"]
@@ -17,8 +41,10 @@ def generate_table(
     outdir: Path,
     package_name: str,
     queries: list[Query],
+    options: Options = Options(),
+    tables: list[Table] = [],
 ):
-    generator = TableGenerator(table, outdir, package_name, queries)
+    generator = TableGenerator(table, outdir, package_name, queries, options, tables)
     generator.generate()
 
 
@@ -34,17 +60,42 @@ def get_and_replace_param(param: str, params: list[tuple[str, str]]):
 
 class TableGenerator:
     def __init__(
-        self, table: Table, outdir: Path, package_name: str, queries: list[Query]
+        self,
+        table: Table,
+        outdir: Path,
+        package_name: str,
+        queries: list[Query],
+        options: Options = Options(),
+        tables: list[Table] = [],
     ):
         self.table = table
         self.outdir = outdir
         self.package_name = package_name
+        self.options = options
+        self.tables = tables
         self.sqlname = quote(table.sqlname, '"' if table.quoted else "")
         self.queries = self.index_queries() + queries
+        self.cached_queries = [q.name for q in self.index_queries()]
+        # queries selecting some other set of columns than a model is loaded
+        # from return a named tuple of just those columns
+        self.results: dict[str, list[Column]] = {}
+        for query in queries:
+            cols = query_select_cols(query_replace_params(query.sql)[0], table)
+            names = [c.sqlname for c in cols]
+            if names != [c.sqlname for c in loaded_columns(table)] and names != [
+                c.sqlname for c in table.columns
+            ]:
+                self.results[query.name] = cols
+        self.relations = self.table_relations()
+        self.deferred = [c for c in table.columns if c.deferred]
+        self.pks = [c for c in table.columns if c.primary_key]
+        self.identity = options.identity_map and bool(self.pks)
+        # (method, sql, keyed) of each statement written, see statements()
+        self.recorded: list[tuple[str, str, bool]] = []
 
     def index_queries(self) -> list[Query]:
         queries: list[Query] = []
-        cols = ", ".join(c.sqlname for c in self.table.columns)
+        cols = ", ".join(c.sqlname for c in loaded_columns(self.table))
         for index in self.table.indices:
             name = "by_" + "_".join(c.pyname for c in index.columns)
             where = " AND ".join(
@@ -71,25 +122,160 @@ class TableGenerator:
         ]
         return queries
 
+    def table_relations(
+        self,
+    ) -> list[tuple[str, Table, list[Column], list[Column], bool]]:
+        """
+        Returns the (name, target table, key columns, target key columns, many)
+        of each foreign key relation to or from a generated table.
+        """
+        relations: list[tuple[str, Table, list[Column], list[Column], bool]] = []
+        for fk in self.table.foreign_keys:
+            if any(fk.table is t for t in self.tables):
+                name = sql_to_module_name(fk.table.sqlname)
+                relations += [(name, fk.table, fk.columns, fk.references, False)]
+        for table in self.tables:
+            for fk in table.foreign_keys:
+                if fk.table is self.table:
+                    name = sql_to_collection_name(table.sqlname)
+                    relations += [(name, table, fk.references, fk.columns, True)]
+
+        # disambiguate multiple relations to the same table by their columns
+        names = [r[0] for r in relations]
+        for i, (name, table, cols, target_cols, many) in enumerate(relations):
+            if names.count(name) > 1:
+                fkcols = target_cols if many else cols
+                name += "_by_" + "_".join(c.pyname for c in fkcols)
+                relations[i] = (name, table, cols, target_cols, many)
+        return relations
+
     def generate(self):
         filename = sql_to_module_name(self.table.sqlname) + ".py"
         with Writer(self.outdir / filename) as w:
-            self.generate_header(w)
-            self.generate_class_header(w)
-            with w.indented():
-                for field in self.table.columns:
-                    self.generate_field_property(w, field)
-                self.generate_insert(w)
-                self.generate_update(w)
-                self.generate_delete(w)
-                for query in self.queries:
-                    generate_query(w, self.table, query)
+            self.generate_module(w)
+
+    def generate_module(self, w: Writer):
+        self.recorded = []
+        self.generate_header(w)
+        self.generate_statements(w)
+        self.generate_fields(w)
+        self.generate_results(w)
+        self.generate_class_header(w)
+        with w.indented():
+            for field in self.table.columns:
+                self.generate_field_property(w, field)
+            self.generate_insert(w)
+            self.generate_insert_many(w)
+            self.generate_upserts(w)
+            self.generate_update(w)
+            self.generate_update_many(w)
+            self.generate_delete(w)
+            self.generate_delete_many(w)
+            self.generate_delete_where(w)
+            for query in self.queries:
+                identity_key = None
+                if self.identity and query.name == self.pk_query_name():
+                    identity_key = self.identity_key("")
+                cache_table = None
+                if self.options.result_cache and query.name in self.cached_queries:
+                    cache_table = self.table.sqlname
+                result = None
+                if query.name in self.results:
+                    result = query_to_result_name(query.name)
+                generate_query(
+                    w,
+                    self.table,
+                    query,
+                    identity_key,
+                    cache_table,
+                    result,
+                    self.recorder(query.name),
+                )
+            self.generate_get_columns(w)
+            self.generate_page_queries(w)
+            self.generate_many_queries(w)
+            self.generate_count_queries(w)
+            self.generate_aggregates(w)
+            self.generate_load_deferred(w)
+            self.generate_blob_methods(w)
+            self.generate_relations(w)
+
+    def method_names(self) -> list[str]:
+        """
+        Returns the names of the methods of the generated model class.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "model.py"
+            with Writer(path) as w:
+                self.generate_module(w)
+            tree = ast.parse(path.read_text())
+        return [
+            node.name
+            for cls in tree.body
+            if isinstance(cls, ast.ClassDef) and cls.name == self.table.pyname
+            for node in cls.body
+            if isinstance(node, ast.FunctionDef)
+        ]
+
+    def record(self, method: str, sql: str, keyed: bool) -> str:
+        """
+        Records a statement as it is written into method, returning sql.
+        """
+        self.recorded += [(method, sql, keyed)]
+        return sql
+
+    def recorder(self, method: str) -> Recorder:
+        return lambda sql, keyed: self.record(method, sql, keyed)
+
+    def statements(self) -> list[tuple[str, str, bool]]:
+        """
+        Returns the (method, sql, keyed) of the statements run by the
+        generated methods, where keyed methods look rows up by a key. The
+        statements are recorded while generating the module, statements whose
+        text is built at runtime are given for all columns or a single key.
+        """
+        with Writer(os.devnull) as w:
+            self.generate_module(w)
+        return self.recorded
+
+    def identity_key(self, prefix: str) -> str:
+        return (
+            "('"
+            + self.table.sqlname
+            + "', ("
+            + ", ".join(prefix + c.pyname for c in self.pks)
+            + ",))"
+        )
+
+    def pk_query_name(self) -> str:
+        return "by_" + "_".join(c.pyname for c in self.pks)
+
+    @contextmanager
+    def identity_map(self, w: Writer):
+        w.writeline("imap = IDENTITY_MAP.get()")
+        w.writeline("if imap is not None:")
+        with w.indented():
+            yield
+
+    def generate_touch(self, w: Writer):
+        # invalidates cached results once the write is committed or rolled
+        # back, so that a query racing with it cannot cache stale rows under
+        # the new version
+        if self.options.result_cache:
+            w.writeline("touch_table(cursor.connection, '", self.table.sqlname, "')")
+
+    def generate_identity_put(self, w: Writer, obj: str):
+        if self.identity:
+            with self.identity_map(w):
+                w.writeline("imap.put(", self.identity_key(obj + "._"), ", ", obj, ")")
 
     def generate_header(self, w: Writer):
         w.writeline(
             "from ",
             self.package_name,
-            ".utils import _UNSET",
+            ".utils import _UNSET, UNSET, NoRowsError, MAX_VARIABLES, FETCH_BATCH_SIZE, ",
+            "BLOB_CHUNK_SIZE, IDENTITY_MAP, column_buffer, column_result, open_blob, copy_to_blob, ",
+            "result_cache, touch_table, LOAD_ON_ACCESS",
         )
         w.writeline(
             "from ",
@@ -112,21 +298,62 @@ class TableGenerator:
             "optional_decimal_to_sql, ",
             "optional_decimal_from_sql",
         )
-        w.writeline("from typing import Union, Optional, Any, Generator, TYPE_CHECKING")
+        w.writeline(
+            "from typing import Union, Optional, Any, Generator, Iterable, Sequence, NamedTuple, TYPE_CHECKING"
+        )
         w.writeline("from datetime import date, datetime, time")
         w.writeline("from decimal import Decimal")
         w.writeline("if TYPE_CHECKING:")
         with w.indented():
             w.writeline("from _typeshed.dbapi import DBAPICursor")
+            for target in {r[1].sqlname: r[1] for r in self.relations}.values():
+                if target is not self.table:
+                    w.writeline(
+                        "from ",
+                        self.package_name,
+                        ".",
+                        sql_to_module_name(target.sqlname),
+                        " import ",
+                        sql_to_class_name(target.sqlname),
+                    )
         w.writeline()
 
+    def unset(self, expr: str) -> str:
+        if self.options.slots:
+            return expr + " is UNSET"
+        return "isinstance(" + expr + ", _UNSET)"
+
+    def not_unset(self, expr: str) -> str:
+        if self.options.slots:
+            return expr + " is not UNSET"
+        return "not isinstance(" + expr + ", _UNSET)"
+
+    def generate_results(self, w: Writer):
+        for name, cols in self.results.items():
+            w.writeline("class ", query_to_result_name(name), "(NamedTuple):")
+            with w.indented():
+                for column in cols:
+                    w.writeline(column.pyname, ": ", column.pytype)
+            w.writeline()
+
     def generate_class_header(self, w: Writer):
         w.writeline("class ", self.table.pyname, ":")
         with w.indented():
+            if self.options.slots:
+                slots = [f"'_{f.pyname}'" for f in self.table.columns]
+                slots += [f"'_rel_{r[0]}'" for r in self.relations]
+                slots += ["'_dirty'"]
+                if self.deferred:
+                    slots += ["'_conn'"]
+                w.writeline(
+                    "__slots__ = (", ", ".join(slots), "," * (len(slots) == 1), ")"
+                )
+                w.writeline()
+            default = "UNSET" if self.options.slots else "_UNSET()"
             w.writeline(
                 "def __init__(self, ",
                 ", ".join(
-                    f"{f.pyname}: Union[{f.pytype}, _UNSET] = _UNSET()"
+                    f"{f.pyname}: Union[{f.pytype}, _UNSET] = {default}"
                     for f in self.table.columns
                 ),
                 "):",
@@ -141,159 +368,1166 @@ class TableGenerator:
                         ", _UNSET] = ",
                         field.pyname,
                     )
+                # bitmask of the fields modified since the model was loaded
+                w.writeline("self._dirty = 0")
+                for i, field in enumerate(self.table.columns):
+                    w.writeline("if ", self.not_unset(field.pyname), ":")
+                    with w.indented():
+                        w.writeline("self._dirty |= ", 1 << i)
+                if self.deferred:
+                    # connection used to load deferred fields on first access
+                    w.writeline("self._conn: Any = None")
+            w.writeline()
+
+            w.writeline("def _mark_clean(self) -> '", self.table.pyname, "':")
+            with w.indented():
+                w.writeline("self._dirty = 0")
+                w.writeline("return self")
+            w.writeline()
+
+            # rows holding every loaded column in table order are decoded
+            # without going through the keyword arguments of __init__
+            w.writeline("@classmethod")
+            if self.deferred:
+                w.writeline(
+                    "def _from_row(cls, row: Sequence[Any], cursor: 'DBAPICursor') -> '",
+                    self.table.pyname,
+                    "':",
+                )
+            else:
+                w.writeline(
+                    "def _from_row(cls, row: Sequence[Any]) -> '",
+                    self.table.pyname,
+                    "':",
+                )
+            with w.indented():
+                w.writeline("obj = cls.__new__(cls)")
+                if self.deferred:
+                    for i, column in enumerate(loaded_columns(self.table)):
+                        w.writeline(
+                            "obj._",
+                            column.pyname,
+                            " = ",
+                            column.val_from_sql(f"row[{i}]"),
+                        )
+                    for column in self.deferred:
+                        w.writeline("obj._", column.pyname, " = UNSET")
+                    w.writeline("obj._dirty = 0")
+                    w.writeline(
+                        "obj._conn = cursor.connection if LOAD_ON_ACCESS.get() else None"
+                    )
+                else:
+                    self.generate_assign_row(w, "obj", "row")
+                w.writeline("return obj")
             w.writeline()
 
     def generate_field_property(self, w: Writer, field: Column):
         w.writeline("@property")
         w.writeline("def ", field.pyname, "(self) -> ", field.pytype, ":")
         with w.indented():
-            w.writeline("if isinstance(self._", field.pyname, ", _UNSET):")
+            w.writeline("if ", self.unset("self._" + field.pyname), ":")
             with w.indented():
-                w.writeline("raise ValueError('", field.pyname, " is unset')")
+                if field.deferred:
+                    self.generate_load_deferred_field(w, field)
+                else:
+                    w.writeline("raise ValueError('", field.pyname, " is unset')")
             w.writeline("return self._", field.pyname)
         w.writeline("@", field.pyname, ".setter")
         w.writeline("def ", field.pyname, "(self, t: ", field.pytype, "):")
         with w.indented():
             w.writeline("self._", field.pyname, " = t")
+            w.writeline("self._dirty |= ", 1 << self.table.columns.index(field))
+        w.writeline()
+
+    def generate_load_deferred_field(self, w: Writer, field: Column):
+        # loaded on a new cursor so that a query being iterated over on the
+        # cursor which loaded the model is not interrupted
+        pks = [c for c in self.table.columns if c.primary_key]
+        sql = self.record(
+            field.pyname,
+            "SELECT "
+            + field.sqlname
+            + " FROM "
+            + self.table.sqlname
+            + " WHERE "
+            + " AND ".join(f"{c.sqlname} = ?" for c in pks),
+            True,
+        )
+        w.writeline("if self._conn is None:")
+        with w.indented():
+            w.writeline(
+                "raise ValueError('",
+                field.pyname,
+                " is not loaded, see load_deferred')",
+            )
+        w.writeline(
+            "row = self._conn.execute('",
+            sql,
+            "', [",
+            ", ".join(c.val_to_sql("self._" + c.pyname) for c in pks),
+            "]).fetchone()",
+        )
+        w.writeline("if row is None:")
+        with w.indented():
+            w.writeline("raise NoRowsError")
+        w.writeline("self._", field.pyname, " = ", field.val_from_sql("row[0]"))
+
+    def insert_sql(self, mask: int, returning: bool, conflict: int = 0) -> str:
+        """
+        Returns the statement which _insert_stmt builds at runtime.
+
+        Statements insert a single row: rows which read back generated values
+        are inserted with one execute and fetchone each, as the order of the
+        rows returned by a multi-row insert is unspecified.
+        """
+        cols = [c.sqlname for i, c in enumerate(self.table.columns) if mask >> i & 1]
+        if not cols:
+            stmt = "INSERT INTO " + self.table.sqlname + " DEFAULT VALUES"
+        else:
+            placeholders = "(" + ", ".join("?" for _ in cols) + ")"
+            stmt = (
+                "INSERT INTO "
+                + self.table.sqlname
+                + "("
+                + ", ".join(cols)
+                + ") VALUES "
+                + placeholders
+            )
+            if conflict:
+                target = [
+                    c.sqlname
+                    for i, c in enumerate(self.table.columns)
+                    if conflict >> i & 1
+                ]
+                # the conflicting row keeps its key, which is never updated
+                keep = conflict | self.pk_mask()
+                update = ", ".join(
+                    c.sqlname + " = excluded." + c.sqlname
+                    for i, c in enumerate(self.table.columns)
+                    if mask >> i & 1 and not keep >> i & 1
+                )
+                stmt += (
+                    " ON CONFLICT("
+                    + ", ".join(target)
+                    + ") DO UPDATE SET "
+                    + (update or target[0] + " = " + target[0])
+                )
+        if returning:
+            stmt += " RETURNING " + ", ".join(
+                c.sqlname for c in loaded_columns(self.table)
+            )
+        return stmt
+
+    def update_sql(self, mask: int, returning: bool) -> str:
+        where = " AND ".join(
+            f"{c.sqlname} = ?" for c in self.table.columns if c.primary_key
+        )
+        cols = [c.sqlname for i, c in enumerate(self.table.columns) if mask >> i & 1]
+        stmt = (
+            "UPDATE "
+            + self.table.sqlname
+            + " SET "
+            + ", ".join(c + " = ?" for c in cols)
+            + " WHERE "
+            + where
+        )
+        if returning:
+            stmt += " RETURNING " + ", ".join(
+                c.sqlname for c in loaded_columns(self.table)
+            )
+        return stmt
+
+    def generate_statements(self, w: Writer):
+        # statements only depend on which columns are set, so they are cached
+        # at module level keyed by a bitmask of the set columns (bit i is
+        # column i). keeping the sql text identical between calls also lets
+        # the sqlite3 statement cache hit.
+        columns = self.table.columns
+        all_mask = (1 << len(columns)) - 1
+        names = [f"'{c.sqlname}'" for c in columns]
+        w.writeline("_COLUMNS = (", ", ".join(names), "," * (len(names) == 1), ")")
+        w.writeline()
+
+        # upserts are inserts with a conflict target, which is also a bitmask
+        w.writeline("_insert_stmts: dict[tuple[int, bool, int], str] = {")
+        with w.indented():
+            for key in [(all_mask, True), (all_mask, False), (0, True)]:
+                w.writeline(key + (0,), ": '", self.insert_sql(*key), "',")
+        w.writeline("}")
+        w.writeline()
+
+        w.writeline(
+            "def _insert_stmt(mask: int, returning: bool = True, ",
+            "conflict: int = 0) -> str:",
+        )
+        with w.indented():
+            w.writeline("if mask == 0:")
+            with w.indented():
+                w.writeline("# DEFAULT VALUES cannot be upserted")
+                w.writeline("conflict = 0")
+            w.writeline("key = (mask, returning, conflict)")
+            w.writeline("stmt = _insert_stmts.get(key)")
+            w.writeline("if stmt is None:")
+            with w.indented():
+                w.writeline(
+                    "cols = [c for i, c in enumerate(_COLUMNS) if mask >> i & 1]"
+                )
+                w.writeline("placeholders = '(' + ', '.join('?' for _ in cols) + ')'")
+                w.writeline(
+                    "stmt = 'INSERT INTO ",
+                    self.table.sqlname,
+                    "(' + ', '.join(cols) + ') VALUES ' + placeholders",
+                )
+                w.writeline("if conflict:")
+                with w.indented():
+                    w.writeline(
+                        "target = [c for i, c in enumerate(_COLUMNS) if conflict >> i & 1]"
+                    )
+                    if self.pk_mask():
+                        w.writeline("keep = conflict | ", self.pk_mask())
+                    else:
+                        w.writeline("keep = conflict")
+                    w.writeline(
+                        "update = ', '.join(c + ' = excluded.' + c ",
+                        "for i, c in enumerate(_COLUMNS) if mask >> i & 1 and not keep >> i & 1)",
+                    )
+                    w.writeline(
+                        "# updating a target column to itself still returns the row"
+                    )
+                    w.writeline(
+                        "stmt += ' ON CONFLICT(' + ', '.join(target) + ') DO UPDATE SET ' + ",
+                        "(update or target[0] + ' = ' + target[0])",
+                    )
+                w.writeline("if returning:")
+                with w.indented():
+                    w.writeline(
+                        "stmt += ' RETURNING ",
+                        ", ".join(c.sqlname for c in loaded_columns(self.table)),
+                        "'",
+                    )
+                w.writeline("_insert_stmts[key] = stmt")
+            w.writeline("return stmt")
+        w.writeline()
+
+        if not self.has_update():
+            return
+
+        update_mask = self.update_mask()
+        w.writeline("_update_stmts: dict[tuple[int, bool], str] = {")
+        with w.indented():
+            for returning in [True, False]:
+                w.writeline(
+                    (update_mask, returning),
+                    ": '",
+                    self.update_sql(update_mask, returning),
+                    "',",
+                )
+        w.writeline("}")
+        w.writeline()
+
+        w.writeline("def _update_stmt(mask: int, returning: bool = True) -> str:")
+        with w.indented():
+            w.writeline("key = (mask, returning)")
+            w.writeline("stmt = _update_stmts.get(key)")
+            w.writeline("if stmt is None:")
+            with w.indented():
+                w.writeline(
+                    "cols = [c for i, c in enumerate(_COLUMNS) if mask >> i & 1]"
+                )
+                w.writeline(
+                    "stmt = 'UPDATE ",
+                    self.table.sqlname,
+                    " SET ' + ', '.join(c + ' = ?' for c in cols) + ' WHERE ",
+                    " AND ".join(f"{c.sqlname} = ?" for c in columns if c.primary_key),
+                    "'",
+                )
+                w.writeline("if returning:")
+                with w.indented():
+                    w.writeline(
+                        "stmt += ' RETURNING ",
+                        ", ".join(c.sqlname for c in loaded_columns(self.table)),
+                        "'",
+                    )
+                w.writeline("_update_stmts[key] = stmt")
+            w.writeline("return stmt")
+        w.writeline()
+
+    def generate_fields(self, w: Writer):
+        # field name -> (column name, array typecode, converter)
+        w.writeline("_FIELDS: dict[str, tuple[str, Optional[str], Any]] = {")
+        with w.indented():
+            for c in self.table.columns:
+                typecode = f"'{c.array_type}'" if c.array_type else None
+                w.writeline(
+                    f"'{c.pyname}': ('{c.sqlname}', {typecode}, {c.from_sql_func()}),"
+                )
+        w.writeline("}")
         w.writeline()
 
     def generate_set_cols(
         self,
         w: Writer,
-        colsname: str,
+        maskname: str,
         valsname: Optional[str],
         include_primary_keys: bool = True,
+        obj: str = "self",
     ):
-        w.writeline(colsname, ": list[str] = []")
+        w.writeline(maskname, " = 0")
         if valsname:
             w.writeline(valsname, ": list[Any] = []")
-        for field in self.table.columns:
+        for i, field in enumerate(self.table.columns):
             if not include_primary_keys and field.primary_key:
                 continue
-            w.writeline("if not isinstance(self._", field.pyname, ", _UNSET):")
+            w.writeline("if ", self.not_unset(obj + "._" + field.pyname), ":")
             with w.indented():
-                w.writeline(colsname, " += ['", field.sqlname, "']")
+                w.writeline(maskname, " |= ", 1 << i)
                 if valsname:
                     w.writeline(
                         valsname,
                         " += [",
-                        field.val_to_sql("self._" + field.pyname),
+                        field.val_to_sql(obj + "._" + field.pyname),
                         "]",
                     )
 
-    def generate_insert(self, w: Writer):
-        w.writeline("def insert(self, cursor: 'DBAPICursor'):")
+    def generate_assign_row(self, w: Writer, obj: str, rowname: str):
+        # deferred columns aren't returned, they keep the value which was
+        # written or are loaded later
+        for i, column in enumerate(loaded_columns(self.table)):
+            w.writeline(
+                obj,
+                "._",
+                column.pyname,
+                " = ",
+                column.val_from_sql(f"{rowname}[{i}]"),
+            )
+        w.writeline(obj, "._dirty = 0")
+        if self.deferred:
+            w.writeline(
+                obj, "._conn = cursor.connection if LOAD_ON_ACCESS.get() else None"
+            )
+
+    def generate_insert(self, w: Writer, name: str = "insert", conflict: int = 0):
+        all_mask = (1 << len(self.table.columns)) - 1
+        self.record(name, self.insert_sql(all_mask, True, conflict), False)
+        w.writeline("def ", name, "(self, cursor: 'DBAPICursor'):")
         with w.indented():
-            self.generate_set_cols(w, "cols", "values")
+            self.generate_set_cols(w, "mask", "values")
             w.writeline()
-            w.writeline("if cols:")
+            if conflict:
+                w.writeline(
+                    "cursor.execute(_insert_stmt(mask, conflict=",
+                    conflict,
+                    "), values)",
+                )
+            else:
+                w.writeline("cursor.execute(_insert_stmt(mask), values)")
+            w.writeline("row = cursor.fetchone()")
+            w.writeline("if row is None:")
+            with w.indented():
+                w.writeline("raise NoRowsError")
+            self.generate_assign_row(w, "self", "row")
+            self.generate_identity_put(w, "self")
+            self.generate_touch(w)
+        w.writeline()
+
+    def generate_insert_many(
+        self, w: Writer, name: str = "insert_many", conflict: int = 0
+    ):
+        all_mask = (1 << len(self.table.columns)) - 1
+        single = name.replace("_many", "")
+        # rows setting every column are written without reading back
+        self.record(name, self.insert_sql(all_mask, False, conflict), False)
+        w.writeline("@classmethod")
+        w.writeline(
+            "def ",
+            name,
+            "(cls, cursor: 'DBAPICursor', rows: Iterable['",
+            self.table.pyname,
+            "'], chunk_size: Optional[int] = None):",
+        )
+        with w.indented():
+            w.writeline("if chunk_size is not None and chunk_size < 1:")
+            with w.indented():
+                w.writeline("raise ValueError('chunk_size must be at least 1')")
+            # rows are grouped by the columns they set so that each group
+            # shares a single statement
+            w.writeline(
+                "groups: dict[int, list[tuple['",
+                self.table.pyname,
+                "', list[Any]]]] = {}",
+            )
+            w.writeline("for obj in rows:")
+            with w.indented():
+                self.generate_set_cols(w, "mask", "values", obj="obj")
+                w.writeline("groups.setdefault(mask, []).append((obj, values))")
+            w.writeline()
+            w.writeline("for mask, group in groups.items():")
+            with w.indented():
+                w.writeline("if mask == 0:")
+                with w.indented():
+                    w.writeline("for obj, _ in group:")
+                    with w.indented():
+                        w.writeline("obj.", single, "(cursor)")
+                    w.writeline("continue")
+                w.writeline("if mask == ", all_mask, ":")
+                with w.indented():
+                    # nothing is generated by the database, so there is no
+                    # need to read anything back
+                    w.writeline("stmt = _insert_stmt(mask, False, ", conflict, ")")
+                    w.writeline("size = chunk_size or len(group)")
+                    w.writeline("for i in range(0, len(group), size):")
+                    with w.indented():
+                        w.writeline(
+                            "cursor.executemany(stmt, [v for _, v in group[i : i + size]])"
+                        )
+                    w.writeline("for obj, _ in group:")
+                    with w.indented():
+                        w.writeline("obj._dirty = 0")
+                    w.writeline("continue")
+                # the order of the rows returned by a multi-row insert is
+                # unspecified, so rows which read back generated values are
+                # inserted one at a time through a single cached statement
+                w.writeline("stmt = _insert_stmt(mask, True, ", conflict, ")")
+                w.writeline("for obj, values in group:")
+                with w.indented():
+                    w.writeline("cursor.execute(stmt, values)")
+                    w.writeline("row = cursor.fetchone()")
+                    w.writeline("if row is None:")
+                    with w.indented():
+                        w.writeline("raise NoRowsError")
+                    self.generate_assign_row(w, "obj", "row")
+            if self.identity:
+                with self.identity_map(w):
+                    w.writeline("for group in groups.values():")
+                    with w.indented():
+                        w.writeline("for obj, _ in group:")
+                        with w.indented():
+                            w.writeline(
+                                "imap.put(", self.identity_key("obj._"), ", obj)"
+                            )
+            self.generate_touch(w)
+        w.writeline()
+
+    def generate_upserts(self, w: Writer):
+        generated: set[str] = set()
+        for index in self.table.indices:
+            if not index.unique:
+                continue
+            suffix = "_on_" + "_".join(c.pyname for c in index.columns)
+            if suffix in generated:
+                continue
+            generated.add(suffix)
+            conflict = sum(
+                1 << i for i, c in enumerate(self.table.columns) if c in index.columns
+            )
+            self.generate_insert(w, "upsert" + suffix, conflict)
+            self.generate_insert_many(w, "upsert_many" + suffix, conflict)
+
+    def pk_mask(self) -> int:
+        return sum(1 << i for i, c in enumerate(self.table.columns) if c.primary_key)
+
+    def update_mask(self) -> int:
+        return sum(
+            1 << i for i, c in enumerate(self.table.columns) if not c.primary_key
+        )
+
+    def has_update(self) -> bool:
+        # rows can only be updated by primary key, and there must be something
+        # other than the primary key to update
+        pks = [c.primary_key for c in self.table.columns]
+        return any(pks) and not all(pks)
+
+    def generate_update_values(self, w: Writer, obj: str, skip: str):
+        # only the fields modified since the model was loaded are written
+        w.writeline("mask = ", obj, "._dirty & ", self.update_mask())
+        w.writeline("if not mask:")
+        with w.indented():
+            w.writeline(skip)
+        w.writeline("values: list[Any] = []")
+        for i, field in enumerate(self.table.columns):
+            if field.primary_key:
+                continue
+            w.writeline("if mask & ", 1 << i, ":")
             with w.indented():
                 w.writeline(
-                    "stmt = 'INSERT INTO ",
-                    self.table.sqlname,
-                    "(' + ', '.join(cols) + ') VALUES (' + ', '.join('?' for _ in values) + ') RETURNING ",
-                    ", ".join(c.sqlname for c in self.table.columns),
-                    "'",
+                    "values += [", field.val_to_sql(obj + "._" + field.pyname), "]"
                 )
-            w.writeline("else:")
+        for column in self.table.columns:
+            if not column.primary_key:
+                continue
+            w.writeline("if ", self.unset(obj + "._" + column.pyname), ":")
             with w.indented():
                 w.writeline(
-                    "stmt = 'INSERT INTO ",
-                    self.table.sqlname,
-                    " DEFAULT VALUES RETURNING ",
-                    ", ".join(c.sqlname for c in self.table.columns),
-                    "'",
+                    "raise ValueError('primary key ",
+                    column.pyname,
+                    " not set')",
                 )
-            w.writeline("cursor.execute(stmt, values)")
+            w.writeline("values += [", obj, "._", column.pyname, "]")
+
+    def generate_update(self, w: Writer):
+        if not self.has_update():
+            return
+
+        self.record("update", self.update_sql(self.update_mask(), True), True)
+        w.writeline("def update(self, cursor: 'DBAPICursor'):")
+        with w.indented():
+            self.generate_update_values(w, "self", "return")
+            w.writeline()
+            w.writeline("cursor.execute(_update_stmt(mask), values)")
             w.writeline("row = cursor.fetchone()")
             w.writeline("if row is None:")
             with w.indented():
                 w.writeline("raise NoRowsError")
-            for i, column in enumerate(self.table.columns):
+            self.generate_assign_row(w, "self", "row")
+            self.generate_identity_put(w, "self")
+            self.generate_touch(w)
+        w.writeline()
+
+    def generate_update_many(self, w: Writer):
+        if not self.has_update():
+            return
+
+        self.record("update_many", self.update_sql(self.update_mask(), False), True)
+        w.writeline("@staticmethod")
+        w.writeline(
+            "def update_many(cursor: 'DBAPICursor', rows: Iterable['",
+            self.table.pyname,
+            "']) -> int:",
+        )
+        with w.indented():
+            # rows are grouped by their modified fields so that each group is
+            # written with a single executemany. nothing is read back, so
+            # values generated by the database are not refreshed.
+            w.writeline(
+                "groups: dict[int, list[tuple['",
+                self.table.pyname,
+                "', list[Any]]]] = {}",
+            )
+            w.writeline("for obj in rows:")
+            with w.indented():
+                self.generate_update_values(w, "obj", "continue")
+                w.writeline("groups.setdefault(mask, []).append((obj, values))")
+            w.writeline()
+            w.writeline("count = 0")
+            w.writeline("for mask, group in groups.items():")
+            with w.indented():
                 w.writeline(
-                    "self._",
-                    column.pyname,
-                    " = ",
-                    column.val_from_sql(f"row[{i}]"),
+                    "cursor.executemany(_update_stmt(mask, False), [v for _, v in group])"
                 )
+                w.writeline("count += cursor.rowcount")
+                w.writeline("for obj, _ in group:")
+                with w.indented():
+                    w.writeline("obj._dirty = 0")
+                    self.generate_identity_put(w, "obj")
+            self.generate_touch(w)
+            w.writeline("return count")
         w.writeline()
 
-    def generate_update(self, w: Writer):
-        # do not generate update if only primary keys
-        if all(c.primary_key for c in self.table.columns):
+    def generate_delete(self, w: Writer):
+        pks = [f for f in self.table.columns if f.primary_key]
+        if not pks:
             return
 
-        w.writeline("def update(self, cursor: 'DBAPICursor'):")
+        sql = self.record(
+            "delete",
+            "DELETE FROM "
+            + self.table.sqlname
+            + " WHERE "
+            + " AND ".join(f"{f.sqlname} = ?" for f in pks),
+            True,
+        )
+        w.writeline("def delete(self, cursor: 'DBAPICursor'):")
         with w.indented():
-            self.generate_set_cols(w, "cols", "values", False)
-            for column in self.table.columns:
-                if not column.primary_key:
-                    continue
-                w.writeline("if isinstance(self._", column.pyname, ", _UNSET):")
-                with w.indented():
-                    w.writeline(
-                        "raise ValueError('primary key ",
-                        column.pyname,
-                        " not set')",
-                    )
-                w.writeline("values += [self._", column.pyname, "]")
+            w.writeline("stmt = '", sql, "'")
+            w.writeline(
+                "cursor.execute(stmt, [",
+                ", ".join(f"self._{f.pyname}" for f in pks),
+                "])",
+            )
+            if self.identity:
+                with self.identity_map(w):
+                    w.writeline("imap.evict(", self.identity_key("self._"), ")")
+            self.generate_touch(w)
+        w.writeline()
+
+    def generate_delete_many(self, w: Writer):
+        pks = [f for f in self.table.columns if f.primary_key]
+        if not pks:
+            return
+
+        keytype = "tuple[" + ", ".join(c.pytype for c in pks) + "]"
+        self.record(
+            "delete_many",
+            "DELETE FROM " + self.table.sqlname + " WHERE " + in_clause_sql(pks),
+            True,
+        )
+        w.writeline("@staticmethod")
+        w.writeline(
+            "def delete_many(cursor: 'DBAPICursor', keys: Iterable[",
+            keytype,
+            "]) -> int:",
+        )
+        with w.indented():
+            w.writeline("keys = list(keys)")
+            w.writeline("count = 0")
+            with chunked_in_loop(w, pks, "keys"):
+                w.writeline(
+                    "cursor.execute('DELETE FROM ",
+                    self.table.sqlname,
+                    " WHERE ' + where, params)",
+                )
+                w.writeline("count += cursor.rowcount")
+            if self.identity:
+                with self.identity_map(w):
+                    w.writeline("for key in keys:")
+                    with w.indented():
+                        w.writeline(
+                            "imap.evict(('", self.table.sqlname, "', tuple(key)))"
+                        )
+            self.generate_touch(w)
+            w.writeline("return count")
+        w.writeline()
 
+    def generate_delete_where(self, w: Writer):
+        generated: set[str] = set()
+        for index in self.table.indices:
+            name = "delete_where_" + "_".join(c.pyname for c in index.columns)
+            if name in generated:
+                continue
+            generated.add(name)
+
+            sql = self.record(
+                name,
+                "DELETE FROM "
+                + self.table.sqlname
+                + " WHERE "
+                + " AND ".join(f"{c.sqlname} = ?" for c in index.columns),
+                True,
+            )
+            w.writeline("@staticmethod")
+            w.writeline(
+                "def ",
+                name,
+                "(cursor: 'DBAPICursor', ",
+                ", ".join(f"{c.pyname}: {c.pytype}" for c in index.columns),
+                ") -> int:",
+            )
+            with w.indented():
+                w.writeline(
+                    "cursor.execute('",
+                    sql,
+                    "', [",
+                    ", ".join(c.val_to_sql(c.pyname) for c in index.columns),
+                    "])",
+                )
+                if self.identity:
+                    # the deleted primary keys are not known
+                    with self.identity_map(w):
+                        w.writeline("imap.evict_table('", self.table.sqlname, "')")
+                self.generate_touch(w)
+                w.writeline("return cursor.rowcount")
             w.writeline()
-            w.writeline("if cols:")
-            where = " AND ".join(
-                f"{c.sqlname} = ?" for c in self.table.columns if c.primary_key
+
+    def generate_get_columns(self, w: Writer):
+        self.record(
+            "get_columns",
+            "SELECT "
+            + ", ".join(c.sqlname for c in self.table.columns)
+            + " FROM "
+            + self.table.sqlname,
+            False,
+        )
+        w.writeline("@staticmethod")
+        w.writeline(
+            "def get_columns(cursor: 'DBAPICursor', ",
+            "columns: Optional[Sequence[str]] = None, ",
+            "batch_size: int = FETCH_BATCH_SIZE) -> dict[str, Any]:",
+        )
+        with w.indented():
+            w.writeline("if columns is None:")
+            with w.indented():
+                w.writeline("columns = list(_FIELDS)")
+            w.writeline("if not columns:")
+            with w.indented():
+                w.writeline("return {}")
+            w.writeline("fields = [_FIELDS[c] for c in columns]")
+            w.writeline(
+                "stmt = 'SELECT ' + ', '.join(f[0] for f in fields) + ' FROM ",
+                self.table.sqlname,
+                "'",
             )
+            w.writeline("cursor.execute(stmt, [])")
+            w.writeline("res = [column_buffer(f[1]) for f in fields]")
+            w.writeline("while rows := cursor.fetchmany(batch_size):")
             with w.indented():
                 w.writeline(
-                    "stmt = 'UPDATE ",
-                    self.table.sqlname,
-                    " SET ' + ",
-                    "', '.join(c + ' = ?' for c in cols)",
-                    " + ' WHERE ",
-                    where,
-                    " RETURNING ",
-                    ", ".join(c.sqlname for c in self.table.columns),
-                    "'",
+                    "for col, (_, _, conv), values in zip(res, fields, zip(*rows)):"
                 )
-            w.writeline("else:")
+                with w.indented():
+                    w.writeline("if conv is None:")
+                    with w.indented():
+                        w.writeline("col.extend(values)")
+                    w.writeline("else:")
+                    with w.indented():
+                        w.writeline("col.extend(map(conv, values))")
+            w.writeline(
+                "return {c: column_result(col) for c, col in zip(columns, res)}"
+            )
+        w.writeline()
+
+    def page_keys(self) -> dict[str, list[Column]]:
+        keys: dict[str, list[Column]] = {}
+        for index in self.table.indices:
+            name = "page_by_" + "_".join(c.pyname for c in index.columns)
+            key = page_key(
+                list(index.columns),
+                index.unique,
+                self.pks,
+                lambda c: not c.nullable or is_rowid_alias(c),
+            )
+            if key is not None:
+                keys.setdefault(name, key)
+        return keys
+
+    def generate_page_queries(self, w: Writer):
+        for name, key in self.page_keys().items():
+            generate_page_query(w, self.table, name, key, self.recorder(name))
+
+    def generate_many_queries(self, w: Writer):
+        generated: set[str] = set()
+        for index in self.table.indices:
+            name = "by_" + "_".join(c.pyname for c in index.columns) + "_many"
+            if name in generated:
+                continue
+            generated.add(name)
+
+            keytype = "tuple[" + ", ".join(c.pytype for c in index.columns) + "]"
+            valtype = f"'{self.table.pyname}'"
+            if not index.unique:
+                valtype = "list[" + valtype + "]"
+
+            w.writeline("@staticmethod")
+            w.writeline(
+                "def ",
+                name,
+                "(cursor: 'DBAPICursor', keys: Iterable[",
+                keytype,
+                "]) -> dict[",
+                keytype,
+                ", ",
+                valtype,
+                "]:",
+            )
+            identity = self.identity and index.columns == self.pks
+            with w.indented():
+                w.writeline("keys = list(dict.fromkeys(keys))")
+                w.writeline("res: dict[", keytype, ", ", valtype, "] = {}")
+                if identity:
+                    # only keys missing from the identity map are queried
+                    with self.identity_map(w):
+                        w.writeline("missing = []")
+                        w.writeline("for key in keys:")
+                        with w.indented():
+                            w.writeline(
+                                "obj = imap.get(('", self.table.sqlname, "', key))"
+                            )
+                            w.writeline("if obj is None:")
+                            with w.indented():
+                                w.writeline("missing.append(key)")
+                            w.writeline("else:")
+                            with w.indented():
+                                w.writeline("res[key] = obj")
+                        w.writeline("keys = missing")
+                with chunked_in_query(
+                    w, self.table, index.columns, "keys", self.recorder(name)
+                ):
+                    objkey = ", ".join("obj._" + c.pyname for c in index.columns)
+                    if index.unique:
+                        w.writeline("res[(", objkey, ",)] = obj")
+                    else:
+                        w.writeline("res.setdefault((", objkey, ",), []).append(obj)")
+                    if identity:
+                        w.writeline("if imap is not None:")
+                        with w.indented():
+                            w.writeline(
+                                "imap.put(", self.identity_key("obj._"), ", obj)"
+                            )
+                w.writeline("return res")
+            w.writeline()
+
+    def generate_count_queries(self, w: Writer):
+        sql = self.record("count", "SELECT COUNT(*) FROM " + self.table.sqlname, False)
+        w.writeline("@staticmethod")
+        w.writeline("def count(cursor: 'DBAPICursor') -> int:")
+        with w.indented():
+            w.writeline("cursor.execute('", sql, "')")
+            w.writeline("return cursor.fetchone()[0]")
+        w.writeline()
+
+        generated: set[str] = set()
+        for index in self.table.indices:
+            suffix = "_by_" + "_".join(c.pyname for c in index.columns)
+            if suffix in generated:
+                continue
+            generated.add(suffix)
+
+            args = ", ".join(f"{c.pyname}: {c.pytype}" for c in index.columns)
+            where = " AND ".join(f"{c.sqlname} = ?" for c in index.columns)
+            values = ", ".join(c.val_to_sql(c.pyname) for c in index.columns)
+
+            sql = self.record(
+                "count" + suffix,
+                "SELECT COUNT(*) FROM " + self.table.sqlname + " WHERE " + where,
+                True,
+            )
+            w.writeline("@staticmethod")
+            w.writeline(
+                "def count", suffix, "(cursor: 'DBAPICursor', ", args, ") -> int:"
+            )
             with w.indented():
                 w.writeline(
-                    'stmt = """SELECT ',
-                    ", ".join(c.sqlname for c in self.table.columns),
-                    " FROM ",
-                    self.table.sqlname,
-                    " WHERE ",
-                    where,
-                    '"""',
+                    "cursor.execute('",
+                    sql,
+                    "', [",
+                    values,
+                    "])",
                 )
-            w.writeline("cursor.execute(stmt, values)")
-            w.writeline("row = cursor.fetchone()")
-            w.writeline("if row is None:")
+                w.writeline("return cursor.fetchone()[0]")
+            w.writeline()
+
+            sql = self.record(
+                "exists" + suffix,
+                "SELECT 1 FROM " + self.table.sqlname + " WHERE " + where + " LIMIT 1",
+                True,
+            )
+            w.writeline("@staticmethod")
+            w.writeline(
+                "def exists", suffix, "(cursor: 'DBAPICursor', ", args, ") -> bool:"
+            )
             with w.indented():
-                w.writeline("raise NoRowsError")
-            for i, column in enumerate(self.table.columns):
                 w.writeline(
-                    "self._",
+                    "cursor.execute('",
+                    sql,
+                    "', [",
+                    values,
+                    "])",
+                )
+                w.writeline("return cursor.fetchone() is not None")
+            w.writeline()
+
+    def generate_aggregates(self, w: Writer):
+        for column in self.table.columns:
+            pytype = col_numeric_type(column)
+            if pytype is None:
+                continue
+            for func in ["min", "max"]:
+                sql = self.record(
+                    func + "_" + column.pyname,
+                    "SELECT "
+                    + func.upper()
+                    + "("
+                    + column.sqlname
+                    + ") FROM "
+                    + self.table.sqlname,
+                    False,
+                )
+                w.writeline("@staticmethod")
+                w.writeline(
+                    "def ",
+                    func,
+                    "_",
                     column.pyname,
-                    " = ",
-                    column.val_from_sql(f"row[{i}]"),
+                    "(cursor: 'DBAPICursor') -> Optional[",
+                    pytype,
+                    "]:",
+                )
+                with w.indented():
+                    w.writeline("cursor.execute('", sql, "')")
+                    w.writeline("return cursor.fetchone()[0]")
+                w.writeline()
+
+            # the sum of no rows is 0 rather than NULL
+            sql = self.record(
+                "sum_" + column.pyname,
+                "SELECT COALESCE(SUM("
+                + column.sqlname
+                + "), "
+                + ("0.0" if pytype == "float" else "0")
+                + ") FROM "
+                + self.table.sqlname,
+                False,
+            )
+            w.writeline("@staticmethod")
+            w.writeline(
+                "def sum_", column.pyname, "(cursor: 'DBAPICursor') -> ", pytype, ":"
+            )
+            with w.indented():
+                w.writeline("cursor.execute('", sql, "')")
+                w.writeline("return cursor.fetchone()[0]")
+            w.writeline()
+
+    def generate_relations(self, w: Writer):
+        # relations which have been prefetched are stored on the model as
+        # _rel_<name>, and are returned by fetch_<name> without a query
+        for name, target, cols, target_cols, many in self.relations:
+            typ = f"'{target.pyname}'"
+            import_target = target is not self.table
+            where = " AND ".join(c.sqlname + " = ?" for c in target_cols)
+            own_key = ", ".join("self." + c.pyname for c in cols)
+
+            ret = "list[" + typ + "]" if many else "Optional[" + typ + "]"
+            sql = self.record(
+                "fetch_" + name,
+                "SELECT "
+                + ", ".join(c.sqlname for c in loaded_columns(target))
+                + " FROM "
+                + target.sqlname
+                + " WHERE "
+                + where,
+                True,
+            )
+            w.writeline(
+                "def fetch_", name, "(self, cursor: 'DBAPICursor') -> ", ret, ":"
+            )
+            with w.indented():
+                if import_target:
+                    w.writeline(
+                        "from ",
+                        self.package_name,
+                        ".",
+                        sql_to_module_name(target.sqlname),
+                        " import ",
+                        target.pyname,
+                    )
+                w.writeline("rel = getattr(self, '_rel_", name, "', UNSET)")
+                w.writeline("if rel is not UNSET:")
+                with w.indented():
+                    w.writeline("return rel")
+                if not many and any(c.nullable for c in cols):
+                    w.writeline("if None in (", own_key, ",):")
+                    with w.indented():
+                        w.writeline("return None")
+                w.writeline("stmt = '", sql, "'")
+                w.writeline(
+                    "cursor.execute(stmt, [",
+                    ", ".join(
+                        t.val_to_sql("self." + c.pyname)
+                        for c, t in zip(cols, target_cols)
+                    ),
+                    "])",
+                )
+                construct = query_construct(target, loaded_columns(target), "res")
+                if many:
+                    w.writeline("return [", construct, " for res in cursor.fetchall()]")
+                else:
+                    w.writeline("res = cursor.fetchone()")
+                    w.writeline("if res is None:")
+                    with w.indented():
+                        w.writeline("return None")
+                    w.writeline("return ", construct)
+            w.writeline()
+
+            keytype = "tuple[" + ", ".join(c.pytype for c in target_cols) + "]"
+            w.writeline("@classmethod")
+            w.writeline(
+                "def prefetch_",
+                name,
+                "(cls, cursor: 'DBAPICursor', models: Sequence['",
+                self.table.pyname,
+                "']):",
+            )
+            with w.indented():
+                if import_target:
+                    w.writeline(
+                        "from ",
+                        self.package_name,
+                        ".",
+                        sql_to_module_name(target.sqlname),
+                        " import ",
+                        target.pyname,
+                    )
+                model_key = "(" + "".join("m." + c.pyname + ", " for c in cols) + ")"
+                w.writeline(
+                    "keys = list(dict.fromkeys(k for k in (",
+                    model_key,
+                    " for m in models) if None not in k))",
+                )
+                w.writeline("related: dict[", keytype, ", ", ret, "] = {}")
+                with chunked_in_query(
+                    w, target, target_cols, "keys", self.recorder("prefetch_" + name)
+                ):
+                    obj_key = "".join("obj._" + c.pyname + ", " for c in target_cols)
+                    if many:
+                        w.writeline(
+                            "related.setdefault((", obj_key, "), []).append(obj)"
+                        )
+                    else:
+                        w.writeline("related[(", obj_key, ")] = obj")
+                w.writeline("for m in models:")
+                with w.indented():
+                    default = "[]" if many else "None"
+                    w.writeline(
+                        "m._rel_",
+                        name,
+                        " = related.get(",
+                        model_key,
+                        ", ",
+                        default,
+                        ")",
+                    )
+            w.writeline()
+
+    def generate_load_deferred(self, w: Writer):
+        if not self.deferred:
+            return
+
+        pks = [c for c in self.table.columns if c.primary_key]
+        keytype = "tuple[" + ", ".join(c.pytype for c in pks) + "]"
+        w.writeline("@staticmethod")
+        w.writeline(
+            "def load_deferred(cursor: 'DBAPICursor', models: Iterable['",
+            self.table.pyname,
+            "']):",
+        )
+        with w.indented():
+            # fields which are already loaded or have been modified are kept
+            w.writeline(
+                "pending: dict[", keytype, ", list['", self.table.pyname, "']] = {}"
+            )
+            w.writeline("for obj in models:")
+            with w.indented():
+                w.writeline(
+                    "if ",
+                    " or ".join(self.unset("obj._" + c.pyname) for c in self.deferred),
+                    ":",
                 )
+                with w.indented():
+                    w.writeline(
+                        "pending.setdefault((",
+                        ", ".join("obj._" + c.pyname for c in pks),
+                        ",), []).append(obj)",
+                    )
+            w.writeline("keys = list(pending)")
+            select = (
+                "SELECT "
+                + ", ".join(c.sqlname for c in pks + self.deferred)
+                + " FROM "
+                + self.table.sqlname
+                + " WHERE "
+            )
+            self.record("load_deferred", select + in_clause_sql(pks), True)
+            with chunked_in_loop(w, pks, "keys"):
+                w.writeline("cursor.execute('", select, "' + where, params)")
+                w.writeline("for row in cursor.fetchall():")
+                with w.indented():
+                    w.writeline(
+                        "for obj in pending[(",
+                        ", ".join(
+                            c.val_from_sql(f"row[{i}]") for i, c in enumerate(pks)
+                        ),
+                        ",)]:",
+                    )
+                    with w.indented():
+                        for i, column in enumerate(self.deferred):
+                            w.writeline("if ", self.unset("obj._" + column.pyname), ":")
+                            with w.indented():
+                                w.writeline(
+                                    "obj._",
+                                    column.pyname,
+                                    " = ",
+                                    column.val_from_sql(f"row[{len(pks) + i}]"),
+                                )
         w.writeline()
 
-    def generate_delete(self, w: Writer):
-        w.writeline("def delete(self, cursor: 'DBAPICursor'):")
+    def generate_blob_methods(self, w: Writer):
+        # blobs are opened by rowid, which is found through the primary key
+        pks = [c for c in self.table.columns if c.primary_key]
+        blobs = [c for c in self.table.columns if c.sqltype.upper() in BYTES_TYPES]
+        if not pks or not blobs:
+            return
+
+        w.writeline("def _blob_rowid(self, connection: Any) -> int:")
         with w.indented():
-            pks = [f for f in self.table.columns if f.primary_key]
+            for column in pks:
+                w.writeline("if ", self.unset("self._" + column.pyname), ":")
+                with w.indented():
+                    w.writeline(
+                        "raise ValueError('primary key ", column.pyname, " not set')"
+                    )
+            if is_rowid_alias(pks[0]):
+                # an INTEGER PRIMARY KEY is an alias for the rowid
+                w.writeline("return self._", pks[0].pyname)
+            else:
+                sql = self.record(
+                    "_blob_rowid",
+                    "SELECT rowid FROM "
+                    + self.table.sqlname
+                    + " WHERE "
+                    + " AND ".join(f"{c.sqlname} = ?" for c in pks),
+                    True,
+                )
+                w.writeline(
+                    "row = connection.execute('",
+                    sql,
+                    "', [",
+                    ", ".join(c.val_to_sql("self._" + c.pyname) for c in pks),
+                    "]).fetchone()",
+                )
+                w.writeline("if row is None:")
+                with w.indented():
+                    w.writeline("raise NoRowsError")
+                w.writeline("return row[0]")
+        w.writeline()
+
+        for column in blobs:
+            bit = 1 << self.table.columns.index(column)
             w.writeline(
-                "stmt = 'DELETE FROM ",
-                self.table.sqlname,
-                " WHERE ",
-                " AND ".join(f"{f.sqlname} = ?" for f in pks),
-                "'",
+                "def open_",
+                column.pyname,
+                "_blob(self, connection: Any, readonly: bool = True) -> Any:",
             )
+            with w.indented():
+                w.writeline(
+                    "return open_blob(connection, '",
+                    self.table.sqlname,
+                    "', '",
+                    column.sqlname,
+                    "', self._blob_rowid(connection), readonly)",
+                )
+            w.writeline()
+
             w.writeline(
-                "cursor.execute(stmt, [",
-                ", ".join(f"self._{f.pyname}" for f in pks),
-                "])",
+                "def write_",
+                column.pyname,
+                "_from(self, connection: Any, stream: Any, size: int, ",
+                "chunk_size: int = BLOB_CHUNK_SIZE):",
             )
-        w.writeline()
+            sql = self.record(
+                "write_" + column.pyname + "_from",
+                "UPDATE "
+                + self.table.sqlname
+                + " SET "
+                + column.sqlname
+                + " = zeroblob(?) WHERE rowid = ?",
+                True,
+            )
+            with w.indented():
+                w.writeline("rowid = self._blob_rowid(connection)")
+                w.writeline("cursor = connection.execute('", sql, "', [size, rowid])")
+                w.writeline("if cursor.rowcount == 0:")
+                with w.indented():
+                    w.writeline("raise NoRowsError")
+                w.writeline(
+                    "with open_blob(connection, '",
+                    self.table.sqlname,
+                    "', '",
+                    column.sqlname,
+                    "', rowid, False) as blob:",
+                )
+                with w.indented():
+                    w.writeline("copy_to_blob(stream, blob, size, chunk_size)")
+                # the streamed value is not held by the model
+                w.writeline("self._", column.pyname, " = UNSET")
+                w.writeline("self._dirty &= ~", bit)
+                self.generate_touch(w)
+            w.writeline()
@@ -1,11 +1,38 @@
 from pathlib import Path
 
+from pianola.generate.options import Options
 from pianola.lib.writer import Writer
 
 
-def generate_utils(outdir: Path):
+def generate_utils(outdir: Path, options: Options = Options()):
     with Writer(outdir / "utils.py") as w:
-        w.writeline("from typing import Any, Sequence, Union, Mapping, Protocol")
+        w.writeline(
+            "from typing import Any, Sequence, Union, Mapping, Protocol, Optional, Iterator"
+        )
+        w.writeline("from array import array")
+        w.writeline("from collections import OrderedDict")
+        w.writeline("from contextlib import contextmanager")
+        w.writeline("from contextvars import ContextVar")
+        w.writeline("import itertools")
+        w.writeline("import sqlite3")
+        w.writeline("import threading")
+        w.writeline("import time")
+        w.writeline("import weakref")
+        w.writeline()
+        w.writeline("try:")
+        with w.indented():
+            w.writeline("import numpy")
+        w.writeline("except ImportError:")
+        with w.indented():
+            w.writeline("numpy = None")
+        w.writeline()
+
+        # the default SQLITE_MAX_VARIABLE_NUMBER for sqlite < 3.32.0
+        w.writeline("MAX_VARIABLES = 999")
+        w.writeline()
+
+        # default number of rows fetched at a time by streaming queries
+        w.writeline("FETCH_BATCH_SIZE = 256")
         w.writeline()
 
         w.writeline("class _UNSET:")
@@ -13,6 +40,761 @@ def generate_utils(outdir: Path):
             w.writeline("pass")
         w.writeline()
 
+        # shared sentinel which can be compared by identity
+        w.writeline("UNSET = _UNSET()")
+        w.writeline()
+
         w.writeline("class NoRowsError(RuntimeError):")
         with w.indented():
             w.writeline("pass")
+        w.writeline()
+
+        w.writeline(
+            "def column_buffer(typecode: Optional[str]) -> Union[array, list[Any]]:"
+        )
+        with w.indented():
+            w.writeline("if typecode is None:")
+            with w.indented():
+                w.writeline("return []")
+            w.writeline("return array(typecode)")
+        w.writeline()
+
+        w.writeline("def column_result(column: Union[array, list[Any]]) -> Any:")
+        with w.indented():
+            w.writeline("if numpy is not None and isinstance(column, array):")
+            with w.indented():
+                w.writeline("return numpy.frombuffer(column, dtype=column.typecode)")
+            w.writeline("return column")
+        w.writeline()
+
+        w.writeline("def prefetch(cursor: Any, models: Sequence[Any], relation: str):")
+        with w.indented():
+            w.writeline("if models:")
+            with w.indented():
+                w.writeline(
+                    "getattr(type(models[0]), 'prefetch_' + relation)(cursor, models)"
+                )
+        w.writeline()
+
+        generate_connection_utils(w, options)
+        generate_transaction_utils(w)
+        generate_blob_utils(w)
+        generate_identity_map_utils(w)
+        generate_result_cache_utils(w)
+
+
+def generate_connection_utils(w: Writer, options: Options):
+    # pragmas applied by connect(), busy_timeout comes first so that switching
+    # the journal mode waits for other connections. the journal mode is stored
+    # in the database file, so only the opt-in profiles change it
+    w.writeline("PROFILES: dict[str, dict[str, Any]] = {")
+    with w.indented():
+        w.writeline("'default': {")
+        with w.indented():
+            w.writeline("'busy_timeout': 5000,")
+            w.writeline("'cache_size': -64000,")
+            w.writeline("'mmap_size': 268435456,")
+            w.writeline("'temp_store': 'MEMORY',")
+        w.writeline("},")
+        w.writeline("'wal': {")
+        with w.indented():
+            w.writeline("'busy_timeout': 5000,")
+            w.writeline("'journal_mode': 'WAL',")
+            w.writeline("'synchronous': 'NORMAL',")
+            w.writeline("'cache_size': -64000,")
+            w.writeline("'mmap_size': 268435456,")
+            w.writeline("'temp_store': 'MEMORY',")
+        w.writeline("},")
+        w.writeline("'bulk': {")
+        with w.indented():
+            w.writeline("'busy_timeout': 5000,")
+            w.writeline("'journal_mode': 'WAL',")
+            w.writeline("'synchronous': 'OFF',")
+            w.writeline("'cache_size': -262144,")
+            w.writeline("'mmap_size': 1073741824,")
+            w.writeline("'temp_store': 'MEMORY',")
+        w.writeline("},")
+    w.writeline("}")
+    w.writeline()
+
+    w.writeline(
+        "def connect(database: str, profile: Union[str, Mapping[str, Any]] = 'default', ",
+        "cached_statements: int = 256, **kwargs: Any) -> sqlite3.Connection:",
+    )
+    with w.indented():
+        if options.converters == "sqlite":
+            # the models rely on the cursor to convert values
+            w.writeline("kwargs.setdefault('detect_types', sqlite3.PARSE_DECLTYPES)")
+        w.writeline(
+            "conn = sqlite3.connect(database, cached_statements=cached_statements, **kwargs)"
+        )
+        w.writeline(
+            "pragmas = PROFILES[profile] if isinstance(profile, str) else profile"
+        )
+        w.writeline("for name, value in pragmas.items():")
+        with w.indented():
+            w.writeline("conn.execute(f'PRAGMA {name} = {value}')")
+        w.writeline("return conn")
+    w.writeline()
+
+    # holds a thread's connection in the pool's thread local, so that the
+    # connection is released when the thread exits
+    w.writeline("class _PooledConnection:")
+    with w.indented():
+        w.writeline("__slots__ = ('conn', '__weakref__')")
+        w.writeline()
+        w.writeline("def __init__(self, conn: sqlite3.Connection):")
+        with w.indented():
+            w.writeline("self.conn = conn")
+    w.writeline()
+
+    w.writeline(
+        "def _release_connection(lock: threading.Lock, "
+        "connections: list[sqlite3.Connection], conn: sqlite3.Connection):"
+    )
+    with w.indented():
+        w.writeline("with lock:")
+        with w.indented():
+            w.writeline("if conn in connections:")
+            with w.indented():
+                w.writeline("connections.remove(conn)")
+        w.writeline("conn.close()")
+    w.writeline()
+
+    # sqlite3 connections must not be shared between threads, so each thread
+    # gets its own long lived connection (and so its own statement cache)
+    w.writeline("class ConnectionPool:")
+    with w.indented():
+        w.writeline(
+            "def __init__(self, database: str, profile: Union[str, Mapping[str, Any]] = 'default', ",
+            "cached_statements: int = 256, **kwargs: Any):",
+        )
+        with w.indented():
+            w.writeline("self.database = database")
+            w.writeline("self.profile = profile")
+            w.writeline("self.cached_statements = cached_statements")
+            w.writeline("# connections are only closed from other threads")
+            w.writeline("kwargs.setdefault('check_same_thread', False)")
+            w.writeline("self.kwargs = kwargs")
+            w.writeline("self.local = threading.local()")
+            w.writeline("self.lock = threading.Lock()")
+            w.writeline("self.connections: list[sqlite3.Connection] = []")
+        w.writeline()
+
+        w.writeline("def connection(self) -> sqlite3.Connection:")
+        with w.indented():
+            w.writeline("pooled = getattr(self.local, 'pooled', None)")
+            w.writeline("if pooled is None:")
+            with w.indented():
+                w.writeline(
+                    "conn = connect(self.database, self.profile, self.cached_statements, **self.kwargs)"
+                )
+                w.writeline("pooled = self.local.pooled = _PooledConnection(conn)")
+                # the finalizer must not reference the pool, or it would keep
+                # the pool alive for as long as the thread
+                w.writeline(
+                    "weakref.finalize(pooled, _release_connection, self.lock, self.connections, conn)"
+                )
+                w.writeline("with self.lock:")
+                with w.indented():
+                    w.writeline("self.connections.append(conn)")
+            w.writeline("return pooled.conn")
+        w.writeline()
+
+        w.writeline("def cursor(self) -> sqlite3.Cursor:")
+        with w.indented():
+            w.writeline("return self.connection().cursor()")
+        w.writeline()
+
+        w.writeline("def close(self):")
+        with w.indented():
+            w.writeline("with self.lock:")
+            with w.indented():
+                w.writeline("for conn in self.connections:")
+                with w.indented():
+                    w.writeline("conn.close()")
+                # the list is shared with the finalizers of live threads
+                w.writeline("self.connections.clear()")
+            w.writeline("self.local = threading.local()")
+        w.writeline()
+
+        w.writeline("def __enter__(self) -> 'ConnectionPool':")
+        with w.indented():
+            w.writeline("return self")
+        w.writeline()
+
+        w.writeline("def __exit__(self, *_: Any):")
+        with w.indented():
+            w.writeline("self.close()")
+
+
+def generate_transaction_utils(w: Writer):
+    w.writeline()
+    w.writeline("_SAVEPOINT_IDS = itertools.count()")
+    w.writeline()
+
+    # transactions are begun and ended with sql statements rather than the
+    # connection methods, which do nothing on autocommit connections. inside
+    # a transaction, including one implicitly begun by the sqlite3 module,
+    # a nested transaction is a savepoint.
+    w.writeline("@contextmanager")
+    w.writeline("def transaction(conn: Any, mode: str = 'IMMEDIATE') -> Iterator[Any]:")
+    with w.indented():
+        w.writeline("if conn.in_transaction:")
+        with w.indented():
+            w.writeline("with savepoint(conn):")
+            with w.indented():
+                w.writeline("yield conn")
+            w.writeline("return")
+        w.writeline("conn.execute('BEGIN ' + mode)")
+        w.writeline("try:")
+        with w.indented():
+            w.writeline("yield conn")
+        w.writeline("except BaseException:")
+        with w.indented():
+            w.writeline("conn.execute('ROLLBACK')")
+            w.writeline("raise")
+        w.writeline("conn.execute('COMMIT')")
+    w.writeline()
+
+    w.writeline("@contextmanager")
+    w.writeline(
+        "def savepoint(conn: Any, name: Optional[str] = None) -> Iterator[Any]:"
+    )
+    with w.indented():
+        w.writeline("name = name or f'pianola_{next(_SAVEPOINT_IDS)}'")
+        w.writeline("conn.execute('SAVEPOINT ' + name)")
+        w.writeline("try:")
+        with w.indented():
+            w.writeline("yield conn")
+        w.writeline("except BaseException:")
+        with w.indented():
+            # rolling back to a savepoint leaves it on the stack
+            w.writeline("conn.execute('ROLLBACK TO ' + name)")
+            w.writeline("conn.execute('RELEASE ' + name)")
+            w.writeline("raise")
+        w.writeline("conn.execute('RELEASE ' + name)")
+    w.writeline()
+
+    # commits a long running write every so many rows or milliseconds, so
+    # the write lock is released regularly for other connections. the
+    # caller reports the rows it has written with add().
+    w.writeline("class BatchCommit:")
+    with w.indented():
+        w.writeline(
+            "def __init__(self, conn: Any, every: Optional[int] = 1000, ",
+            "ms: Optional[float] = None, mode: str = 'IMMEDIATE'):",
+        )
+        with w.indented():
+            w.writeline("self.conn = conn")
+            w.writeline("self.every = every")
+            w.writeline("self.ms = ms")
+            w.writeline("self.mode = mode")
+            w.writeline("self.pending = 0")
+            w.writeline("self.commits = 0")
+            w.writeline("self.started = 0.0")
+        w.writeline()
+
+        w.writeline("def begin(self):")
+        with w.indented():
+            w.writeline("self.conn.execute('BEGIN ' + self.mode)")
+            w.writeline("self.started = time.monotonic()")
+        w.writeline()
+
+        w.writeline("def commit(self):")
+        with w.indented():
+            w.writeline("self.conn.execute('COMMIT')")
+            w.writeline("self.commits += 1")
+            w.writeline("self.pending = 0")
+        w.writeline()
+
+        w.writeline("def add(self, rows: int = 1):")
+        with w.indented():
+            w.writeline("self.pending += rows")
+            w.writeline(
+                "if (self.every is not None and self.pending >= self.every) or (",
+                "self.ms is not None and (time.monotonic() - self.started) * 1000 >= self.ms):",
+            )
+            with w.indented():
+                w.writeline("self.commit()")
+                w.writeline("self.begin()")
+        w.writeline()
+
+        w.writeline("def __enter__(self) -> 'BatchCommit':")
+        with w.indented():
+            w.writeline("if self.conn.in_transaction:")
+            with w.indented():
+                w.writeline(
+                    "raise RuntimeError('batch_commit cannot be used inside a transaction')"
+                )
+            w.writeline("self.begin()")
+            w.writeline("return self")
+        w.writeline()
+
+        # rows written since the last commit are rolled back on error
+        w.writeline("def __exit__(self, exc_type: Any, *_: Any):")
+        with w.indented():
+            w.writeline("if exc_type is None:")
+            with w.indented():
+                w.writeline("self.commit()")
+            w.writeline("else:")
+            with w.indented():
+                w.writeline("self.conn.execute('ROLLBACK')")
+    w.writeline()
+
+    w.writeline(
+        "def batch_commit(conn: Any, every: Optional[int] = 1000, ",
+        "ms: Optional[float] = None, mode: str = 'IMMEDIATE') -> BatchCommit:",
+    )
+    with w.indented():
+        w.writeline("return BatchCommit(conn, every, ms, mode)")
+
+
+def generate_blob_utils(w: Writer):
+    w.writeline()
+    # number of bytes copied at a time when streaming blobs
+    w.writeline("BLOB_CHUNK_SIZE = 65536")
+    w.writeline()
+
+    # stands in for sqlite3.Blob where Connection.blobopen is not available
+    # (python < 3.11 or other dbapi modules). only one chunk is held in python
+    # at a time when reading, but sqlite still reads the whole value for every
+    # chunk. sql can only replace a whole value, so contiguous writes are
+    # buffered and spliced into the value by a single update when the blob is
+    # read from, written out of sequence or closed.
+    w.writeline("class ChunkedBlob:")
+    with w.indented():
+        w.writeline(
+            "def __init__(self, connection: Any, table: str, column: str, ",
+            "rowid: int, readonly: bool = True):",
+        )
+        with w.indented():
+            w.writeline("self.connection = connection")
+            w.writeline("self.table = table")
+            w.writeline("self.column = column")
+            w.writeline("self.rowid = rowid")
+            w.writeline("self.readonly = readonly")
+            w.writeline("self.offset = 0")
+            w.writeline(
+                "row = connection.execute(f'SELECT length({column}) FROM {table} ",
+                "WHERE rowid = ?', [rowid]).fetchone()",
+            )
+            w.writeline("if row is None:")
+            with w.indented():
+                w.writeline("raise NoRowsError")
+            w.writeline("self.size = row[0] or 0")
+            w.writeline("self.pending: list[bytes] = []")
+            w.writeline("self.pending_offset = 0")
+            w.writeline("self.pending_end = 0")
+        w.writeline()
+
+        w.writeline("def __len__(self) -> int:")
+        with w.indented():
+            w.writeline("return self.size")
+        w.writeline()
+
+        w.writeline("def tell(self) -> int:")
+        with w.indented():
+            w.writeline("return self.offset")
+        w.writeline()
+
+        w.writeline("def seek(self, offset: int, origin: int = 0):")
+        with w.indented():
+            w.writeline("base = [0, self.offset, self.size][origin]")
+            w.writeline("if not 0 <= base + offset <= self.size:")
+            with w.indented():
+                w.writeline("raise ValueError('offset out of blob range')")
+            w.writeline("self.offset = base + offset")
+        w.writeline()
+
+        w.writeline("def read(self, length: int = -1) -> bytes:")
+        with w.indented():
+            w.writeline("if length < 0 or length > self.size - self.offset:")
+            with w.indented():
+                w.writeline("length = self.size - self.offset")
+            w.writeline("if length == 0:")
+            with w.indented():
+                w.writeline("return b''")
+            w.writeline("self.flush()")
+            w.writeline(
+                "row = self.connection.execute(f'SELECT substr({self.column}, ?, ?) ",
+                "FROM {self.table} WHERE rowid = ?', [self.offset + 1, length, self.rowid]).fetchone()",
+            )
+            w.writeline("self.offset += length")
+            w.writeline("return bytes(row[0])")
+        w.writeline()
+
+        w.writeline("def write(self, data: bytes):")
+        with w.indented():
+            w.writeline("if self.readonly:")
+            with w.indented():
+                w.writeline("raise ValueError('blob is read only')")
+            w.writeline("if self.offset + len(data) > self.size:")
+            with w.indented():
+                w.writeline("raise ValueError('data longer than blob length')")
+            w.writeline("if self.pending and self.offset != self.pending_end:")
+            with w.indented():
+                w.writeline("self.flush()")
+            w.writeline("if not self.pending:")
+            with w.indented():
+                w.writeline("self.pending_offset = self.offset")
+            w.writeline("self.pending.append(bytes(data))")
+            w.writeline("self.offset += len(data)")
+            w.writeline("self.pending_end = self.offset")
+        w.writeline()
+
+        w.writeline("def flush(self):")
+        with w.indented():
+            w.writeline("if not self.pending:")
+            with w.indented():
+                w.writeline("return")
+            w.writeline("data = b''.join(self.pending)")
+            w.writeline("self.pending = []")
+            w.writeline(
+                "self.connection.execute(f'UPDATE {self.table} SET {self.column} = ",
+                "CAST(substr({self.column}, 1, ?) || ? || substr({self.column}, ?) AS BLOB) ",
+                "WHERE rowid = ?', [self.pending_offset, data, self.pending_offset + len(data) + 1, self.rowid])",
+            )
+        w.writeline()
+
+        w.writeline("def close(self):")
+        with w.indented():
+            w.writeline("self.flush()")
+        w.writeline()
+
+        w.writeline("def __enter__(self) -> 'ChunkedBlob':")
+        with w.indented():
+            w.writeline("return self")
+        w.writeline()
+
+        w.writeline("def __exit__(self, *_: Any):")
+        with w.indented():
+            w.writeline("self.close()")
+        w.writeline()
+
+    w.writeline(
+        "def open_blob(connection: Any, table: str, column: str, rowid: int, ",
+        "readonly: bool = True) -> Any:",
+    )
+    with w.indented():
+        w.writeline("if hasattr(connection, 'blobopen'):")
+        with w.indented():
+            w.writeline(
+                "return connection.blobopen(table, column, rowid, readonly=readonly)"
+            )
+        w.writeline("return ChunkedBlob(connection, table, column, rowid, readonly)")
+    w.writeline()
+
+    w.writeline(
+        "def copy_to_blob(stream: Any, blob: Any, size: int, ",
+        "chunk_size: int = BLOB_CHUNK_SIZE):",
+    )
+    with w.indented():
+        w.writeline("remaining = size")
+        w.writeline("while remaining > 0:")
+        with w.indented():
+            w.writeline("chunk = stream.read(min(chunk_size, remaining))")
+            w.writeline("if not chunk:")
+            with w.indented():
+                w.writeline(
+                    "raise ValueError(f'stream ended {remaining} bytes short of {size}')"
+                )
+            w.writeline("blob.write(chunk)")
+            w.writeline("remaining -= len(chunk)")
+
+
+def generate_identity_map_utils(w: Writer):
+    w.writeline()
+    # models loaded by primary key, keyed by (table, primary key). a map is
+    # only used inside its with block, which scopes it to one unit of work
+    # (and one thread or task) and discards it afterwards.
+    w.writeline("class IdentityMap:")
+    with w.indented():
+        w.writeline("def __init__(self, maxsize: int = 1024):")
+        with w.indented():
+            w.writeline("self.maxsize = maxsize")
+            w.writeline(
+                "self.entries: OrderedDict[tuple[str, tuple[Any, ...]], Any] = OrderedDict()"
+            )
+            w.writeline("self.hits = 0")
+            w.writeline("self.misses = 0")
+            w.writeline("self.evictions = 0")
+            w.writeline("self.tokens: list[Any] = []")
+        w.writeline()
+
+        w.writeline("def get(self, key: tuple[str, tuple[Any, ...]]) -> Any:")
+        with w.indented():
+            w.writeline("obj = self.entries.get(key)")
+            w.writeline("if obj is None:")
+            with w.indented():
+                w.writeline("self.misses += 1")
+                w.writeline("return None")
+            w.writeline("self.hits += 1")
+            w.writeline("self.entries.move_to_end(key)")
+            w.writeline("return obj")
+        w.writeline()
+
+        w.writeline("def put(self, key: tuple[str, tuple[Any, ...]], obj: Any):")
+        with w.indented():
+            w.writeline("self.entries[key] = obj")
+            w.writeline("self.entries.move_to_end(key)")
+            w.writeline("if len(self.entries) > self.maxsize:")
+            with w.indented():
+                w.writeline("self.entries.popitem(last=False)")
+                w.writeline("self.evictions += 1")
+        w.writeline()
+
+        w.writeline("def evict(self, key: tuple[str, tuple[Any, ...]]):")
+        with w.indented():
+            w.writeline("self.entries.pop(key, None)")
+        w.writeline()
+
+        w.writeline("def evict_table(self, table: str):")
+        with w.indented():
+            w.writeline("for key in [k for k in self.entries if k[0] == table]:")
+            with w.indented():
+                w.writeline("del self.entries[key]")
+        w.writeline()
+
+        w.writeline("def clear(self):")
+        with w.indented():
+            w.writeline("self.entries.clear()")
+        w.writeline()
+
+        w.writeline("def stats(self) -> dict[str, int]:")
+        with w.indented():
+            w.writeline(
+                "return {'size': len(self.entries), 'hits': self.hits, ",
+                "'misses': self.misses, 'evictions': self.evictions}",
+            )
+        w.writeline()
+
+        w.writeline("def __enter__(self) -> 'IdentityMap':")
+        with w.indented():
+            w.writeline("self.tokens.append(IDENTITY_MAP.set(self))")
+            w.writeline("return self")
+        w.writeline()
+
+        w.writeline("def __exit__(self, *_: Any):")
+        with w.indented():
+            w.writeline("IDENTITY_MAP.reset(self.tokens.pop())")
+            w.writeline("if not self.tokens:")
+            with w.indented():
+                w.writeline("self.clear()")
+    w.writeline()
+
+    w.writeline(
+        "IDENTITY_MAP: ContextVar[Optional[IdentityMap]] = ",
+        "ContextVar('IDENTITY_MAP', default=None)",
+    )
+    w.writeline()
+
+    # whether loaded models keep the connection which loaded them, to load
+    # their deferred fields on access. the aio workers turn it off, since
+    # their connections can't be used from the event loop's thread
+    w.writeline(
+        "LOAD_ON_ACCESS: ContextVar[bool] = ContextVar('LOAD_ON_ACCESS', default=True)"
+    )
+
+
+def generate_result_cache_utils(w: Writer):
+    w.writeline()
+    # bumped when a write through the generated methods of each table ends.
+    # tables written inside a transaction are pending until the transaction
+    # is committed or rolled back, with their connections kept alive so that
+    # their ids are not reused.
+    w.writeline("TABLE_VERSIONS: dict[str, int] = {}")
+    w.writeline("PENDING_TABLES: dict[int, tuple[Any, set[str]]] = {}")
+    w.writeline("_PENDING_LOCK = threading.Lock()")
+    w.writeline()
+
+    w.writeline("def _bump_table(table: str):")
+    with w.indented():
+        w.writeline("TABLE_VERSIONS[table] = TABLE_VERSIONS.get(table, 0) + 1")
+    w.writeline()
+
+    w.writeline("def _in_transaction(connection: Any) -> bool:")
+    with w.indented():
+        w.writeline("try:")
+        with w.indented():
+            w.writeline("return connection.in_transaction")
+        # a closed connection has ended its transaction
+        w.writeline("except Exception:")
+        with w.indented():
+            w.writeline("return False")
+    w.writeline()
+
+    w.writeline("def flush_pending_tables():")
+    with w.indented():
+        w.writeline("with _PENDING_LOCK:")
+        with w.indented():
+            w.writeline(
+                "for key, (connection, tables) in list(PENDING_TABLES.items()):"
+            )
+            with w.indented():
+                w.writeline("if not _in_transaction(connection):")
+                with w.indented():
+                    w.writeline("for table in tables:")
+                    with w.indented():
+                        w.writeline("_bump_table(table)")
+                    w.writeline("del PENDING_TABLES[key]")
+    w.writeline()
+
+    w.writeline("def touch_table(connection: Any, table: str):")
+    with w.indented():
+        w.writeline("if _in_transaction(connection):")
+        with w.indented():
+            w.writeline("with _PENDING_LOCK:")
+            with w.indented():
+                w.writeline(
+                    "PENDING_TABLES.setdefault(id(connection), (connection, set()))[1].add(table)"
+                )
+        w.writeline("else:")
+        with w.indented():
+            w.writeline("_bump_table(table)")
+        w.writeline("flush_pending_tables()")
+    w.writeline()
+
+    w.writeline("def rows_size(rows: list[Any]) -> int:")
+    with w.indented():
+        w.writeline("size = 64")
+        w.writeline("for row in rows:")
+        with w.indented():
+            w.writeline("size += 64")
+            w.writeline("for v in row:")
+            with w.indented():
+                w.writeline(
+                    "size += len(v) + 48 if isinstance(v, (str, bytes)) else 16"
+                )
+        w.writeline("return size")
+    w.writeline()
+
+    # caches the rows returned by generated queries, keyed by (table, method,
+    # params). an entry is valid while the table has not been written through
+    # the generated methods and no connection has seen a commit from another
+    # connection (PRAGMA data_version) since the entry was filled. data
+    # versions can only be compared on one connection, so new connections
+    # invalidate the cache and long lived connections should be used.
+    w.writeline("class ResultCache:")
+    with w.indented():
+        w.writeline(
+            "def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ",
+            "max_connections: int = 64):",
+        )
+        with w.indented():
+            w.writeline("self.max_entries = max_entries")
+            w.writeline("self.max_bytes = max_bytes")
+            w.writeline("self.max_connections = max_connections")
+            w.writeline(
+                "self.entries: OrderedDict[tuple[Any, ...], tuple[int, int, list[Any], int]] = OrderedDict()"
+            )
+            w.writeline("self.size = 0")
+            w.writeline("self.epoch = 0")
+            # connections are kept alive so that their ids are not reused
+            w.writeline("self.data_versions: dict[int, tuple[Any, int]] = {}")
+            w.writeline("self.lock = threading.Lock()")
+            w.writeline("self.hits = 0")
+            w.writeline("self.misses = 0")
+            w.writeline("self.evictions = 0")
+        w.writeline()
+
+        w.writeline("def check(self, connection: Any) -> int:")
+        with w.indented():
+            w.writeline(
+                "(version,) = connection.execute('PRAGMA data_version').fetchone()"
+            )
+            w.writeline("with self.lock:")
+            with w.indented():
+                w.writeline("seen = self.data_versions.get(id(connection))")
+                w.writeline("if seen is None or seen[1] != version:")
+                with w.indented():
+                    w.writeline(
+                        "if seen is None and len(self.data_versions) >= self.max_connections:"
+                    )
+                    with w.indented():
+                        w.writeline("self.data_versions.clear()")
+                    w.writeline(
+                        "self.data_versions[id(connection)] = (connection, version)"
+                    )
+                    w.writeline("self.epoch += 1")
+                w.writeline("return self.epoch")
+        w.writeline()
+
+        w.writeline(
+            "def fetch(self, cursor: Any, key: tuple[Any, ...], table: str, ",
+            "stmt: str, params: Sequence[Any]) -> list[Any]:",
+        )
+        with w.indented():
+            # rows read inside a transaction may be uncommitted or about to
+            # be rolled back, so they are neither served from nor cached
+            w.writeline("flush_pending_tables()")
+            w.writeline("if _in_transaction(cursor.connection):")
+            with w.indented():
+                w.writeline("cursor.execute(stmt, params)")
+                w.writeline("return cursor.fetchall()")
+            # versions are read before querying, so a write racing with the
+            # query leaves behind an entry which is already stale
+            w.writeline("epoch = self.check(cursor.connection)")
+            w.writeline("version = TABLE_VERSIONS.get(table, 0)")
+            w.writeline("with self.lock:")
+            with w.indented():
+                w.writeline("entry = self.entries.get(key)")
+                w.writeline(
+                    "if entry is not None and entry[0] == epoch and entry[1] == version:"
+                )
+                with w.indented():
+                    w.writeline("self.entries.move_to_end(key)")
+                    w.writeline("self.hits += 1")
+                    w.writeline("return entry[2]")
+                w.writeline("self.misses += 1")
+            w.writeline("cursor.execute(stmt, params)")
+            w.writeline("rows = cursor.fetchall()")
+            w.writeline("size = rows_size(rows)")
+            w.writeline("with self.lock:")
+            with w.indented():
+                w.writeline("old = self.entries.pop(key, None)")
+                w.writeline("if old is not None:")
+                with w.indented():
+                    w.writeline("self.size -= old[3]")
+                w.writeline("if size <= self.max_bytes:")
+                with w.indented():
+                    w.writeline("self.entries[key] = (epoch, version, rows, size)")
+                    w.writeline("self.size += size")
+                w.writeline(
+                    "while len(self.entries) > self.max_entries or self.size > self.max_bytes:"
+                )
+                with w.indented():
+                    w.writeline("_, evicted = self.entries.popitem(last=False)")
+                    w.writeline("self.size -= evicted[3]")
+                    w.writeline("self.evictions += 1")
+            w.writeline("return rows")
+        w.writeline()
+
+        w.writeline("def clear(self):")
+        with w.indented():
+            w.writeline("with self.lock:")
+            with w.indented():
+                w.writeline("self.entries.clear()")
+                w.writeline("self.size = 0")
+        w.writeline()
+
+        w.writeline("def stats(self) -> dict[str, int]:")
+        with w.indented():
+            w.writeline(
+                "return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, ",
+                "'misses': self.misses, 'evictions': self.evictions}",
+            )
+        w.writeline()
+
+    w.writeline("_RESULT_CACHE: Optional[ResultCache] = None")
+    w.writeline()
+
+    w.writeline("def set_result_cache(cache: Optional[ResultCache]):")
+    with w.indented():
+        w.writeline("global _RESULT_CACHE")
+        w.writeline("_RESULT_CACHE = cache")
+    w.writeline()
+
+    w.writeline("def result_cache() -> Optional[ResultCache]:")
+    with w.indented():
+        w.writeline("return _RESULT_CACHE")
@@ -1,8 +1,18 @@
+import os
 from pathlib import Path
+from typing import Optional
 
-from pianola.generate.sqlite.query import generate_query
+from pianola.generate.sqlite.query import (
+    Recorder,
+    chunked_in_query,
+    generate_page_query,
+    generate_query,
+    is_rowid_alias,
+    page_key,
+)
 from pianola.lib.schema.sql.column import Column
 from pianola.lib.schema.sql.query import Query
+from pianola.lib.schema.sql.table import Table
 from pianola.lib.schema.sql.view import View
 from pianola.lib.stringutils import quote, sql_to_module_name
 from pianola.lib.writer import Writer
@@ -19,20 +29,38 @@ class ViewGenerator:
         self.outdir = outdir
         self.package_name = package_name
         self.sqlname = quote(view.sqlname, '"' if view.quoted else "")
+        # (method, sql, keyed) of each statement written, see statements()
+        self.recorded: list[tuple[str, str, bool]] = []
 
     def generate(self):
         filename = sql_to_module_name(self.view.sqlname) + ".py"
         with Writer(self.outdir / filename) as w:
-            self.generate_header(w)
-            self.generate_class_header(w)
-            with w.indented():
-                self.generate_query(w)
+            self.generate_module(w)
+
+    def generate_module(self, w: Writer):
+        self.recorded = []
+        self.generate_header(w)
+        self.generate_class_header(w)
+        with w.indented():
+            self.generate_query(w)
+
+    def recorder(self, method: str) -> Recorder:
+        return lambda sql, keyed: self.recorded.append((method, sql, keyed))
+
+    def statements(self) -> list[tuple[str, str, bool]]:
+        """
+        Returns the (method, sql, keyed) of the statements run by the
+        generated methods, as TableGenerator.statements does for tables.
+        """
+        with Writer(os.devnull) as w:
+            self.generate_module(w)
+        return self.recorded
 
     def generate_header(self, w: Writer):
         w.writeline(
             "from ",
             self.package_name,
-            ".utils import _UNSET",
+            ".utils import _UNSET, MAX_VARIABLES, FETCH_BATCH_SIZE",
         )
         w.writeline(
             "from ",
@@ -55,7 +83,9 @@ class ViewGenerator:
             "optional_decimal_to_sql, ",
             "optional_decimal_from_sql",
         )
-        w.writeline("from typing import Union, Optional, Any, Generator, TYPE_CHECKING")
+        w.writeline(
+            "from typing import Union, Optional, Any, Generator, Iterable, TYPE_CHECKING"
+        )
         w.writeline("from datetime import date, datetime, time")
         w.writeline("from decimal import Decimal")
         w.writeline("if TYPE_CHECKING:")
@@ -83,21 +113,109 @@ class ViewGenerator:
                     )
             w.writeline()
 
+    def index_keys(self) -> list[tuple[list[Column], bool]]:
+        """
+        Returns the (columns, unique) of each index on a source table whose
+        columns are all selected by the view. Lookups by these columns are
+        pushed down to the index by sqlite, lookups by other columns would
+        scan the view.
+        """
+        sources = {id(info.table): info.table for info in self.view.column_info}
+        keys: list[tuple[list[Column], bool]] = []
+        for table in sources.values():
+            for index in table.indices:
+                key = [self.view_column(table, c) for c in index.columns]
+                if any(c is None for c in key):
+                    continue
+                # a join can repeat the rows of a table, so keys are only
+                # unique in views of a single table
+                keys += [([c for c in key if c], index.unique and len(sources) == 1)]
+        return keys
+
+    def view_column(self, table: Table, column: Column) -> Optional[Column]:
+        for view_column, info in zip(self.view.columns, self.view.column_info):
+            if info.table is table and info.column is column:
+                return view_column
+        return None
+
+    def tiebreak(self) -> list[Column]:
+        # a join can repeat the rows of a table, so only views of a single
+        # table selecting its whole primary key have one
+        tables = {id(info.table): info.table for info in self.view.column_info}
+        if len(tables) != 1:
+            return []
+        table = next(iter(tables.values()))
+        pks = [self.view_column(table, c) for c in table.columns if c.primary_key]
+        if any(c is None for c in pks):
+            return []
+        return [c for c in pks if c]
+
+    def not_null(self, column: Column) -> bool:
+        i = next(i for i, c in enumerate(self.view.columns) if c is column)
+        info = self.view.column_info[i]
+        assert info.column is not None
+        return not column.nullable or is_rowid_alias(info.column)
+
     def generate_query(self, w: Writer):
-        def query_sql(col: Column):
-            return (
-                "SELECT "
-                + ", ".join(c.sqlname for c in self.view.columns)
-                + " WHERE "
-                + col.sqlname
-                + " = {"
-                + col.pyname
-                + " "
-                + col.pytype
-                + "}"
+        cols = ", ".join(c.sqlname for c in self.view.columns)
+        generate_query(
+            w,
+            self.view,
+            Query("get", "SELECT " + cols + " FROM " + self.sqlname, False),
+            record=self.recorder("get"),
+        )
+
+        generated: set[str] = set()
+        for key, unique in self.index_keys():
+            suffix = "_".join(c.pyname for c in key)
+            if suffix in generated:
+                continue
+            generated.add(suffix)
+
+            where = " AND ".join(
+                f"{c.sqlname} = {{{c.pyname} {c.pytype}}}" for c in key
+            )
+            sql = "SELECT " + cols + " FROM " + self.sqlname + " WHERE " + where
+            generate_query(
+                w,
+                self.view,
+                Query("by_" + suffix, sql, unique),
+                record=self.recorder("by_" + suffix),
             )
+            self.generate_many_query(w, "by_" + suffix + "_many", key, unique)
+            paged = page_key(key, unique, self.tiebreak(), self.not_null)
+            if paged is not None:
+                name = "page_by_" + suffix
+                generate_page_query(w, self.view, name, paged, self.recorder(name))
 
-        for col in self.view.columns:
-            name = "by_" + col.pyname
-            sql = query_sql(col)
-            generate_query(w, self.view, Query(name, sql, False))
+    def generate_many_query(
+        self, w: Writer, name: str, key: list[Column], unique: bool
+    ):
+        keytype = "tuple[" + ", ".join(c.pytype for c in key) + "]"
+        valtype = f"'{self.view.pyname}'"
+        if not unique:
+            valtype = "list[" + valtype + "]"
+
+        w.writeline("@staticmethod")
+        w.writeline(
+            "def ",
+            name,
+            "(cursor: 'DBAPICursor', keys: Iterable[",
+            keytype,
+            "]) -> dict[",
+            keytype,
+            ", ",
+            valtype,
+            "]:",
+        )
+        with w.indented():
+            w.writeline("keys = list(dict.fromkeys(keys))")
+            w.writeline("res: dict[", keytype, ", ", valtype, "] = {}")
+            with chunked_in_query(w, self.view, key, "keys", self.recorder(name)):
+                objkey = ", ".join("obj." + c.pyname for c in key)
+                if unique:
+                    w.writeline("res[(", objkey, ",)] = obj")
+                else:
+                    w.writeline("res.setdefault((", objkey, ",), []).append(obj)")
+            w.writeline("return res")
+        w.writeline()
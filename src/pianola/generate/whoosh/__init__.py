@@ -1,5 +1,6 @@
 from pathlib import Path
 
+from pianola.generate.options import Options
 from pianola.generate.whoosh.index import IndexGenerator
 from pianola.lib.schema.whoosh import WhooshSchema
 from pianola.lib.writer import Writer
@@ -10,6 +11,7 @@ def generate(
     outdir: Path,
     package_name: str,
     exclude: list[str] = [],
+    options: Options = Options(),
 ):
     outdir.mkdir(exist_ok=True)
 
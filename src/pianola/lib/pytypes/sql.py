@@ -27,14 +27,17 @@ def col_add_pytype(column: Column):
     sqltype = column.sqltype
     pytype = ""
     conv_func: Optional[str] = None
+    array_type: Optional[str] = None
     if sqltype.upper() in INTEGER_TYPES:
         pytype = "int"
+        array_type = "q"
     elif sqltype.upper() in STRING_TYPES:
         pytype = "str"
     elif sqltype.upper() in BYTES_TYPES:
         pytype = "bytes"
     elif sqltype.upper() in FLOAT_TYPES:
         pytype = "float"
+        array_type = "d"
     elif sqltype.upper() in NUMERIC_TYPES:
         pytype = "Union[int, float]"
     elif sqltype.upper() in BOOLEAN_TYPES:
@@ -56,5 +59,23 @@ def col_add_pytype(column: Column):
 
     if column.nullable:
         pytype = "Optional[" + pytype + "]"
+        # arrays cannot hold NULLs
+        array_type = None
     column.pytype = pytype
     column.conv_func = conv_func
+    column.array_type = array_type
+
+
+def col_numeric_type(column: Column) -> Optional[str]:
+    """
+    Returns the python type of min/max/sum over column, or None if the column
+    is not numeric.
+    """
+    sqltype = column.sqltype.upper()
+    if sqltype in INTEGER_TYPES:
+        return "int"
+    elif sqltype in FLOAT_TYPES:
+        return "float"
+    elif sqltype in NUMERIC_TYPES:
+        return "Union[int, float]"
+    return None
@@ -1,4 +1,5 @@
 from pianola.lib.schema.sql.column import Column
+from pianola.lib.schema.sql.foreign_key import ForeignKey
 from pianola.lib.schema.sql.index import Index
 from pianola.lib.schema.sql.query import Query
 from pianola.lib.schema.sql.schema import SqlSchema
@@ -10,21 +10,26 @@ class Column:
     sqltype: str = ""
     pytype: str = ""
     conv_func: Optional[str] = None
+    array_type: Optional[str] = None
     nullable: bool = True
     default_value: Union[str, int, float, None] = None
     primary_key: bool = False
     reference: Optional["Column"] = None
+    # left out of the default select list and loaded on demand
+    deferred: bool = False
+    # an INTEGER PRIMARY KEY, which is another name for the table's rowid
+    rowid_alias: bool = False
 
-    def val_from_sql(self, s: str) -> str:
+    def from_sql_func(self) -> Optional[str]:
         if self.conv_func is None:
+            return None
+        return ("optional_" if self.nullable else "") + self.conv_func + "_from_sql"
+
+    def val_from_sql(self, s: str) -> str:
+        func = self.from_sql_func()
+        if func is None:
             return s
-        return (
-            ("optional_" if self.nullable else "")
-            + self.conv_func
-            + "_from_sql("
-            + s
-            + ")"
-        )
+        return func + "(" + s + ")"
 
     def val_to_sql(self, s: str) -> str:
         if self.conv_func is None:
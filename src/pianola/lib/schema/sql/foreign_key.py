@@ -0,0 +1,15 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from pianola.lib.schema.sql.column import Column
+
+if TYPE_CHECKING:
+    from pianola.lib.schema.sql.table import Table
+
+
+@dataclass
+class ForeignKey:
+    columns: list[Column]
+    # excluded from repr and comparison as tables can reference themselves
+    table: "Table" = field(repr=False, compare=False)
+    references: list[Column]
@@ -1,6 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from pianola.lib.schema.sql.column import Column
+from pianola.lib.schema.sql.foreign_key import ForeignKey
 from pianola.lib.schema.sql.index import Index
 from pianola.lib.stringutils import quote
 
@@ -12,6 +13,7 @@ class Table:
     quoted: bool
     columns: list[Column]
     indices: list[Index]
+    foreign_keys: list[ForeignKey] = field(default_factory=list)
 
     def find_column(self, name: str, quoted: bool) -> Column:
         for column in self.columns:
@@ -10,6 +10,8 @@ from pianola.lib.stringutils import quote
 class ColumnInfo:
     table: Table
     alias: Optional[str]
+    # the column of table which the view column selects
+    column: Optional[Column] = None
 
 
 @dataclass
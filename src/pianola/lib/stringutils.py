@@ -22,11 +22,19 @@ def sql_to_module_name(s: str) -> str:
     return sc.lowercase(s)
 
 
+def sql_to_collection_name(s: str) -> str:
+    return inflector.plural_noun(sql_to_module_name(s))
+
+
 def sql_to_class_name(s: str) -> str:
     if t := inflector.singular_noun(s):
         s = t
     return sc.pascalcase(s)
 
 
+def query_to_result_name(s: str) -> str:
+    return sc.pascalcase(s) + "Row"
+
+
 def sql_to_class_field(s: str) -> str:
     return sc.snakecase(s)
@@ -1,6 +1,11 @@
+import asyncio
+import io
 import os
+import sqlite3
 import sys
 import tempfile
+import threading
+from array import array
 from datetime import date, datetime, time
 from decimal import Decimal
 from pathlib import Path
@@ -8,8 +13,11 @@ from typing import Generator
 
 import pysqlite3
 import pytest
-from pianola.analyse.sqlite import analyse
+from pianola.analyse import analyse
+from pianola.generate.options import Options
 from pianola.generate.sqlite import generate
+from pianola.generate.sqlite.advise import advise
+from pianola.generate.sqlite.audit import audit, format_json, format_text
 
 FILE = Path(os.path.dirname(os.path.realpath(__file__)))
 
@@ -28,7 +36,7 @@ def db() -> Generator[str, None, None]:
 
 
 def test_analyser(db: str):
-    schema = analyse(db)
+    schema = analyse("sqlite://" + db)
     assert schema.dialect == "sqlite"
     assert len(schema.tables) == 13
 
@@ -43,7 +51,7 @@ def test_analyser(db: str):
 
 
 def test_generator(db: str, tmp_path: Path):
-    schema = analyse(db)
+    schema = analyse("sqlite://" + db)
 
     models_dir = tmp_path / "models"
     os.mkdir(models_dir)
@@ -166,3 +174,886 @@ def test_generator(db: str, tmp_path: Path):
     r4.insert(cursor)
     assert r4.a_key1 == 1
     assert r4.a_key2 == 2
+
+
+def test_insert_many(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "insert_many_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "insert_many_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("insert_many_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        rows = [models.ASequenceMulti(a_text=str(i)) for i in range(1000)]
+        rows += [models.ASequenceMulti(a_seq=5000, a_text="explicit")]
+        models.ASequenceMulti.insert_many(cursor, rows, chunk_size=64)
+        assert [r.a_seq for r in rows[:3]] == [1, 2, 3]
+        assert rows[999].a_text == "999"
+        # generated keys are assigned to the objects they were inserted from
+        assert all(
+            models.ASequenceMulti.by_a_seq(cursor, r.a_seq).a_text == r.a_text
+            for r in rows
+        )
+        with pytest.raises(ValueError):
+            models.ASequenceMulti.insert_many(cursor, rows, chunk_size=0)
+
+        res = list(models.ASequenceMulti.get(cursor))
+        assert len(res) == 1001
+        assert models.ASequenceMulti.by_a_seq(cursor, 5000).a_text == "explicit"
+
+
+def test_get_columns(db: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "column_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "column_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("column_models")
+    numpy = pytest.importorskip("numpy")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        cols = models.ASequenceMulti.get_columns(cursor)
+        assert list(cols) == ["a_seq", "a_text"]
+        assert len(cols["a_seq"]) == 0
+        assert cols["a_text"] == []
+
+        rows = [models.ASequenceMulti(a_text=str(i)) for i in range(600)]
+        rows.append(models.ASequenceMulti())
+        models.ASequenceMulti.insert_many(cursor, rows)
+        objs = list(models.ASequenceMulti.get(cursor))
+
+        # integer columns are returned as numpy arrays when it is installed
+        cols = models.ASequenceMulti.get_columns(cursor, batch_size=64)
+        assert isinstance(cols["a_seq"], numpy.ndarray)
+        assert cols["a_seq"].tolist() == [o.a_seq for o in objs]
+        assert cols["a_text"] == [o.a_text for o in objs]
+        assert len(cols["a_text"]) == len(objs) == 601
+
+        # and as arrays when it isn't
+        monkeypatch.setattr(models.utils, "numpy", None)
+        cols = models.ASequenceMulti.get_columns(cursor, ["a_text", "a_seq"])
+        assert list(cols) == ["a_text", "a_seq"]
+        assert isinstance(cols["a_seq"], array)
+        assert cols["a_seq"].tolist() == [o.a_seq for o in objs]
+        assert cols["a_text"] == [o.a_text for o in objs]
+        assert len(models.ASequenceMulti.get_columns(cursor, [])) == 0
+
+
+def test_generator_slots(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "slots_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "slots_models", [], Options(slots=True))
+    sys.path.append(str(tmp_path))
+    models = __import__("slots_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        r1 = models.APrimaryMulti(a_text="abc")
+        assert not hasattr(r1, "__dict__")
+        with pytest.raises(ValueError):
+            r1.a_key
+        r1.insert(cursor)
+
+        s1 = models.APrimaryMulti.by_a_key(cursor, r1.a_key)
+        assert s1.a_text == "abc"
+
+
+def test_index_queries(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "index_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "index_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("index_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        rows = [models.APrimaryComposite(i // 7, i % 7) for i in range(100)]
+        models.APrimaryComposite.insert_many(cursor, rows)
+
+        keys = []
+        after = None
+        while page := models.APrimaryComposite.page_by_a_key1_a_key2(cursor, after, 9):
+            keys += [(r.a_key1, r.a_key2) for r in page]
+            after = keys[-1]
+        assert keys == [(i // 7, i % 7) for i in range(100)]
+
+        # nullable keys can't be continued after a NULL, and a non unique key
+        # on a table without a primary key has no tie-breaker
+        assert not hasattr(models.AUniqueIndex, "page_by_a_key")
+        assert not hasattr(models.AIndex, "page_by_a_key")
+        assert hasattr(models.ASequence, "page_by_a_seq")
+
+        res = models.APrimaryComposite.by_a_key1_a_key2_many(
+            cursor, [(0, 1), (2, 3), (99, 99)]
+        )
+        assert sorted(res) == [(0, 1), (2, 3)]
+        assert res[(2, 3)].a_key2 == 3
+
+
+def test_rowid_alias(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE TABLE a_big (a_id BIGINT PRIMARY KEY, a_tag TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX a_big_tag ON a_big (a_tag)")
+    schema = analyse("sqlite://" + db)
+
+    # only a column declared exactly INTEGER aliases the rowid
+    assert schema.find_table("a_sequence", False).columns[0].rowid_alias
+    table = schema.find_table("a_big", False)
+    assert not table.find_column("a_id", False).rowid_alias
+
+    models_dir = tmp_path / "rowid_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "rowid_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("rowid_models")
+
+    # a BIGINT PRIMARY KEY may be NULL, so it can't break ties between pages
+    assert not hasattr(models.ABig, "page_by_a_tag")
+    assert not hasattr(models.ABig, "page_by_a_id")
+
+
+def test_relations(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "relation_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "relation_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("relation_models")
+    from relation_models.utils import prefetch
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        parents = [models.APrimaryComposite(i, i + 1) for i in range(3)]
+        models.APrimaryComposite.insert_many(cursor, parents)
+        children = [models.AForeignKeyComposite(i % 3, i % 3 + 1) for i in range(7)]
+        children += [models.AForeignKeyComposite(None, None)]
+        models.AForeignKeyComposite.insert_many(cursor, children)
+
+        assert children[1].fetch_a_primary_composite(cursor).a_key1 == 1
+        assert children[7].fetch_a_primary_composite(cursor) is None
+        assert len(parents[0].fetch_a_foreign_key_composites(cursor)) == 3
+
+        children = list(models.AForeignKeyComposite.get(cursor))
+        prefetch(cursor, children, "a_primary_composite")
+        cursor.execute("DELETE FROM a_primary_composite")
+        assert children[2].fetch_a_primary_composite(cursor).a_key2 == 3
+        assert children[7].fetch_a_primary_composite(cursor) is None
+
+
+def test_generator_aio(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "aio_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "aio_models", [], Options(aio=True))
+    sys.path.append(str(tmp_path))
+    models = __import__("aio_models")
+    from aio_models.aio import AsyncDatabase
+    from aio_models.aio import a_sequence_multi
+
+    async def run():
+        async with AsyncDatabase(db, max_workers=2) as conn:
+            rows = [models.ASequenceMulti(a_text=str(i)) for i in range(300)]
+            await a_sequence_multi.insert_many(conn, rows)
+
+            res = await asyncio.gather(
+                *[a_sequence_multi.by_a_seq(conn, i) for i in range(1, 11)]
+            )
+            assert [r.a_text for r in res] == [str(i) for i in range(10)]
+
+            count = 0
+            async for _ in a_sequence_multi.get(conn, batch_size=64):
+                count += 1
+            assert count == 300
+
+    asyncio.run(run())
+
+
+def test_upsert(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "upsert_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "upsert_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("upsert_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        r1 = models.APrimaryMulti(a_key=1, a_text="a")
+        r1.upsert_on_a_key(cursor)
+        r2 = models.APrimaryMulti(a_key=1, a_text="b")
+        r2.upsert_on_a_key(cursor)
+        r3 = models.APrimaryMulti(a_key=1)
+        r3.upsert_on_a_key(cursor)
+        assert r3.a_text == "b"
+
+        rows = [models.APrimaryMulti(a_key=i, a_text=str(i)) for i in range(5)]
+        models.APrimaryMulti.upsert_many_on_a_key(cursor, rows)
+        rows = [models.ASequenceMulti(a_text=str(i)) for i in range(3)]
+        models.ASequenceMulti.upsert_many_on_a_seq(cursor, rows)
+        assert [r.a_seq for r in rows] == [1, 2, 3]
+
+        res = list(models.APrimaryMulti.get(cursor))
+        assert [(r.a_key, r.a_text) for r in res] == [(i, str(i)) for i in range(5)]
+
+        # the conflict target isn't rewritten
+        stmt = models.a_primary_multi._insert_stmt(3, True, 1)
+        assert "DO UPDATE SET a_text = excluded.a_text RETURNING" in stmt
+        assert "a_key = excluded" not in stmt
+
+        # with nothing else to update the row is still returned
+        models.AUniqueIndex(a_key=7).upsert_on_a_key(cursor)
+        r4 = models.AUniqueIndex(a_key=7)
+        r4.upsert_on_a_key(cursor)
+        assert r4.a_key == 7
+        assert "DO UPDATE SET a_key = a_key" in models.a_unique_index._insert_stmt(
+            1, True, 1
+        )
+
+
+def test_dirty_update(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "dirty_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "dirty_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("dirty_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        models.APrimaryMulti(a_key=1, a_text="a").insert(cursor)
+        (r,) = models.APrimaryMulti.get(cursor)
+        cursor.execute("UPDATE a_primary_multi SET a_text = 'b'")
+
+        # nothing modified, so nothing is written
+        r.update(cursor)
+        assert r.a_text == "a"
+        (r,) = models.APrimaryMulti.get(cursor)
+        assert r.a_text == "b"
+
+        r.a_text = "c"
+        r.update(cursor)
+        (r,) = models.APrimaryMulti.get(cursor)
+        assert r.a_text == "c"
+
+
+def test_bulk_update_delete(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "bulk_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "bulk_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("bulk_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+
+        rows = [models.APrimaryMulti(a_key=i, a_text=str(i)) for i in range(2000)]
+        models.APrimaryMulti.insert_many(cursor, rows)
+        for r in rows[:1500]:
+            r.a_text = "x"
+        assert models.APrimaryMulti.update_many(cursor, rows) == 1500
+        assert models.APrimaryMulti.update_many(cursor, rows) == 0
+        assert models.APrimaryMulti.by_a_key(cursor, 1499).a_text == "x"
+        assert models.APrimaryMulti.by_a_key(cursor, 1500).a_text == "1500"
+
+        keys = [(i,) for i in range(0, 2000, 2)]
+        assert models.APrimaryMulti.delete_many(cursor, keys) == 1000
+        assert models.APrimaryMulti.delete_where_a_key(cursor, 1) == 1
+        assert models.APrimaryMulti.delete_where_a_key(cursor, 1) == 0
+        assert len(list(models.APrimaryMulti.get(cursor))) == 999
+
+        models.APrimaryComposite.insert_many(
+            cursor,
+            [models.APrimaryComposite(a_key1=i, a_key2=-i) for i in range(10)],
+        )
+        keys = [(i, -i) for i in range(5)] + [(9, 9)]
+        assert models.APrimaryComposite.delete_many(cursor, keys) == 5
+
+
+def test_sqlite_converters(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE a_reading (a_ts DATETIME NOT NULL, a_value DECIMAL)")
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "converter_models"
+    os.mkdir(models_dir)
+
+    options = Options(converters="sqlite", converter_cache=16)
+    generate(schema, models_dir, "converter_models", [], options)
+    # the schema can still be generated with the default converters
+    table = schema.find_table("a_reading", False)
+    assert table.find_column("a_ts", False).conv_func is not None
+    sys.path.append(str(tmp_path))
+    models = __import__("converter_models")
+    models.converters.register_converters(pysqlite3)
+
+    with pysqlite3.connect(db, detect_types=pysqlite3.PARSE_DECLTYPES) as conn:
+        cursor = conn.cursor()
+        now = datetime.now()
+        models.AReading(a_ts=now, a_value=Decimal("0.1")).insert(cursor)
+        models.AReading(a_ts=now, a_value=None).insert(cursor)
+        rows = list(models.AReading.get(cursor))
+        assert [(r.a_ts, r.a_value) for r in rows] == [
+            (now, Decimal("0.1")),
+            (now, None),
+        ]
+
+    # decimals keep more digits than a REAL, with either kind of converter
+    precise = [Decimal("1.000000000000000000001"), Decimal("-12345678901234567.890")]
+    plain_dir = tmp_path / "plain_converter_models"
+    os.mkdir(plain_dir)
+    generate(schema, plain_dir, "plain_converter_models")
+    plain = __import__("plain_converter_models")
+    for module, detect_types in [(plain, 0), (models, pysqlite3.PARSE_DECLTYPES)]:
+        with pysqlite3.connect(db, detect_types=detect_types) as conn:
+            cursor = conn.cursor()
+            conn.execute("DELETE FROM a_reading")
+            for value in precise:
+                module.AReading(a_ts=now, a_value=value).insert(cursor)
+            values = [r.a_value for r in module.AReading.get(cursor)]
+            assert [str(v) for v in values] == [str(v) for v in precise]
+
+
+def test_deferred(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE TABLE a_document (a_id INTEGER NOT NULL PRIMARY KEY, a_body BLOB)"
+        )
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "deferred_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "deferred_models", [], Options(defer_blobs=True))
+    assert not any(c.deferred for c in schema.find_table("a_document", False).columns)
+    sys.path.append(str(tmp_path))
+    models = __import__("deferred_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+        docs = [models.ADocument(a_body=bytes([i]) * 10) for i in range(5)]
+        models.ADocument.insert_many(cursor, docs)
+
+        docs = list(models.ADocument.get(cursor))
+        assert all(isinstance(d._a_body, models.utils._UNSET) for d in docs)
+        assert docs[0].a_body == b"\x00" * 10
+
+        docs[1].a_body = b"changed"
+        models.ADocument.load_deferred(cursor, docs)
+        assert [d.a_body for d in docs[1:]] == [b"changed"] + [
+            bytes([i]) * 10 for i in range(2, 5)
+        ]
+
+        # deferred columns aren't read back, unset ones are loaded on access
+        assert "a_body" not in models.a_document._insert_stmt(0)
+        doc = models.ADocument()
+        doc.insert(cursor)
+        assert isinstance(doc._a_body, models.utils._UNSET)
+        assert doc.a_body is None
+
+    # async models load deferred fields explicitly, on a worker thread
+    aio_dir = tmp_path / "deferred_aio_models"
+    os.mkdir(aio_dir)
+    options = Options(defer_blobs=True, aio=True)
+    generate(schema, aio_dir, "deferred_aio_models", [], options)
+    from deferred_aio_models.aio import AsyncDatabase, a_document
+
+    async def run():
+        async with AsyncDatabase(db) as conn:
+            docs = [d async for d in a_document.get(conn)]
+            with pytest.raises(ValueError):
+                docs[2].a_body
+            await a_document.load_deferred(conn, docs)
+            assert docs[2].a_body == b"\x02" * 10
+
+    asyncio.run(run())
+
+    # the sync models of an aio package still load deferred fields on access
+    aio_models = __import__("deferred_aio_models")
+    with pysqlite3.connect(db) as conn:
+        docs = list(aio_models.ADocument.get(conn.cursor()))
+        assert docs[2].a_body == b"\x02" * 10
+
+
+def test_blob_streaming(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE TABLE a_attachment (a_id INTEGER NOT NULL PRIMARY KEY, a_data BLOB)"
+        )
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "blob_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "blob_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("blob_models")
+
+    data = bytes(range(256)) * 1000
+    # sqlite3 has Connection.blobopen from python 3.11, pysqlite3 does not
+    for module in [sqlite3, pysqlite3]:
+        with module.connect(db) as conn:
+            cursor = conn.cursor()
+            a = models.AAttachment(a_data=b"")
+            a.insert(cursor)
+            a.write_a_data_from(conn, io.BytesIO(data), len(data), chunk_size=4096)
+
+            b = models.AAttachment.by_a_id(cursor, a.a_id)
+            assert b.a_data == data
+            with b.open_a_data_blob(conn) as blob:
+                assert len(blob) == len(data)
+                blob.seek(1000)
+                assert blob.read(10) == data[1000:1010]
+
+            # the fallback buffers contiguous writes until read or moved
+            with models.utils.ChunkedBlob(
+                conn, "a_attachment", "a_data", a.a_id, False
+            ) as blob:
+                blob.write(b"ab")
+                blob.write(b"cd")
+                blob.seek(10)
+                blob.write(b"ef")
+                blob.seek(0)
+                assert blob.read(4) == b"abcd"
+                assert blob.read(2) == data[4:6]
+            assert models.AAttachment.by_a_id(cursor, a.a_id).a_data == (
+                b"abcd" + data[4:10] + b"ef" + data[12:]
+            )
+
+    # a BIGINT PRIMARY KEY isn't the rowid, which has to be looked up
+    with pysqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE a_big_file (a_id BIGINT PRIMARY KEY, a_data BLOB)")
+    schema = analyse("sqlite://" + db)
+    models_dir = tmp_path / "big_blob_models"
+    os.mkdir(models_dir)
+    generate(schema, models_dir, "big_blob_models")
+    models = __import__("big_blob_models")
+
+    for module in [sqlite3, pysqlite3]:
+        with module.connect(db) as conn:
+            cursor = conn.cursor()
+            conn.execute("DELETE FROM a_big_file")
+            models.ABigFile(a_id=100, a_data=b"100").insert(cursor)
+            one = models.ABigFile(a_id=1, a_data=b"")
+            one.insert(cursor)
+            one.write_a_data_from(conn, io.BytesIO(b"one"), 3)
+            assert models.ABigFile.by_a_id(cursor, 1).a_data == b"one"
+            assert models.ABigFile.by_a_id(cursor, 100).a_data == b"100"
+
+
+def test_identity_map(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "identity_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "identity_models", [], Options(identity_map=True))
+    sys.path.append(str(tmp_path))
+    models = __import__("identity_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+        for i in range(3):
+            models.APrimaryMulti(a_key=i, a_text=str(i)).insert(cursor)
+
+        # outside of a unit of work every lookup queries the database
+        assert models.APrimaryMulti.by_a_key(
+            cursor, 0
+        ) is not models.APrimaryMulti.by_a_key(cursor, 0)
+
+        with models.utils.IdentityMap(maxsize=2) as imap:
+            r0 = models.APrimaryMulti.by_a_key(cursor, 0)
+            assert models.APrimaryMulti.by_a_key(cursor, 0) is r0
+            many = models.APrimaryMulti.by_a_key_many(cursor, [(0,), (1,), (2,)])
+            assert many[(0,)] is r0
+            assert imap.stats() == {"size": 2, "hits": 2, "misses": 3, "evictions": 1}
+
+            many[(2,)].delete(cursor)
+            assert models.APrimaryMulti.by_a_key(cursor, 2) is None
+
+        assert imap.stats()["size"] == 0
+        assert models.utils.IDENTITY_MAP.get() is None
+        conn.commit()
+
+
+def test_identity_map_aio(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "identity_aio_models"
+    os.mkdir(models_dir)
+
+    options = Options(identity_map=True, aio=True)
+    generate(schema, models_dir, "identity_aio_models", [], options)
+    sys.path.append(str(tmp_path))
+    models = __import__("identity_aio_models")
+    from identity_aio_models.aio import AsyncDatabase, a_primary_multi
+
+    async def run():
+        async with AsyncDatabase(db, max_workers=2) as conn:
+            await a_primary_multi.insert(
+                conn, models.APrimaryMulti(a_key=1, a_text="1")
+            )
+
+            # the executor threads see the identity map of the calling task
+            with models.utils.IdentityMap() as imap:
+                r1 = await a_primary_multi.by_a_key(conn, 1)
+                assert await a_primary_multi.by_a_key(conn, 1) is r1
+                many = await a_primary_multi.by_a_key_many(conn, [(1,)])
+                assert many[(1,)] is r1
+                assert imap.stats()["hits"] == 2
+
+    asyncio.run(run())
+
+
+def test_result_cache(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "cache_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "cache_models", [], Options(result_cache=True))
+    sys.path.append(str(tmp_path))
+    models = __import__("cache_models")
+
+    cache = models.utils.ResultCache(max_entries=8)
+    models.utils.set_result_cache(cache)
+    try:
+        with pysqlite3.connect(db) as conn, pysqlite3.connect(db) as other:
+            cursor = conn.cursor()
+            models.APrimaryMulti(a_key=1, a_text="a").insert(cursor)
+            conn.commit()
+
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "a"
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "a"
+            assert cache.hits == 1
+
+            # written through the generated methods
+            models.APrimaryMulti(a_key=2, a_text="b").insert(cursor)
+            conn.commit()
+            assert len(list(models.APrimaryMulti.get(cursor))) == 2
+
+            # written by another connection
+            other.execute("UPDATE a_primary_multi SET a_text = 'c'")
+            other.commit()
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "c"
+            assert cache.hits == 1
+
+            # uncommitted writes are neither cached for other connections nor
+            # kept once rolled back
+            other_cursor = other.cursor()
+            row = models.APrimaryMulti.by_a_key(cursor, 1)
+            row.a_text = "uncommitted"
+            row.update(cursor)
+            assert conn.in_transaction
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "uncommitted"
+            assert models.APrimaryMulti.by_a_key(other_cursor, 1).a_text == "c"
+            conn.rollback()
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "c"
+            assert models.APrimaryMulti.by_a_key(other_cursor, 1).a_text == "c"
+
+            # committed writes are seen by both connections
+            row.a_text = "committed"
+            row.update(cursor)
+            assert models.APrimaryMulti.by_a_key(other_cursor, 1).a_text == "c"
+            conn.commit()
+            assert models.APrimaryMulti.by_a_key(cursor, 1).a_text == "committed"
+            assert models.APrimaryMulti.by_a_key(other_cursor, 1).a_text == "committed"
+    finally:
+        models.utils.set_result_cache(None)
+
+
+def test_aggregates(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "aggregate_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "aggregate_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("aggregate_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+        assert models.AIndex.count(cursor) == 0
+        assert models.AIndex.max_a_key(cursor) is None
+        assert models.AIndex.sum_a_key(cursor) == 0
+
+        models.AIndex.insert_many(
+            cursor, [models.AIndex(a_key=i % 3) for i in range(10)]
+        )
+        assert models.AIndex.count(cursor) == 10
+        assert models.AIndex.count_by_a_key(cursor, 1) == 3
+        assert models.AIndex.exists_by_a_key(cursor, 2)
+        assert not models.AIndex.exists_by_a_key(cursor, 3)
+        assert models.AIndex.min_a_key(cursor) == 0
+        assert models.AIndex.max_a_key(cursor) == 2
+        assert models.AIndex.sum_a_key(cursor) == 9
+
+
+def test_named_queries(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    queries_dir = tmp_path / "queries"
+    os.mkdir(queries_dir)
+    with open(queries_dir / "multi.sql", "w") as f:
+        f.write(
+            "-- name: text_of_key :one\n"
+            "SELECT a_text FROM a_primary_multi WHERE a_key = {a_key int};\n"
+            "-- name: multis_after\n"
+            "SELECT a_key, a_text -- the whole row\n"
+            "FROM a_primary_multi WHERE a_key > {a_key int} AND a_text != '--';\n"
+        )
+
+    models_dir = tmp_path / "query_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "query_models", [], Options(queries=queries_dir))
+    sys.path.append(str(tmp_path))
+    models = __import__("query_models")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+        for i in range(3):
+            models.APrimaryMulti(a_key=i, a_text=str(i)).insert(cursor)
+
+        assert models.APrimaryMulti.text_of_key(cursor, 1) == ("1",)
+        assert models.APrimaryMulti.text_of_key(cursor, 1).a_text == "1"
+        res = list(models.APrimaryMulti.multis_after(cursor, 0))
+        assert [(r.a_key, r.a_text) for r in res] == [(1, "1"), (2, "2")]
+
+    with open(queries_dir / "bad.sql", "w") as f:
+        f.write("-- name: bad\nSELECT a_nothing FROM a_primary_multi;\n")
+    with pytest.raises(ValueError):
+        generate(schema, models_dir, "query_models", [], Options(queries=queries_dir))
+
+    # a query can't replace a generated method
+    with open(queries_dir / "bad.sql", "w") as f:
+        f.write("-- name: count_by_a_key :one\nSELECT a_key FROM a_primary_multi;\n")
+    with pytest.raises(ValueError, match="count_by_a_key"):
+        generate(schema, models_dir, "query_models", [], Options(queries=queries_dir))
+
+
+def test_audit(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE VIEW a_multi_view AS SELECT a_key, a_text FROM a_primary_multi"
+        )
+    schema = analyse("sqlite://" + db)
+
+    queries_dir = tmp_path / "audit_queries"
+    os.mkdir(queries_dir)
+    with open(queries_dir / "multi.sql", "w") as f:
+        f.write(
+            "-- name: by_text\n"
+            "SELECT a_key, a_text FROM a_primary_multi WHERE a_text = {a_text str};\n"
+        )
+
+    results = audit(schema, Path(db), [], Options(queries=queries_dir))
+    by_method = {(r.table, r.method): r for r in results if r.keyed}
+    assert not any(r.error for r in results)
+    assert by_method[("a_primary_multi", "by_text")].failed
+    assert not by_method[("a_primary_multi", "by_a_key")].failed
+    assert not by_method[("a_primary_multi", "delete_many")].failed
+    # every statement written into the models is audited
+    methods = {(r.table, r.method) for r in results}
+    assert ("a_primary_multi", "upsert_on_a_key") in methods
+    assert ("a_primary_multi", "sum_a_key") in methods
+
+    # view accessors are audited too, lookups are pushed down to the index
+    assert by_method[("a_multi_view", "by_a_key")].scans == []
+    assert not by_method[("a_multi_view", "by_a_key_many")].failed
+    get = next(r for r in results if (r.table, r.method) == ("a_multi_view", "get"))
+    assert get.scans == ["SCAN a_primary_multi"]
+    assert "WARN a_multi_view.get" in format_text(results)
+
+    assert "FAIL a_primary_multi.by_text" in format_text(results)
+    assert "a_primary_multi" in format_json(results)
+
+
+def test_advise(db: str):
+    with pysqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE a_tag (a_name TEXT, a_kind TEXT)")
+        conn.execute("CREATE INDEX a_tag_name ON a_tag (a_name)")
+        conn.execute("CREATE INDEX a_tag_name_kind ON a_tag (a_name, a_kind)")
+        conn.executemany(
+            "INSERT INTO a_foreign_key (a_key) VALUES (?)", [(i,) for i in range(100)]
+        )
+    schema = analyse("sqlite://" + db)
+
+    advice = advise(schema, Path(db))
+    proposal = next(p for p in advice.proposals if p.table == "a_foreign_key")
+    assert proposal.columns == ["a_key"]
+    assert proposal.rows == 100
+    assert proposal.btrees == (1, 2)
+    assert proposal.fixed == [
+        "a_primary.fetch_a_foreign_keys",
+        "a_primary.prefetch_a_foreign_keys",
+    ]
+
+    assert [(r.index, r.covered_by) for r in advice.redundant] == [
+        ("a_tag_name", "a_tag_name_kind")
+    ]
+
+    # the database itself is neither indexed nor analysed
+    with pysqlite3.connect(db) as conn:
+        names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master")]
+        assert "sqlite_stat1" not in names
+        assert not any(n.startswith("ix_") for n in names)
+
+
+def test_views(db: str, tmp_path: Path):
+    with pysqlite3.connect(db) as conn:
+        conn.executescript(
+            "CREATE TABLE a_person (a_id INTEGER PRIMARY KEY, a_name TEXT, "
+            "a_city TEXT NOT NULL);"
+            "CREATE INDEX a_person_city ON a_person (a_city);"
+            "CREATE VIEW a_person_view AS "
+            "SELECT a_id AS a_person_id, a_name, a_city FROM a_person;"
+        )
+        conn.executemany(
+            "INSERT INTO a_person VALUES (?, ?, ?)",
+            [(i, f"name{i}", f"city{i % 3}") for i in range(10)],
+        )
+    schema = analyse("sqlite://" + db)
+
+    view = schema.views[-1]
+    assert [c.sqlname for c in view.columns] == ["a_person_id", "a_name", "a_city"]
+    assert [i.column.sqlname for i in view.column_info] == ["a_id", "a_name", "a_city"]
+    assert all(i.table.sqlname == "a_person" for i in view.column_info)
+
+    models_dir = tmp_path / "view_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "view_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("view_models")
+
+    # only indexed columns get lookups
+    assert not hasattr(models.APersonView, "by_a_name")
+    assert hasattr(models.APersonView, "page_by_a_person_id")
+
+    with pysqlite3.connect(db) as conn:
+        cursor = conn.cursor()
+        assert len(list(models.APersonView.get(cursor, batch_size=3))) == 10
+        assert models.APersonView.by_a_person_id(cursor, 4).a_name == "name4"
+        people = list(models.APersonView.by_a_city(cursor, "city1"))
+        assert [p.a_person_id for p in people] == [1, 4, 7]
+
+        res = models.APersonView.by_a_city_many(cursor, [("city0",), ("city2",)])
+        assert {k: len(v) for k, v in res.items()} == {("city0",): 4, ("city2",): 3}
+
+        page = models.APersonView.page_by_a_city(cursor, limit=4)
+        after = (page[-1].a_city, page[-1].a_person_id)
+        page = models.APersonView.page_by_a_city(cursor, after, limit=4)
+        assert [(p.a_city, p.a_person_id) for p in page] == [
+            ("city1", 1),
+            ("city1", 4),
+            ("city1", 7),
+            ("city2", 2),
+        ]
+
+
+def test_transactions(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "transaction_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "transaction_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("transaction_models")
+    utils = models.utils
+
+    conn = utils.connect(db, isolation_level=None)
+    cursor = conn.cursor()
+    with utils.transaction(conn):
+        models.APrimaryMulti(a_key=1, a_text="1").insert(cursor)
+        # a nested transaction is a savepoint, rolled back on its own
+        with pytest.raises(ValueError):
+            with utils.transaction(conn):
+                models.APrimaryMulti(a_key=2, a_text="2").insert(cursor)
+                raise ValueError()
+    assert not conn.in_transaction
+    assert models.APrimaryMulti.count(cursor) == 1
+
+    with utils.batch_commit(conn, every=3) as batch:
+        for i in range(10, 20):
+            models.APrimaryMulti(a_key=i, a_text=str(i)).insert(cursor)
+            batch.add()
+    assert batch.commits == 4
+    assert models.APrimaryMulti.count(cursor) == 11
+
+    # only the rows since the last commit are lost
+    with pytest.raises(ValueError):
+        with utils.batch_commit(conn, every=3) as batch:
+            for i in range(20, 25):
+                models.APrimaryMulti(a_key=i, a_text=str(i)).insert(cursor)
+                batch.add()
+            raise ValueError()
+    assert models.APrimaryMulti.count(cursor) == 14
+    conn.close()
+
+
+def test_connection_pool(db: str, tmp_path: Path):
+    schema = analyse("sqlite://" + db)
+
+    models_dir = tmp_path / "pool_models"
+    os.mkdir(models_dir)
+
+    generate(schema, models_dir, "pool_models")
+    sys.path.append(str(tmp_path))
+    models = __import__("pool_models")
+    utils = models.utils
+
+    # the default profile leaves the journal mode of the database alone
+    conn = utils.connect(db)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
+
+    with utils.ConnectionPool(db) as pool:
+        models.APrimaryMulti(a_key=1, a_text="1").insert(pool.cursor())
+        pool.connection().commit()
+
+        counts = []
+        thread = threading.Thread(
+            target=lambda: counts.append(models.APrimaryMulti.count(pool.cursor()))
+        )
+        thread.start()
+        thread.join()
+        assert counts == [1]
+        # the connection of the exited thread has been released
+        assert len(pool.connections) == 1
+        assert pool.connection() is pool.connections[0]